@@ -54,10 +54,16 @@ class Config(object):
         
         # these are to be read by main
         self._state_filename = None
+        self._filter_design_cache_filename = None
+        self._filter_calibration_filename = None
+        self._telemetry_snapshot = None  # (filename, interval)
         self._service_makers = []
+        self._service_specs = []  # parameters of _service_makers, for shinysdr.i.dsp_process
         
         # private: config state
         self.__server_audio = None
+        self.__receiver_budget = None
+        self.__recording = None
         
         # private: meta
         self.__waiting = []
@@ -72,6 +78,13 @@ class Config(object):
             from shinysdr.plugins.rebooter import Rebooter
             self.devices.add('rebooter', Rebooter(self.reactor))
         
+        for key in self.devices._channelizers:
+            if key not in self.devices._values:
+                raise ConfigException('config.devices.set_channelizer: no device named %r' % (key,))
+        for key in self.devices._shared_decimations:
+            if key not in self.devices._values:
+                raise ConfigException('config.devices.set_shared_decimation: no device named %r' % (key,))
+        
         self.__finished = True
         if len(self._service_makers) == 0:
             warnings.warn('No network service defined!')
@@ -81,7 +94,11 @@ class Config(object):
         return AppRoot(
             devices=self.devices._values,
             audio_config=self.__server_audio,
-            features=self.features._get_all())
+            features=self.features._get_all(),
+            channelizers=dict(self.devices._channelizers),
+            shared_decimations=dict(self.devices._shared_decimations),
+            receiver_budget=self.__receiver_budget,
+            recording=self.__recording)
     
     def _not_finished(self):
         if self.__finished:
@@ -97,7 +114,37 @@ class Config(object):
         if self._state_filename is not None:
             raise ConfigException('config.persist_to_file has already been done once')
         self._state_filename = str(filename)
+    
+    def set_filter_design_cache(self, filename):
+        """
+        Save computed filter designs in the given file so that they need not be recomputed at the next startup.
+        """
+        self._not_finished()
+        if self._filter_design_cache_filename is not None:
+            raise ConfigException('config.set_filter_design_cache has already been done once')
+        self._filter_design_cache_filename = str(filename)
+    
+    def set_filter_calibration(self, filename):
+        """
+        Use the relative costs of filter blocks measured by filter_calibration.py when designing filters.
+        """
+        self._not_finished()
+        if self._filter_calibration_filename is not None:
+            raise ConfigException('config.set_filter_calibration has already been done once')
+        self._filter_calibration_filename = str(filename)
 
+    def set_telemetry_snapshot(self, filename, interval=60):
+        """
+        Save recently received telemetry (such as APRS stations and aircraft) in the given file every interval seconds and at shutdown, and restore it at startup.
+        """
+        self._not_finished()
+        if self._telemetry_snapshot is not None:
+            raise ConfigException('config.set_telemetry_snapshot has already been done once')
+        interval = float(interval)
+        if interval <= 0:
+            raise ConfigException('config.set_telemetry_snapshot: interval must be positive, not %r' % (interval,))
+        self._telemetry_snapshot = (str(filename), interval)
+    
     def serve_web(self, http_endpoint, ws_endpoint, root_cap=None, title=u'ShinySDR'):
         self._not_finished()
         # TODO: See if we're reinventing bits of Twisted service stuff here
@@ -122,6 +169,12 @@ class Config(object):
                 title=title)
         
         self._service_makers.append(make_service)
+        self._service_specs.append((u'web', {
+            u'http_endpoint': http_endpoint,
+            u'ws_endpoint': ws_endpoint,
+            u'root_cap': root_cap,
+            u'title': title,
+        }))
 
     def serve_ghpsdr(self):
         self._not_finished()
@@ -132,6 +185,7 @@ class Config(object):
             return lazy_ghpsdr.DspserverService(self.reactor, app.get_receive_flowgraph(), 'tcp:8000')
         
         self._service_makers.append(make_service)
+        self._service_specs.append((u'ghpsdr', {}))
     
     def set_server_audio_allowed(self, allowed, device_name='', sample_rate=44100):
         """
@@ -144,6 +198,38 @@ class Config(object):
         else:
             self.__server_audio = None
     
+    def set_receiver_budget(self, budget):
+        """
+        Set the limit on how many receivers may be active at once.
+        """
+        self._not_finished()
+        budget = float(budget)
+        if budget <= 0:
+            raise ConfigException('config.set_receiver_budget: budget must be positive, not %r' % (budget,))
+        self.__receiver_budget = budget
+    
+    def set_audio_recording(self, directory, file_format='wav', rotate_interval=3600, min_free_space=1e9):
+        """
+        Allow receivers' audio to be recorded to files in the given directory.
+        """
+        self._not_finished()
+        from shinysdr.i.recording import RECORDING_FORMATS, RecordingSettings
+        if self.__recording is not None:
+            raise ConfigException('config.set_audio_recording has already been done once')
+        if not os.path.isdir(directory):
+            raise ConfigException('config.set_audio_recording: %r is not a directory' % (directory,))
+        if file_format not in RECORDING_FORMATS:
+            raise ConfigException('config.set_audio_recording: file_format must be one of %r, not %r' % (RECORDING_FORMATS, file_format))
+        rotate_interval = float(rotate_interval)
+        if rotate_interval <= 0:
+            raise ConfigException('config.set_audio_recording: rotate_interval must be positive, not %r' % (rotate_interval,))
+        self.__recording = RecordingSettings(
+            directory=os.path.abspath(directory),
+            file_format=file_format,
+            rotate_interval=rotate_interval,
+            min_free_bytes=float(min_free_space),
+            queue_length=1000)
+    
     def set_stereo(self, value):
         """
         Deprecated alias for self.features.(en|dis)able('stereo').
@@ -174,11 +260,36 @@ class _ConfigDict(object):
 
 
 class _ConfigDevices(_ConfigDict):
+    def __init__(self, config):
+        super(_ConfigDevices, self).__init__(config)
+        self._channelizers = {}
+        self._shared_decimations = {}
+    
     def add(self, key, *devices):
         if len(devices) <= 0:
             raise ConfigException('config.devices: no device(s) specified')
         from shinysdr.devices import merge_devices
         super(_ConfigDevices, self).add(key, merge_devices(devices))
+    
+    def set_channelizer(self, key, channels=16):
+        self._config._not_finished()
+        channels = int(channels)
+        if channels < 2 or channels % 2 != 0:
+            raise ConfigException('config.devices.set_channelizer: channels must be an even number, at least 2, not %r' % (channels,))
+        key = unicode(key)
+        if key in self._shared_decimations:
+            raise ConfigException('config.devices.set_channelizer: %r already has shared decimation' % (key,))
+        self._channelizers[key] = channels
+    
+    def set_shared_decimation(self, key, decimation=20):
+        self._config._not_finished()
+        decimation = int(decimation)
+        if decimation < 2:
+            raise ConfigException('config.devices.set_shared_decimation: decimation must be at least 2, not %r' % (decimation,))
+        key = unicode(key)
+        if key in self._channelizers:
+            raise ConfigException('config.devices.set_shared_decimation: %r already has a channelizer' % (key,))
+        self._shared_decimations[key] = decimation
 
 
 class _ConfigDbs(object):
@@ -189,6 +300,10 @@ class _ConfigDbs(object):
         self._config = config
         self.__reactor = reactor
         
+        # paths given, for shinysdr.i.dsp_process
+        self._directory_paths = []
+        self._writable_path = None
+        
         self.__read_only_databases, diagnostics = databases_from_directory(self.__reactor,
             os.path.join(os.path.dirname(__file__), 'data/dbs/'))
         if len(diagnostics) > 0:
@@ -199,6 +314,7 @@ class _ConfigDbs(object):
         path = str(path)
         dbs, path_diagnostics = databases_from_directory(self.__reactor, path)
         self.__read_only_databases.update(dbs)
+        self._directory_paths.append(os.path.abspath(path))
         for d in path_diagnostics:
             log.msg('%s: %s' % d)
 
@@ -208,6 +324,7 @@ class _ConfigDbs(object):
         if self.__writable_db is not None:
             raise ConfigException('Multiple writable databases are not yet supported.')
         self.__writable_db, diagnostics = database_from_csv(self.__reactor, path, writable=True)
+        self._writable_path = os.path.abspath(path)
         for d in diagnostics:
             log.msg('%s: %s' % (path, d))
     
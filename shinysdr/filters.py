@@ -21,9 +21,13 @@ GNU Radio blocks which automatically compute appropriate filter designs.
 
 from __future__ import absolute_import, division
 
+from collections import OrderedDict
 from fractions import gcd
+import json
 from math import pi, sin, cos
+import os
 
+from gnuradio import blocks
 from gnuradio import gr
 from gnuradio.fft import window
 from gnuradio import filter as grfilter  # don't shadow builtin
@@ -31,13 +35,170 @@ from gnuradio.filter import pfb
 from gnuradio.filter import firdes
 from gnuradio.filter import rational_resampler
 
+from twisted.python import log
+
 from shinysdr.i.math import factorize, small_factor_at_least
 
 
 __all__ = []  # appended later
 
-# Use rational_resampler_ccf rather than arb_resampler_ccf. This is less efficient, but avoids the bug <http://gnuradio.org/redmine/issues/713> where the latter block will hang the flowgraph if it is reused. When that is fixed, turn this flag off and maybe ditch the code for it.
+
+class _DesignCache(object):
+    """
+    Bounded cache of filter designs (plans and tap arrays), keyed by the parameters they were computed from, so that building the same filter repeatedly (as happens on every receiver add, mode change, and device switch) does not repeat the design computations.
+    
+    Tap arrays, but not plans (which are cheap once their taps are known), may be saved to and loaded from a file so that they need not be recomputed after a restart.
+    """
+    
+    # Kinds of keys whose values are sequences of numbers and can be saved.
+    __persistable_kinds = frozenset(['low_pass', 'rational_design'])
+    
+    def __init__(self, max_entries=500):
+        self.__max_entries = max_entries
+        self.__entries = OrderedDict()
+        self.__filename = None
+        self.__changed = False
+    
+    def get(self, key, compute):
+        """Return the cached value for key, a tuple whose first element is a string identifying the kind of design, or else compute() and cache it."""
+        entries = self.__entries
+        if key in entries:
+            value = entries.pop(key)
+        else:
+            value = compute()
+            if key[0] in self.__persistable_kinds:
+                value = tuple(value)
+                self.__changed = True
+        entries[key] = value  # now most recently used
+        while len(entries) > self.__max_entries:
+            entries.popitem(last=False)
+        return value
+    
+    def clear(self):
+        self.__entries.clear()
+    
+    def load(self, filename):
+        """Load designs previously saved to filename, if it exists, and save to it in the future."""
+        self.__filename = filename
+        if not os.path.isfile(filename):
+            return
+        try:
+            with open(filename, 'r') as f:
+                records = json.load(f)
+            for key, value in records:
+                key = tuple(key)
+                if key[0] in self.__persistable_kinds and key not in self.__entries:
+                    self.__entries[key] = tuple(value)
+        except (IOError, ValueError, TypeError, IndexError) as e:
+            log.err(e, 'Failed to read filter design cache %r; ignoring it' % (filename,))
+    
+    def save(self):
+        """Write the persistable designs to the file given to load(), if they have changed since it was read."""
+        if self.__filename is None or not self.__changed:
+            return
+        records = [[list(key), list(value)]
+            for key, value in self.__entries.iteritems()
+            if key[0] in self.__persistable_kinds]
+        temp_filename = self.__filename + '.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump(records, f)
+        os.rename(temp_filename, self.__filename)
+        self.__changed = False
+
+
+design_cache = _DesignCache()
+
+
+__all__.append('design_cache')
+
+
+# --- Cost model ---
+#
+# Estimates of the CPU cost of filter blocks, used to choose among filter designs. Costs are in complex multiply-accumulate operations per second, multiplied by a factor per kind of block which may be measured on the host by shinysdr/test/manual/filter_calibration.py and loaded with load_filter_calibration.
+
+
+_default_filter_calibration = {
+    'fir': 1.0,
+    'fft': 1.0,
+    'rational': 1.0,
+    'pfb': 1.0,
+}
+_filter_calibration = dict(_default_filter_calibration)
+
+# Stopband attenuation of the windows we design with, as used by firdes to choose the number of taps.
+_hamming_attenuation_db = 53
+_kaiser_7_attenuation_db = 7.0 / 0.1102 + 8.7  # rational_resampler.design_filter uses beta = 7.0
+
+# Beyond this many taps we don't expect a single stage to work well (buffer length limits), so plans avoid it where possible.
+_max_stage_taps = 2000
+
+
+def load_filter_calibration(filename):
+    """Load relative costs of filter block types, as written by filter_calibration.py."""
+    with open(filename, 'r') as f:
+        calibration = json.load(f)
+    if not isinstance(calibration, dict):
+        raise ValueError('filter calibration must be a JSON object')
+    for key, value in calibration.iteritems():
+        if key not in _default_filter_calibration:
+            raise ValueError('unknown filter calibration key %r' % (key,))
+        if not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError('filter calibration value for %r must be a positive number, not %r' % (key, value))
+    _filter_calibration.clear()
+    _filter_calibration.update(_default_filter_calibration)
+    _filter_calibration.update(calibration)
+    design_cache.clear()  # plans depend on the calibration
+
+
+__all__.append('load_filter_calibration')
+
+
+def _estimate_ntaps(attenuation_db, sampling_freq, transition_width):
+    """Return the number of taps firdes will use for a window-method filter (cf. firdes::compute_ntaps)."""
+    ntaps = int(attenuation_db * sampling_freq / (22.0 * transition_width))
+    if ntaps % 2 == 0:
+        ntaps += 1
+    return ntaps
+
+
+def _fir_cost(ntaps, output_rate):
+    """Cost of fir_filter_ccc or freq_xlating_fir_filter_ccc, which compute only the output samples."""
+    return _filter_calibration['fir'] * ntaps * output_rate
+
+
+def _fft_cost(ntaps, input_rate):
+    """Cost of fft_filter_ccc, which filters every input sample regardless of decimation."""
+    fft_size = 2 << (ntaps - 1).bit_length()  # 2 * 2 ** ceil(log2(ntaps)), as chosen by fft_filter
+    samples_per_block = fft_size - ntaps + 1
+    # forward and inverse FFT of (fft_size / 2) log2(fft_size) butterflies each, plus the multiplication by the filter
+    per_block = fft_size * (fft_size.bit_length() - 1) + fft_size
+    return _filter_calibration['fft'] * per_block * input_rate / samples_per_block
+
+
+def _prefer_fft_filter(ntaps, input_rate, output_rate):
+    return _fft_cost(ntaps, input_rate) < _fir_cost(ntaps, output_rate)
+
+
+def _rational_resampler_cost(ntaps, interpolation, output_rate):
+    """Cost of a polyphase rational resampler, which uses ntaps / interpolation taps per output sample."""
+    return _filter_calibration['rational'] * ntaps / interpolation * output_rate
+
+
+def _pfb_resampler_cost(ntaps, filter_count, output_rate):
+    """Cost of arb_resampler, which computes a filter and its derivative from one of filter_count branches per output sample."""
+    return _filter_calibration['pfb'] * 2 * ntaps / filter_count * output_rate
+
+
+def _low_pass_taps(gain, sampling_freq, cutoff_freq, transition_width, window_type=firdes.WIN_HAMMING):
+    """Equivalent to firdes.low_pass, but cached."""
+    return design_cache.get(
+        ('low_pass', gain, sampling_freq, cutoff_freq, transition_width, window_type),
+        lambda: firdes.low_pass(gain, sampling_freq, cutoff_freq, transition_width, window_type))
+
+
+# Consider rational_resampler_ccf as well as arb_resampler_ccf, choosing by estimated cost. The rational resampler is preferred unless the other is estimated to be cheaper by the following factor, since it avoids the bug <http://gnuradio.org/redmine/issues/713> where arb_resampler_ccf will hang the flowgraph if it is reused.
 _use_rational_resampler = True
+_arb_resampler_cost_penalty = 1.25
 
 
 class _MultistageChannelFilterPlan(object):
@@ -76,6 +237,12 @@ class _MultistageChannelFilterPlan(object):
     def get_shape(self):
         return self.__shape_json
     
+    def estimate_cost(self):
+        """Estimate the CPU cost of this filter; see _fir_cost."""
+        return sum(
+            design.estimate_cost(self.__cutoff_freq, self.__transition_width)
+            for design in self.__stage_designs)
+    
     def replace(self, cutoff_freq=None, transition_width=None):
         if cutoff_freq is None:
             cutoff_freq = self.__cutoff_freq
@@ -114,6 +281,9 @@ class _FilterPlanCommentStage(_FilterPlanStage):
     def calculate_taps(self, final_cutoff, final_transition):
         return None
     
+    def estimate_cost(self, final_cutoff, final_transition):
+        return 0
+    
     def explain(self):
         return self.comment
 
@@ -135,6 +305,9 @@ class _FilterPlanXlateStage(_FilterPlanStage):
     def calculate_taps(self, final_cutoff, final_transition):
         return [1]
     
+    def estimate_cost(self, final_cutoff, final_transition):
+        return _fir_cost(1, self.output_rate)
+    
     def explain(self):
         return 'freq xlation only'
 
@@ -155,16 +328,33 @@ class _FilterPlanDecimatingStage(_FilterPlanStage):
                 0,
                 self.input_rate)
         else:
-            if len(taps) > 10:
+            if _prefer_fft_filter(len(taps), self.input_rate, self.output_rate):
                 return grfilter.fft_filter_ccc(self.decimation, taps, 1)
             else:
                 return grfilter.fir_filter_ccc(self.decimation, taps)
     
+    def estimate_cost(self, final_cutoff, final_transition):
+        # same calculation as calculate_taps
+        transition = self.output_rate / 2 - (final_cutoff - final_transition / 2)
+        if transition <= 0:
+            return float('inf')
+        ntaps = _estimate_ntaps(_hamming_attenuation_db, self.input_rate, transition)
+        if ntaps > _max_stage_taps:
+            return float('inf')
+        return self._estimate_cost_for_taps(ntaps)
+    
+    def _estimate_cost_for_taps(self, ntaps):
+        fir_cost = _fir_cost(ntaps, self.output_rate)
+        if self.freq_xlating:
+            return fir_cost
+        else:
+            return min(fir_cost, _fft_cost(ntaps, self.input_rate))
+    
     def calculate_taps(self, final_cutoff, final_transition):
         # TODO check for collision with user filter
         user_inner = final_cutoff - final_transition / 2
         limit = self.output_rate / 2
-        return firdes.low_pass(
+        return _low_pass_taps(
             1.0,
             self.input_rate,
             (user_inner + limit) / 2,
@@ -181,13 +371,18 @@ class _FilterPlanFinalDecimatingStage(_FilterPlanDecimatingStage):
         _FilterPlanDecimatingStage.__init__(self, **kwargs)
 
     def calculate_taps(self, final_cutoff, final_transition):
-        return firdes.low_pass(
+        return _low_pass_taps(
             1.0,
             self.input_rate,
             final_cutoff,
             final_transition,
             firdes.WIN_HAMMING)
     
+    def estimate_cost(self, final_cutoff, final_transition):
+        # The final stage may need many taps for a sharp filter; it is not limited by _max_stage_taps since it is better to have a long final filter than no filter at all.
+        return self._estimate_cost_for_taps(
+            _estimate_ntaps(_hamming_attenuation_db, self.input_rate, final_transition))
+    
     def explain(self):
         return 'final filter and ' + super(_FilterPlanFinalDecimatingStage, self).explain()
 
@@ -208,10 +403,23 @@ class _FilterPlanRationalResamplerStage(_FilterPlanStage):
     
     def calculate_taps(self, final_cutoff, final_transition):
         # TODO: This might be internal, and we eventually want to integrate it in the plan anyway
-        return rational_resampler.design_filter(
-            interpolation=self.interpolation,
-            decimation=self.decimation,
-            fractional_bw=0.4)
+        return design_cache.get(
+            ('rational_design', self.interpolation, self.decimation, 0.4),
+            lambda: rational_resampler.design_filter(
+                interpolation=self.interpolation,
+                decimation=self.decimation,
+                fractional_bw=0.4))
+    
+    def estimate_cost(self, final_cutoff, final_transition):
+        # same calculation as rational_resampler.design_filter
+        halfband = 0.5
+        rate = self.interpolation / self.decimation
+        if rate >= 1.0:
+            transition = halfband - 0.4
+        else:
+            transition = rate * (halfband - 0.4)
+        ntaps = _estimate_ntaps(_kaiser_7_attenuation_db, self.interpolation, transition)
+        return _rational_resampler_cost(ntaps, self.interpolation, self.output_rate)
     
     def explain(self):
         return 'rational_resampler by %s/%s (stage rates %s/%s)' % (self.interpolation, self.decimation, self.output_rate, self.input_rate)
@@ -229,28 +437,107 @@ class _FilterPlanPfbResamplerStage(_FilterPlanStage):
     def calculate_taps(self, final_cutoff, final_transition):
         return None
     
+    def estimate_cost(self, final_cutoff, final_transition):
+        # approximately the default filter design of pfb.arb_resampler_ccf
+        filter_count = 32
+        halfband = 0.5 * min(1.0, self.resample_rate)
+        transition = 0.4 * halfband
+        ntaps = _estimate_ntaps(80, filter_count, transition)
+        return _pfb_resampler_cost(ntaps, filter_count, self.output_rate)
+    
     def explain(self):
         return 'arb_resampler %s/%s = %s' % (self.output_rate, self.input_rate, float(self.output_rate) / self.input_rate)
 
 
-def _make_filter_plan_1(input_rate, output_rate):
+def _make_filter_plan_1(input_rate, output_rate, cutoff_freq, transition_width):
+    """Return the _MultistageChannelFilterPlan with the least estimated cost, without taps. Cached."""
+    return design_cache.get(
+        ('plan', input_rate, output_rate, cutoff_freq, transition_width),
+        lambda: _compute_filter_plan_1(input_rate, output_rate, cutoff_freq, transition_width))
+
+
+def _compute_filter_plan_1(input_rate, output_rate, cutoff_freq, transition_width):
     assert input_rate > 0
     assert output_rate > 0
     
-    total_decimation = max(1, int(input_rate // output_rate))
-    
-    using_rational_resampler = _use_rational_resampler and input_rate % 1 == 0 and output_rate % 1 == 0
-    if using_rational_resampler:
+    candidates = []
+    if _use_rational_resampler and input_rate % 1 == 0 and output_rate % 1 == 0:
         # If using rational resampler, don't decimate to the point that we get a fractional rate, if possible.
-        input_rate = int(input_rate)
-        output_rate = int(output_rate)
-        if input_rate > output_rate:
-            total_decimation = input_rate // small_factor_at_least(input_rate, output_rate)
-        # print input_rate / total_decimation, total_decimation, input_rate, output_rate, input_rate // gcd(input_rate, output_rate)
-        # TODO: Don't re-factorize unnecessarily
+        int_input_rate = int(input_rate)
+        int_output_rate = int(output_rate)
+        total_decimation = max(1, int_input_rate // int_output_rate)
+        if int_input_rate > int_output_rate:
+            total_decimation = int_input_rate // small_factor_at_least(int_input_rate, int_output_rate)
+        candidates.append(_make_candidate_filter_plan(
+            input_rate=int_input_rate,
+            output_rate=int_output_rate,
+            total_decimation=total_decimation,
+            using_rational_resampler=True,
+            cutoff_freq=cutoff_freq,
+            transition_width=transition_width))
+    candidates.append(_make_candidate_filter_plan(
+        input_rate=input_rate,
+        output_rate=output_rate,
+        total_decimation=max(1, int(input_rate // output_rate)),
+        using_rational_resampler=False,
+        cutoff_freq=cutoff_freq,
+        transition_width=transition_width))
+    
+    def adjusted_cost(plan):
+        cost = plan.estimate_cost()
+        if isinstance(plan.get_stage_designs()[-1], _FilterPlanPfbResamplerStage) and len(candidates) > 1:
+            cost *= _arb_resampler_cost_penalty
+        return cost
+    
+    # min() picks the first of equal candidates, so ties favor the rational resampler.
+    return min(candidates, key=adjusted_cost)
+
+
+def _choose_stage_decimations(input_rate, total_decimation, cutoff_freq, transition_width):
+    """
+    Return the list of stage decimations, whose product is total_decimation, for which the decimating stages have the least estimated cost.
+    
+    Considers every ordered factorization of total_decimation (by dynamic programming over the decimation so far).
+    """
+    divisors = set([1])
+    for factor in factorize(total_decimation):
+        divisors.update([divisor * factor for divisor in divisors])
+    divisors = sorted(divisors, reverse=True)
+    results = {}
+    
+    def best_after(decimation_so_far):
+        if decimation_so_far in results:
+            return results[decimation_so_far]
+        remaining = total_decimation // decimation_so_far
+        stage_input_rate = input_rate / decimation_so_far
+        best = (float('inf'), None)
+        for stage_decimation in divisors:
+            if stage_decimation == 1 or remaining % stage_decimation != 0:
+                continue
+            if stage_decimation == remaining:
+                stage_type = _FilterPlanFinalDecimatingStage
+                rest_cost, rest = 0, []
+            else:
+                stage_type = _FilterPlanDecimatingStage
+                rest_cost, rest = best_after(decimation_so_far * stage_decimation)
+            stage_cost = stage_type(
+                freq_xlating=decimation_so_far == 1,
+                decimation=stage_decimation,
+                input_rate=stage_input_rate,
+                output_rate=stage_input_rate / stage_decimation).estimate_cost(cutoff_freq, transition_width)
+            if stage_cost + rest_cost < best[0]:
+                best = (stage_cost + rest_cost, [stage_decimation] + rest)
+        results[decimation_so_far] = best
+        return best
     
-    stage_decimations = factorize(total_decimation)
-    stage_decimations.reverse()
+    if total_decimation <= 1:
+        return []
+    _cost, stage_decimations = best_after(1)
+    return stage_decimations
+
+
+def _make_candidate_filter_plan(input_rate, output_rate, total_decimation, using_rational_resampler, cutoff_freq, transition_width):
+    stage_decimations = _choose_stage_decimations(input_rate, total_decimation, cutoff_freq, transition_width)
     
     # loop variables
     stage_designs = []
@@ -314,8 +601,8 @@ def _make_filter_plan_1(input_rate, output_rate):
     plan = _MultistageChannelFilterPlan(
         stage_designs=stage_designs,
         freq_xlate_stage=freq_xlate_stage,
-        cutoff_freq=-1,
-        transition_width=-1)
+        cutoff_freq=cutoff_freq,
+        transition_width=transition_width)
     
     return plan
 
@@ -343,7 +630,9 @@ class MultistageChannelFilter(gr.hier_block2):
     
         plan = _make_filter_plan_1(
             input_rate=input_rate,
-            output_rate=output_rate)
+            output_rate=output_rate,
+            cutoff_freq=cutoff_freq,
+            transition_width=transition_width)
         plan = plan.replace(
             cutoff_freq=cutoff_freq,
             transition_width=transition_width)
@@ -442,8 +731,179 @@ class MultistageChannelFilter(gr.hier_block2):
 __all__.append('MultistageChannelFilter')
 
 
+class ChannelizerBank(gr.hier_block2):
+    """
+    Splits the entire input band into evenly spaced channels using a polyphase filterbank, so that many narrowband receivers can share one filtering operation rather than each filtering the full input rate.
+    
+    Output i is the channel centered at i * spacing (with indexes above half the channel count being negative frequencies, as with FFT bins). The outputs run at twice the channel spacing and the channel filter is wide, so that a signal near the edge between two channels is still entirely present in the nearer one; the receiver then does a small final frequency translation and filter.
+    
+    Every output is connected internally, so any subset of outputs may be used.
+    
+    See also SharedDecimationBank, which has the same interface for use by receivers.
+    """
+    def __init__(self,
+            name='Channelizer Bank',
+            input_rate=0,
+            channels=16):
+        channels = int(channels)
+        if channels < 2:
+            raise ValueError('channels (%s) must be at least 2' % (channels,))
+        if channels % _channelizer_oversample != 0:
+            # pfb.channelizer_ccf would reject the oversampling rate.
+            raise ValueError('channels (%s) must be a multiple of %s' % (channels, _channelizer_oversample))
+        
+        gr.hier_block2.__init__(
+            self, name,
+            gr.io_signature(1, 1, gr.sizeof_gr_complex * 1),
+            gr.io_signature(channels, channels, gr.sizeof_gr_complex * 1),
+        )
+        
+        self.__input_rate = input_rate
+        self.__channels = channels
+        self.__spacing = input_rate / channels
+        self.__output_rate = self.__spacing * _channelizer_oversample
+        
+        # Output Nyquist frequency is one spacing; the passband extends to 3/4 of that, leaving room for a signal half a channel off center plus its own bandwidth.
+        self.__passband_half_width = self.__spacing * 0.75
+        taps = _low_pass_taps(
+            1.0,
+            input_rate,
+            self.__spacing * 0.875,
+            self.__spacing * 0.25,
+            firdes.WIN_BLACKMAN_HARRIS)
+        
+        self.__ntaps = len(taps)
+        self.__channelizer = pfb.channelizer_ccf(channels, taps, _channelizer_oversample)
+        self.connect(self, self.__channelizer)
+        for i in xrange(channels):
+            self.connect((self.__channelizer, i), (self, i))
+            # Ensure every output of the channelizer is connected even when the corresponding output of this block is not.
+            self.connect((self.__channelizer, i), blocks.null_sink(gr.sizeof_gr_complex))
+    
+    def get_input_rate(self):
+        return self.__input_rate
+    
+    def get_output_rate(self):
+        return self.__output_rate
+    
+    def get_channel_count(self):
+        return self.__channels
+    
+    def get_channel_spacing(self):
+        return self.__spacing
+    
+    def get_max_signal_half_width(self):
+        """Return the maximum distance from its center frequency at which a signal is guaranteed to be entirely within the passband of its nearest channel."""
+        return self.__passband_half_width - self.__spacing / 2
+    
+    def nearest_channel(self, freq):
+        """Return (output index, center frequency) for the channel nearest to freq, which is relative to the input center frequency."""
+        k = int(round(freq / self.__spacing))
+        return (k % self.__channels, k * self.__spacing)
+    
+    def get_channel_cost(self, index, used_indexes):
+        """Return the cost, in units of full-rate filters, of the shared processing needed to add the given channel to those already in use."""
+        return 0 if used_indexes else 1
+    
+    def connect_channel(self, connector, source, index):
+        """Connect source to this bank using connector and return the endpoint providing the given channel."""
+        connector.connect(source, self)
+        return (self, index)
+    
+    def explain(self):
+        """Return a description of the filter design."""
+        return '%i channels of %i at spacing %s using %i taps in %s' % (
+            self.__channels,
+            self.__output_rate,
+            self.__spacing,
+            self.__ntaps,
+            type(self.__channelizer).__name__)
+    
+    def explain_channel(self, index):
+        """Return a description of the filtering providing the given channel."""
+        return 'channel %i of %s' % (index, self.explain())
+
+
+__all__.append('ChannelizerBank')
+
+# ChannelizerBank output rate as a multiple of its channel spacing.
+_channelizer_oversample = 2
+
+
+class SharedDecimationBank(object):
+    """
+    Provides frequency-translating decimating filters which are shared by receivers with nearby frequencies, so that the expensive first stages of filtering at the full input rate are done once per cluster of receivers rather than once per receiver.
+    
+    Clusters are cells of a fixed frequency grid, so that a receiver's output rate does not change as other receivers come and go. Cells are spaced at half the output rate, and each cell's filter passes 35% of its output rate either side of its center; this means that any signal within 10% of the output rate of its frequency fits in the nearest cell.
+    
+    Has the same interface as ChannelizerBank for use by receivers, but is not itself a block; each cell's filter is a separate MultistageChannelFilter created when first used.
+    """
+    def __init__(self, input_rate=0, decimation=1):
+        decimation = int(decimation)
+        if decimation < 2:
+            raise ValueError('decimation (%s) must be at least 2' % (decimation,))
+        self.__input_rate = input_rate
+        self.__decimation = decimation
+        self.__output_rate = input_rate / decimation
+        self.__spacing = self.__output_rate / 2
+        self.__stages = {}
+    
+    def get_input_rate(self):
+        return self.__input_rate
+    
+    def get_output_rate(self):
+        return self.__output_rate
+    
+    def get_channel_spacing(self):
+        return self.__spacing
+    
+    def get_max_signal_half_width(self):
+        """Return the maximum distance from its center frequency at which a signal is guaranteed to be entirely within the passband of its nearest channel."""
+        return self.__output_rate * 0.1
+    
+    def nearest_channel(self, freq):
+        """Return (channel index, center frequency) for the channel nearest to freq, which is relative to the input center frequency."""
+        k = int(round(freq / self.__spacing))
+        return (k, k * self.__spacing)
+    
+    def get_channel_cost(self, index, used_indexes):
+        """Return the cost, in units of full-rate filters, of the shared processing needed to add the given channel to those already in use."""
+        return 0 if index in used_indexes else 1
+    
+    def connect_channel(self, connector, source, index):
+        """Connect source to the filter for the given channel using connector and return the filter."""
+        stage = self.__get_stage(index)
+        connector.connect(source, stage)
+        return stage
+    
+    def __get_stage(self, index):
+        if index not in self.__stages:
+            self.__stages[index] = MultistageChannelFilter(
+                name='Shared Decimation Stage',
+                input_rate=self.__input_rate,
+                output_rate=self.__output_rate,
+                cutoff_freq=self.__output_rate * 0.4,
+                transition_width=self.__output_rate * 0.1,
+                center_freq=index * self.__spacing)
+        return self.__stages[index]
+    
+    def explain(self):
+        """Return a description of the filter designs of the channels which have been used."""
+        s = 'decimation by %i to %s, channels at spacing %s' % (self.__decimation, self.__output_rate, self.__spacing)
+        for index, stage in sorted(self.__stages.iteritems()):
+            s += '\n channel %i at %s: %s' % (index, index * self.__spacing, stage.explain().replace('\n', '\n  '))
+        return s
+    
+    def explain_channel(self, index):
+        """Return a description of the filtering providing the given channel, which is shared by all receivers using that channel."""
+        return 'shared channel %i at %s: %s' % (index, index * self.__spacing, self.__get_stage(index).explain())
+
+
+__all__.append('SharedDecimationBank')
+
+
 # TODO: Rename for consistency. Document.
-# TODO: Add the ability to memoize/precompute filter taps, particularly because pfb uses optfir internally which is slow. Maybe we can express this using the same 'plan' type as MultistageChannelFilter.
+# TODO: Maybe we can express this using the same 'plan' type as MultistageChannelFilter.
 # TODO: I think there are places where we are _not_ using make_resampler because it didn't have a complex mode before.
 def make_resampler(in_rate, out_rate, complex=False):
     # pylint: disable=redefined-builtin
@@ -457,27 +917,40 @@ def make_resampler(in_rate, out_rate, complex=False):
     in_relative_cutoff = in_relative_max_rate * fractional_cutoff
     in_relative_transition_width = in_relative_max_rate * fractional_transition_width
     
-    if _use_rational_resampler and in_rate % 1 == 0 and out_rate % 1 == 0:
-        # Note: rational_resampler has this logic built in, but it does not correctly design the filter when decimating <http://gnuradio.org/redmine/issues/745>, so we do it ourselves; but this also allows sharing the calculation details for pfb_ and rational_.
+    pfbsize = 32  # TODO: justify magic number (taken from gqrx)
+    
+    use_rational = _use_rational_resampler and in_rate % 1 == 0 and out_rate % 1 == 0
+    if use_rational:
         in_rate = int(in_rate)
         out_rate = int(out_rate)
         common = gcd(in_rate, out_rate)
         interpolation = out_rate // common
         decimation = in_rate // common
+        rational_cost = _rational_resampler_cost(
+            _estimate_ntaps(_hamming_attenuation_db, interpolation, in_relative_transition_width),
+            interpolation,
+            out_rate)
+        pfb_cost = _pfb_resampler_cost(
+            _estimate_ntaps(_hamming_attenuation_db, pfbsize, in_relative_transition_width),
+            pfbsize,
+            out_rate)
+        use_rational = rational_cost <= pfb_cost * _arb_resampler_cost_penalty
+    
+    if use_rational:
+        # Note: rational_resampler has this logic built in, but it does not correctly design the filter when decimating <http://gnuradio.org/redmine/issues/745>, so we do it ourselves; but this also allows sharing the calculation details for pfb_ and rational_.
         return (rational_resampler.rational_resampler_ccf if complex else rational_resampler.rational_resampler_fff)(
             interpolation=interpolation,
             decimation=decimation,
-            taps=firdes.low_pass(
+            taps=_low_pass_taps(
                 interpolation,  # gain compensates for interpolation
                 interpolation,  # rational resampler filter runs at the interpolated rate
                 in_relative_cutoff,
                 in_relative_transition_width))
     else:
         resample_ratio = out_rate / in_rate
-        pfbsize = 32  # TODO: justify magic number (taken from gqrx)
         return (pfb.arb_resampler_ccf if complex else pfb.arb_resampler_fff)(
             resample_ratio,
-            firdes.low_pass(
+            _low_pass_taps(
                 pfbsize,
                 pfbsize,
                 in_relative_cutoff,
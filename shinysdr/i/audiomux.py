@@ -21,6 +21,8 @@ GR blocks and such supporting receiver audio delivery.
 
 from __future__ import absolute_import, division
 
+from collections import OrderedDict
+
 from twisted.python import log
 
 from gnuradio import audio
@@ -96,6 +98,17 @@ class AudioManager(object):
     def validate_destination(self, destination):
         return destination in self.__audio_buses
     
+    def has_clients(self):
+        """Return whether any client audio queues are present, which indicates that there are clients connected."""
+        return len(self.__audio_queue_sinks) > 0
+    
+    def destination_has_consumers(self, destination):
+        """Return whether audio sent to the given destination would be heard by anyone."""
+        if destination == CLIENT_AUDIO_DEVICE:
+            return self.has_clients()
+        else:
+            return destination in self.__audio_devices
+    
     def reconnecting(self):
         return ReconnectSession(self.__audio_buses, self.__audio_devices, self.__audio_queue_sinks)
 
@@ -144,6 +157,8 @@ class BusPlumber(object):
     """
     Takes an arbitrary number of blocks' float or pair-of-float (stereo) outputs (bus inputs), sums and resamples them, and connects them to an arbitrary number of blocks' inputs (bus outputs).
     
+    Inputs with the same sample rate are summed before resampling, so the number of resamplers depends on the number of distinct rates rather than the number of inputs.
+    
     If there are no outputs, the inputs will go to a null sink. If there are no inputs, the outputs will remain unconnected.
     
     (This cannot be a hierarchical block, because hierarchical blocks cannot currently have variable numbers of ports.)
@@ -153,15 +168,25 @@ class BusPlumber(object):
         self.__nchannels = nchannels
         self.__channels = xrange(nchannels)
         self.__bus_rate = 0.0
+        
+        # Blocks kept between reconnections, so that a reconnection which does not change them leaves them untouched.
+        self.__mixer = _Mixer(nchannels)
+        self.__null_sink = blocks.null_sink(gr.sizeof_float * nchannels)
+        self.__resamplers_rate = None
+        self.__group_mixers = {}  # input rate -> _Mixer
+        self.__input_resamplers = {}  # input rate -> resampler
+        self.__output_resamplers = {}  # output rate -> resampler
     
     def get_current_rate(self):
         return self.__bus_rate
     
     def connect(self, inputs, outputs):
         """
-        Make all new connections (graph.disconnect_all() must have been done) between inputs and outputs.
+        Make all new connections (graph.disconnect_all() must have been done, unless the graph is an IncrementalConnector) between inputs and outputs.
         
         inputs and outputs must be iterables of (sample_rate, block) tuples.
+        
+        The mixer and resamplers are reused from previous calls where possible, so with an IncrementalConnector, adding or removing an input or output changes only its own connections.
         """
         inputs = list(inputs)
         outputs = list(outputs)
@@ -180,39 +205,94 @@ class BusPlumber(object):
         elif new_bus_rate != self.__bus_rate:
             self.__bus_rate = new_bus_rate
         
-        # recreated each time because reusing an add_ff w/ different
-        # input counts fails; TODO: report/fix bug
-        bus_sum = blocks.add_ff(vlen=self.__nchannels)
+        if self.__bus_rate != self.__resamplers_rate:
+            # Resamplers are only reusable while the bus rate is unchanged.
+            self.__input_resamplers = {}
+            self.__output_resamplers = {}
+            self.__resamplers_rate = self.__bus_rate
         
-        in_index = 0
+        rate_groups = OrderedDict()
         for in_rate, in_block in inputs:
-            self.__connect_maybe_with_resampler(in_block, in_rate, self.__bus_rate, (bus_sum, in_index))
-            in_index += 1
+            rate_groups.setdefault(in_rate, []).append(in_block)
+        mixer_inputs = []
+        input_resamplers = {}
+        group_mixers = {}
+        for in_rate, in_blocks in rate_groups.iteritems():
+            if in_rate == self.__bus_rate:
+                mixer_inputs.extend(in_blocks)
+            else:
+                group_mixer = group_mixers[in_rate] = self.__group_mixers.get(in_rate) or _Mixer(self.__nchannels)
+                group_sum = group_mixer.connect(self.__graph, in_blocks)
+                mixer_inputs.append(self.__maybe_resample(group_sum, in_rate, self.__bus_rate, self.__input_resamplers, input_resamplers, in_rate))
+        self.__input_resamplers = input_resamplers
+        self.__group_mixers = group_mixers
         
-        if in_index > 0:
+        if len(mixer_inputs) > 0:
+            bus_sum = self.__mixer.connect(self.__graph, mixer_inputs)
             # connect output only if there is at least one input
             if len(outputs) > 0:
-                resampler_table = {}
+                output_resamplers = {}
                 for out_rate, out_block in outputs:
-                    self.__connect_maybe_with_resampler(bus_sum, self.__bus_rate, out_rate, out_block, resampler_table=resampler_table)
+                    self.__graph.connect(
+                        self.__maybe_resample(bus_sum, self.__bus_rate, out_rate, self.__output_resamplers, output_resamplers, out_rate),
+                        out_block)
+                self.__output_resamplers = output_resamplers
             else:
                 # gnuradio requires at least one connected output
-                self.__graph.connect(bus_sum, blocks.null_sink(gr.sizeof_float * self.__nchannels))
+                self.__graph.connect(bus_sum, self.__null_sink)
     
-    def __connect_maybe_with_resampler(self, in_endpoint, in_rate, out_rate, out_endpoint, resampler_table=None):
-        """Connect in_endpoint, a source of vectors of size self.__nchannels, to out_endpoint, inserting per-channel resamplers if needed.
+    def __maybe_resample(self, in_block, in_rate, out_rate, old_resamplers, new_resamplers, key):
+        """Return a block producing in_block's output (vectors of size self.__nchannels) at out_rate, connecting a resampler if needed.
         
-        If resampler_table (a dict) is provided then it is used to record resamplers already created that can be shared. in_endpoint and in_rate are assumed to be the same."""
+        Resamplers are looked up by key in old_resamplers and new_resamplers, so that they are reused between and within reconnections, and recorded in new_resamplers."""
         if in_rate == out_rate:
-            self.__graph.connect(in_endpoint, out_endpoint)
-        else:
-            if resampler_table is not None and out_rate in resampler_table:
-                self.__graph.connect(resampler_table[out_rate], out_endpoint)
-            else:
-                resampler = VectorResampler(in_rate, out_rate, vlen=self.__nchannels)
-                self.__graph.connect(in_endpoint, resampler, out_endpoint)
-                if resampler_table is not None:
-                    resampler_table[out_rate] = resampler
+            return in_block
+        if key in new_resamplers:
+            return new_resamplers[key]
+        resampler = old_resamplers.get(key)
+        if resampler is None:
+            resampler = VectorResampler(in_rate, out_rate, vlen=self.__nchannels)
+        new_resamplers[key] = resampler
+        self.__graph.connect(in_block, resampler)
+        return resampler
+
+
+class _Mixer(object):
+    """
+    Sums a varying set of sources using an add_ff whose inputs are never left unconnected; unused inputs are fed zeros.
+    
+    This way the add_ff is reused when the number of sources changes (an add_ff cannot be reconnected with a different number of inputs), and each source stays on the same input port, so that when used with an IncrementalConnector, adding or removing one source changes only that source's connection.
+    """
+    def __init__(self, nchannels):
+        self.__nchannels = nchannels
+        self.__zeros = blocks.null_source(gr.sizeof_float * nchannels)
+        self.__add = None
+        self.__capacity = 0
+        self.__ports = OrderedDict()  # id(source) -> (source, port)
+    
+    def connect(self, graph, sources):
+        """Connect sources to the mixer's inputs, and return the block producing their sum."""
+        wanted = OrderedDict((id(source), source) for source in sources)
+        if len(wanted) > self.__capacity:
+            # Grow geometrically so that this is rare.
+            capacity = 1
+            while capacity < len(wanted):
+                capacity *= 2
+            self.__add = blocks.add_ff(vlen=self.__nchannels)
+            self.__capacity = capacity
+            self.__ports = OrderedDict()
+        for key in self.__ports.keys():
+            if key not in wanted:
+                del self.__ports[key]
+        free_ports = sorted(set(xrange(self.__capacity)) - set(port for _, port in self.__ports.itervalues()))
+        for key, source in wanted.iteritems():
+            if key not in self.__ports:
+                self.__ports[key] = (source, free_ports.pop(0))
+        for source, port in self.__ports.itervalues():
+            graph.connect(source, (self.__add, port))
+        for port in free_ports:
+            graph.connect(self.__zeros, (self.__add, port))
+        return self.__add
 
 
 class AudioQueueSink(gr.hier_block2):
@@ -24,8 +24,10 @@ interface.
 
 from __future__ import absolute_import, division
 
+from collections import OrderedDict
 import math
 import os
+import time
 
 from zope.interface import Interface, implements
 
@@ -44,8 +46,13 @@ from shinysdr.values import ExportedState, LooseCell, StreamCell, exported_value
 class RecursiveLockBlockMixin(object):
     """
     For top blocks needing recursive locking and/or a notification to restart parts.
+    
+    Also measures how long the lock is held, since all streams are stopped meanwhile; therefore, new blocks should be constructed before locking, and the lock held only to change connections.
     """
     __lock_count = 0
+    __lock_t0 = None
+    __last_lock_duration = 0.0
+    __max_lock_duration = 0.0
     
     def _recursive_lock_hook(self):
         """To override."""
@@ -53,6 +60,7 @@ class RecursiveLockBlockMixin(object):
     def _recursive_lock(self):
         # gnuradio uses a non-recursive lock, which is not adequate for our purposes because we want to make changes locally or globally without worrying about having a single lock entry point
         if self.__lock_count == 0:
+            self.__lock_t0 = time.time()
             self.lock()
             self._recursive_lock_hook()
         self.__lock_count += 1
@@ -61,6 +69,86 @@ class RecursiveLockBlockMixin(object):
         self.__lock_count -= 1
         if self.__lock_count == 0:
             self.unlock()
+            duration = time.time() - self.__lock_t0
+            self.__last_lock_duration = duration
+            self.__max_lock_duration = max(self.__max_lock_duration, duration)
+    
+    def _get_lock_durations(self):
+        """Return the (most recent, maximum) time in seconds the lock has been held, including the time taken to stop and restart the flow graph."""
+        return (self.__last_lock_duration, self.__max_lock_duration)
+
+
+class IncrementalConnector(object):
+    """
+    Stands in for a flow graph's connect() so that reconnection can be done by changing only the edges which differ.
+    
+    Between begin() and finish() (or abort()), connect() records the connections wanted. finish() then disconnects the edges which were previously made but are no longer wanted and connects the ones which are new. Blocks must be reused (not recreated) between reconnections to benefit.
+    
+    All edges of the graph must be made through this object, or else the disconnect_all method must be used to resynchronize.
+    """
+    def __init__(self, graph):
+        self.__graph = graph
+        self.__current = OrderedDict()
+        self.__wanted = None
+    
+    def begin(self):
+        if self.__wanted is not None:
+            raise Exception('IncrementalConnector: begin() twice')
+        # ordered so that the graph is modified in the same order as the connect() calls, for determinism
+        self.__wanted = OrderedDict()
+    
+    def connect(self, *endpoints):
+        """Same signature as gr.top_block.connect."""
+        if self.__wanted is None:
+            raise Exception('IncrementalConnector: connect() outside of begin()/finish()')
+        endpoints = [_normalize_endpoint(e) for e in endpoints]
+        for src, dst in zip(endpoints, endpoints[1:]):
+            self.__wanted[_edge_key(src, dst)] = (src, dst)
+    
+    def finish(self):
+        """Apply the recorded connections to the graph.
+        
+        The graph should be locked. Returns a pair of the number of edges removed and added."""
+        wanted = self.__wanted
+        current = self.__current
+        self.__wanted = None
+        removed = [edge for key, edge in current.iteritems() if key not in wanted]
+        added = [edge for key, edge in wanted.iteritems() if key not in current]
+        # Disconnect first, because a new edge may be to an input port which was previously connected to something else.
+        for src, dst in removed:
+            self.__graph.disconnect(src, dst)
+        for src, dst in added:
+            self.__graph.connect(src, dst)
+        self.__current = wanted
+        return len(removed), len(added)
+    
+    def abort(self):
+        """Discard the connections recorded since begin(), leaving the graph unchanged."""
+        self.__wanted = None
+    
+    def disconnect_all(self):
+        self.__graph.disconnect_all()
+        self.__current = OrderedDict()
+    
+    def get_blocks(self):
+        """Return a list of the blocks in the connections last made by finish(), in the order they were connected."""
+        blocks = OrderedDict()
+        for src, dst in self.__current.itervalues():
+            blocks.setdefault(id(src[0]), src[0])
+            blocks.setdefault(id(dst[0]), dst[0])
+        return blocks.values()
+
+
+def _normalize_endpoint(endpoint):
+    if isinstance(endpoint, tuple):
+        return endpoint
+    else:
+        return (endpoint, 0)
+
+
+def _edge_key(src, dst):
+    # Using id() because not all block wrapper objects are hashable; the edge tuple keeps the blocks alive so the ids remain valid.
+    return (id(src[0]), src[1], id(dst[0]), dst[1])
 
 
 class Context(object):
@@ -114,8 +202,10 @@ class MessageDistributorSink(gr.hier_block2):
         
         if migrate is not None:
             assert isinstance(migrate, MessageDistributorSink)  # sanity check
-            for queue in migrate.__subscriptions.keys():
-                migrate.unsubscribe(queue)
+            # Take over the subscriptions without disconnecting them from the old sink, which would require locking the flow graph. The old sink is expected to be discarded as a whole, and until it is, this sink is not yet connected, so no messages are duplicated.
+            queues = migrate.__subscriptions.keys()
+            migrate.__subscriptions.clear()
+            for queue in queues:
                 self.subscribe(queue)
         
         # set now, not earlier, so as not to trigger anything while migrating
@@ -256,6 +346,8 @@ class MonitorSink(gr.hier_block2, ExportedState):
         self.__scope_sink = None
         self.__scope_chunker = None
         self.__before_fft = None
+        self.__after_fft = None
+        self.__after_fft_discard = None
         self.__logpwrfft = None
         self.__overlapper = None
         
@@ -277,11 +369,13 @@ class MonitorSink(gr.hier_block2, ExportedState):
             input_length = self.__freq_resolution
             output_length = self.__freq_resolution
             self.__after_fft = None
+            self.__after_fft_discard = None
         else:
             # use vector_to_streams to cut the output in half and discard the redundant part
             input_length = self.__freq_resolution * 2
             output_length = self.__freq_resolution
             self.__after_fft = blocks.vector_to_streams(itemsize=output_length * gr.sizeof_float, nstreams=2)
+            self.__after_fft_discard = blocks.null_sink(gr.sizeof_float * self.__freq_resolution)
         
         sample_rate = self.__signal_type.get_sample_rate()
         overlap_factor = int(math.ceil(_maximum_fft_rate * input_length / sample_rate))
@@ -327,6 +421,7 @@ class MonitorSink(gr.hier_block2, ExportedState):
             vec_len=self.__time_length)
 
     def __connect(self):
+        # All blocks are created by __rebuild, so that the lock is held only while changing connections.
         self.__context.lock()
         try:
             self.disconnect_all()
@@ -338,7 +433,7 @@ class MonitorSink(gr.hier_block2, ExportedState):
             if self.__after_fft is not None:
                 self.connect(self.__logpwrfft, self.__after_fft)
                 self.connect(self.__after_fft, self.__fft_converter, self.__fft_sink)
-                self.connect((self.__after_fft, 1), blocks.null_sink(gr.sizeof_float * self.__freq_resolution))
+                self.connect((self.__after_fft, 1), self.__after_fft_discard)
             else:
                 self.connect(self.__logpwrfft, self.__fft_converter, self.__fft_sink)
             if self.__enable_scope:
@@ -0,0 +1,247 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Running the devices and flowgraph in a process separate from the web server (shinysdr --dsp-process).
+
+The DSP process executes the configuration and owns everything main.py would otherwise construct except the network services. The web server process mirrors the session (see shinysdr.i.mirror); spectrum and other stream cells, and audio, are passed through SharedRings rather than the state stream, so that serving clients costs the DSP process little beyond writing into memory.
+
+This module is not an external API and not guaranteed to have a stable
+interface.
+"""
+
+from __future__ import absolute_import, division
+
+import sys
+
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+
+from gnuradio import gr
+
+from shinysdr.config import Config, ConfigException, execute_config
+from shinysdr.i.mirror import StateMirrorServerProtocol, spawn_mirrored_process, take_stdout_for_mirror
+from shinysdr.i.ring import SharedRing
+from shinysdr.types import ReferenceT
+from shinysdr.values import ExportedState, exported_value
+
+
+__all__ = []  # appended later
+
+
+# About 2.7 seconds of 48 kHz stereo audio.
+_AUDIO_RING_CAPACITY = 2 ** 20
+
+# How often the web server process moves audio from the ring to the client's queue.
+_AUDIO_POLL_INTERVAL = 0.02
+
+
+@defer.inlineCallbacks
+def spawn_dsp_process(reactor, config_path, force_run=False):
+    """Start a DSP process using the given configuration.
+
+    Returns a Deferred which fires with (app, config), where app is a stand-in for the AppRoot in the DSP process, and config is a Config object with the network services and databases the configuration specified.
+    """
+    args = [config_path]
+    if force_run:
+        args.append('--force-run')
+    process, mirror = spawn_mirrored_process(reactor, 'shinysdr.i.dsp_process', args)
+    root = yield mirror.when_ready()
+
+    def stop():
+        # The DSP process shuts down, saving its state, when its stdin is closed.
+        process.closeStdin()
+        return mirror.when_lost()
+
+    reactor.addSystemEventTrigger('before', 'shutdown', stop)
+
+    root_state = root.state()
+    config_obj = yield _replicate_service_config(reactor, root_state['service_config'].get())
+    session = _RemoteSession(
+        reactor=reactor,
+        mirror=mirror,
+        proxy=root_state['session'].get(),
+        audio_queue_channels=root_state['audio_queue_channels'].get())
+    defer.returnValue((_RemoteApp(session), config_obj))
+
+
+__all__.append('spawn_dsp_process')
+
+
+@defer.inlineCallbacks
+def _replicate_service_config(reactor, spec):
+    config_obj = Config(reactor)
+    for path in spec[u'db_directories']:
+        config_obj.databases.add_directory(path)
+    if spec[u'writable_db'] is not None:
+        config_obj.databases.add_writable_database(spec[u'writable_db'])
+    for kind, kwargs in spec[u'services']:
+        if kind == u'web':
+            config_obj.serve_web(
+                http_endpoint=str(kwargs[u'http_endpoint']),
+                ws_endpoint=str(kwargs[u'ws_endpoint']),
+                root_cap=kwargs[u'root_cap'],
+                title=kwargs[u'title'])
+        else:
+            raise ConfigException('config.serve_%s is not supported when using a separate DSP process' % (kind,))
+    yield config_obj._wait_and_validate()
+    defer.returnValue(config_obj)
+
+
+class _RemoteApp(object):
+    """Stands in for AppRoot as far as network services need."""
+    def __init__(self, session):
+        self.__session = session
+
+    def get_session(self):
+        return self.__session
+
+    def get_receive_flowgraph(self):
+        # Not available in this process.
+        return None
+
+
+class _RemoteSession(ExportedState):
+    """Counterpart of shinysdr.i.session.Session."""
+    def __init__(self, reactor, mirror, proxy, audio_queue_channels):
+        self.__reactor = reactor
+        self.__mirror = mirror
+        self.__proxy = proxy
+        self.__audio_queue_channels = audio_queue_channels
+        self.__audio = {}
+
+    def state_def(self, callback):
+        super(_RemoteSession, self).state_def(callback)
+        for cell in self.__proxy.state().itervalues():
+            callback(cell)
+
+    def add_audio_queue(self, queue, queue_rate):
+        ring = SharedRing.create(_AUDIO_RING_CAPACITY)
+        self.__mirror.send_command('audio_subscribe', ring.get_path(), queue_rate)
+        loop = LoopingCall(_copy_ring_to_queue, ring, queue)
+        loop.clock = self.__reactor
+        loop.start(_AUDIO_POLL_INTERVAL, now=False)
+        self.__audio[queue] = (ring, loop)
+
+    def remove_audio_queue(self, queue):
+        ring, loop = self.__audio.pop(queue)
+        loop.stop()
+        self.__mirror.send_command('audio_unsubscribe', ring.get_path())
+        ring.close(unlink=True)
+
+    def get_audio_queue_channels(self):
+        return self.__audio_queue_channels
+
+
+def _copy_ring_to_queue(ring, queue):
+    while True:
+        data = ring.read()
+        if data is None:
+            break
+        if not queue.full_p():  # insert_tail would block
+            queue.insert_tail(gr.message_from_string(data))
+
+
+class _DSPProcessRoot(ExportedState):
+    """What the DSP process exports to the web server process."""
+    def __init__(self, app, config_obj):
+        self.__session = app.get_session()
+        self.__service_config = {
+            u'services': config_obj._service_specs,
+            u'db_directories': config_obj.databases._directory_paths,
+            u'writable_db': config_obj.databases._writable_path,
+        }
+
+    @exported_value(type=ReferenceT(), changes='never')
+    def get_session(self):
+        return self.__session
+
+    @exported_value(type=int, changes='never')
+    def get_audio_queue_channels(self):
+        return self.__session.get_audio_queue_channels()
+
+    @exported_value(changes='never')
+    def get_service_config(self):
+        return self.__service_config
+
+
+class _DSPServerProtocol(StateMirrorServerProtocol):
+    def __init__(self, reactor, root_object, session, finished):
+        StateMirrorServerProtocol.__init__(self, root_object)
+        self.__reactor = reactor
+        self.__session = session
+        self.__finished = finished
+        self.__audio = {}
+
+    def connectionLost(self, reason):
+        # pylint: disable=signature-differs
+        for path in self.__audio.keys():
+            self._op_audio_unsubscribe(path)
+        StateMirrorServerProtocol.connectionLost(self, reason)
+        self.__finished.callback(None)
+
+    def _op_audio_subscribe(self, path, queue_rate):
+        queue = gr.msg_queue(limit=100)
+        running = [True]
+        self.__session.add_audio_queue(queue, queue_rate)
+        self.__reactor.callInThread(_copy_queue_to_ring, queue, SharedRing(path), running)
+        self.__audio[path] = (queue, running)
+
+    def _op_audio_unsubscribe(self, path):
+        queue, running = self.__audio.pop(path)
+        self.__session.remove_audio_queue(queue)
+        running[0] = False
+        # Insert a dummy message to ensure the loop thread unblocks.
+        queue.insert_tail(gr.message())
+
+
+def _copy_queue_to_ring(queue, ring, running):
+    # RUNS IN A SEPARATE THREAD.
+    while running[0]:
+        message = queue.delete_head()  # blocking call
+        if message.length() > 0:  # avoid crash bug
+            # If the web server process is not keeping up, the audio is dropped rather than backing up into the flowgraph.
+            ring.write(message.to_string())
+    ring.close()
+
+
+@defer.inlineCallbacks
+def _dsp_process_main(reactor, config_path, force_run):
+    from twisted.internet.stdio import StandardIO
+    from shinysdr.main import configure_logging, _make_app
+
+    state_stream_fd = take_stdout_for_mirror()
+    configure_logging()
+
+    config_obj = Config(reactor)
+    execute_config(config_obj, config_path)
+    yield config_obj._wait_and_validate()
+    app, pfg = _make_app(reactor, config_obj)
+
+    if force_run:
+        # TODO kludge, make this less digging into guts (same as in main)
+        app.get_receive_flowgraph().monitor.get_fft_distributor().subscribe(gr.msg_queue(limit=2))
+
+    finished = defer.Deferred()
+    protocol = _DSPServerProtocol(reactor, _DSPProcessRoot(app, config_obj), app.get_session(), finished)
+    StandardIO(protocol, stdin=0, stdout=state_stream_fd, reactor=reactor)
+    yield finished
+    yield pfg.sync()
+
+
+if __name__ == '__main__':
+    from twisted.internet.task import react
+    react(_dsp_process_main, [sys.argv[1], '--force-run' in sys.argv[2:]])
@@ -21,6 +21,7 @@ from __future__ import absolute_import, division
 
 import json
 
+import numpy
 from zope.interface import Interface
 
 
@@ -68,5 +69,8 @@ def transform_for_json(obj):
         return {k: transform_for_json(v) for k, v in obj.iteritems()}
     elif isinstance(obj, (list, tuple)):
         return map(transform_for_json, obj)
+    elif isinstance(obj, numpy.ndarray):
+        # e.g. the current value of a TrackHistory cell, which is included in the cell's description
+        return transform_for_json(obj.tolist())
     else:
         return obj
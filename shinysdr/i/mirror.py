@@ -0,0 +1,487 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Mirroring of ExportedState/Cell trees between processes.
+
+The serving side runs the same state stream protocol as the WebSocket interface (StateStreamInner), framed as netstrings instead of WebSocket messages. The mirroring side reconstructs the tree as proxy objects which can be used, and re-exported, as if they were local. Setting a proxy cell is asynchronous: the new value is visible once the serving side has reported it back.
+
+The contents of StreamCells do not go through the protocol stream; each subscription to a proxy StreamCell gets a SharedRing which the serving side writes into.
+"""
+
+from __future__ import absolute_import, division
+
+import json
+import os
+import struct
+import sys
+
+import numpy
+
+from twisted.internet import defer
+from twisted.internet.protocol import ProcessProtocol
+from twisted.protocols.basic import NetstringReceiver
+from twisted.python import log
+from twisted.python.reflect import namedAny
+from zope.interface import directlyProvides
+
+from shinysdr.i.network.export_ws import StateStreamInner
+from shinysdr.i.poller import the_subscription_context
+from shinysdr.i.ring import SharedRing
+from shinysdr.types import BulkDataT, RangeT, ReferenceT, ValueType
+from shinysdr.units import Unit
+from shinysdr.values import Command, ExportedState, IWritableCollection, LooseCell, StreamCell, ValueCell
+
+
+__all__ = []  # appended later
+
+
+# The initial state of a device tree is sent as one message, so the default netstring limit is far too small.
+_MAX_MESSAGE_LENGTH = 2 ** 24
+
+# Enough for several seconds of spectrum frames.
+_STREAM_RING_CAPACITY = 2 ** 20
+
+# Methods which may be called on a proxy for an IWritableCollection.
+_COLLECTION_METHODS = frozenset(['create_child', 'delete_child'])
+
+
+class StateMirrorServerProtocol(NetstringReceiver):
+    """Serves the tree rooted at root_object to one StateMirrorClientProtocol.
+
+    Subclasses may handle additional commands (sent with StateMirrorClientProtocol.send_command) by defining methods named _op_<command>.
+    """
+    MAX_LENGTH = _MAX_MESSAGE_LENGTH
+
+    def __init__(self, root_object, subscription_context=the_subscription_context):
+        self.__root_object = root_object
+        self.__subscription_context = subscription_context
+        self.__inner = None
+        self.__streams = {}
+
+    def connectionMade(self):
+        self.__inner = StateStreamInner(
+            self.__send,
+            self.__root_object,
+            u'',
+            subscription_context=self.__subscription_context,
+            stream_cells=False)
+
+    def connectionLost(self, reason):
+        # pylint: disable=signature-differs
+        for path in self.__streams.keys():
+            self._op_stream_unsubscribe(path)
+        if self.__inner is not None:
+            self.__inner.connectionLost(reason)
+            self.__inner = None
+
+    def stringReceived(self, string):
+        # pylint: disable=broad-except
+        # An exception here would otherwise drop the connection, and with it the whole mirror.
+        try:
+            command = json.loads(string)
+            if command[0] == 'set':
+                self.__inner.dataReceived(string)
+            else:
+                getattr(self, '_op_' + command[0])(*command[1:])
+        except Exception as e:
+            log.err(e, 'Error handling mirrored state command')
+
+    def _op_call(self, serial, method, args, message_id):
+        obj = self.__inner._get_registered_object(serial)
+        if not (IWritableCollection.providedBy(obj) and method in _COLLECTION_METHODS):
+            raise Exception('Method %r may not be called on %r' % (method, obj))
+        try:
+            result = getattr(obj, method)(*args)
+        except Exception as e:
+            self.__reply(['error', message_id, unicode(e)])
+            raise
+        self.__reply(['return', message_id, result])
+
+    def _op_stream_subscribe(self, serial, path):
+        cell = self.__inner._get_registered_object(serial)
+        ring = SharedRing(path)
+        subscription = cell.subscribe2(
+            lambda value: ring.write(''.join(str(piece) for piece in value)),
+            self.__subscription_context)
+        self.__streams[path] = (subscription, ring)
+
+    def _op_stream_unsubscribe(self, path):
+        subscription, ring = self.__streams.pop(path)
+        subscription.unsubscribe()
+        ring.close()
+
+    def _flush(self):  # exposed for testing
+        self.__inner._flush()
+
+    def __reply(self, message):
+        # preserve order with respect to state changes already made
+        self.__inner._flush()
+        self.sendString(json.dumps([message]))
+
+    def __send(self, message, safe_to_drop=False):
+        self.sendString(message.encode('utf-8'))
+
+
+__all__.append('StateMirrorServerProtocol')
+
+
+class StateMirrorClientProtocol(NetstringReceiver):
+    """Mirrors the tree served by a StateMirrorServerProtocol.
+
+    Use when_ready() to obtain the proxy for the remote root object.
+    """
+    MAX_LENGTH = _MAX_MESSAGE_LENGTH
+
+    def __init__(self):
+        self.__objects = {}
+        self.__root = None
+        self.__ready_deferreds = []
+        self.__lost_deferreds = []
+        self.__connected = True
+        self.__last_message_id = 0
+        self.__pending = {}
+
+    def when_ready(self):
+        """Return a Deferred which fires with the proxy for the root object once its initial state has been received."""
+        if self.__root is not None:
+            return defer.succeed(self.__root)
+        d = defer.Deferred()
+        self.__ready_deferreds.append(d)
+        return d
+
+    def when_lost(self):
+        """Return a Deferred which fires when the connection has been lost."""
+        if not self.__connected:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.__lost_deferreds.append(d)
+        return d
+
+    def connectionLost(self, reason):
+        # pylint: disable=signature-differs
+        self.__connected = False
+        ready_deferreds = self.__ready_deferreds
+        self.__ready_deferreds = []
+        for d in ready_deferreds:
+            d.errback(reason)
+        lost_deferreds = self.__lost_deferreds
+        self.__lost_deferreds = []
+        for d in lost_deferreds:
+            d.callback(None)
+
+    def send_command(self, *command):
+        """Send a command to be handled by an _op_ method of the server protocol."""
+        self.sendString(json.dumps(command))
+
+    def stringReceived(self, string):
+        for message in json.loads(string):
+            self.__handle(message)
+
+    def _send_set(self, serial, value):
+        """Used by proxy cells. Returns a Deferred which fires when the set has been performed."""
+        message_id, d = self.__new_request()
+        self.send_command('set', serial, value, message_id)
+        return d
+
+    def _call(self, serial, method, args):
+        """Used by proxy blocks. Returns a Deferred for the return value of the method."""
+        message_id, d = self.__new_request()
+        self.send_command('call', serial, method, args, message_id)
+        return d
+
+    def __new_request(self):
+        self.__last_message_id += 1
+        d = defer.Deferred()
+        self.__pending[self.__last_message_id] = d
+        return self.__last_message_id, d
+
+    def __handle(self, message):
+        op = message[0]
+        if op == 'register_block':
+            _, serial, _url, interface_names = message
+            self.__objects[serial] = _ProxyBlock(self, serial, interface_names)
+        elif op == 'register_cell':
+            _, serial, url, description = message
+            key = url.rsplit('/', 1)[-1]
+            if description[u'type'] == u'command_cell':
+                cell = _make_proxy_command(self, serial, key, description)
+            elif _is_stream_description(description):
+                cell = _ProxyStreamCell(self, serial, key, description)
+            else:
+                cell = _ProxyCell(self, serial, key, description)
+            self.__objects[serial] = cell
+        elif op == 'value':
+            _, serial, value = message
+            if serial == 0:
+                self.__set_root(self.__objects[value])
+                return
+            target = self.__objects[serial]
+            if isinstance(target, _ProxyBlock):
+                target._set_cells({k: self.__objects[s] for k, s in value.iteritems()})
+            elif target.type().is_reference():
+                target.set_internal(self.__objects[value])
+            else:
+                target.set_internal(value)
+        elif op == 'delete':
+            _, serial = message
+            del self.__objects[serial]
+        elif op == 'done':
+            _, message_id = message
+            self.__pending.pop(message_id).callback(None)
+        elif op == 'return':
+            _, message_id, value = message
+            self.__pending.pop(message_id).callback(value)
+        elif op == 'error':
+            _, message_id, error_message = message
+            self.__pending.pop(message_id).errback(Exception(error_message))
+        else:
+            log.msg('Unrecognized mirrored state op received: %r' % (message,))
+
+    def __set_root(self, root):
+        self.__root = root
+        deferreds = self.__ready_deferreds
+        self.__ready_deferreds = []
+        for d in deferreds:
+            d.callback(root)
+
+
+__all__.append('StateMirrorClientProtocol')
+
+
+def spawn_mirrored_process(reactor, module_name, args=()):
+    """Run "python -m <module_name> <args>" with its stdin and stdout connected to a StateMirrorClientProtocol.
+
+    The module should call take_stdout_for_mirror() and then serve a StateMirrorServerProtocol using twisted.internet.stdio.StandardIO. The process should exit when its stdin is closed.
+
+    Returns (process, mirror).
+    """
+    env = dict(os.environ)
+    # the child must be able to import the same modules as we can
+    env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+    mirror = StateMirrorClientProtocol()
+    process = reactor.spawnProcess(
+        _MirrorProcessProtocol(mirror, module_name),
+        sys.executable,
+        env=env,
+        args=[sys.executable, '-m', module_name] + list(args),
+        childFDs={
+            0: 'w',
+            1: 'r',
+            2: 2,
+        })
+    return process, mirror
+
+
+__all__.append('spawn_mirrored_process')
+
+
+def take_stdout_for_mirror():
+    """For use in a process started by spawn_mirrored_process.
+
+    Reserves the original stdout for the mirror protocol and sends anything else written to stdout (e.g. banners printed by drivers) to stderr. This should be done before anything else is done. Returns the file descriptor to use for the protocol.
+    """
+    fd = os.dup(1)
+    os.dup2(2, 1)
+    return fd
+
+
+__all__.append('take_stdout_for_mirror')
+
+
+class _MirrorProcessProtocol(ProcessProtocol):
+    def __init__(self, mirror, name):
+        self.__mirror = mirror
+        self.__name = name
+
+    def connectionMade(self):
+        self.__mirror.makeConnection(self.transport)
+
+    def outReceived(self, data):
+        self.__mirror.dataReceived(data)
+
+    def processEnded(self, reason):
+        log.msg('Process %s exited: %s' % (self.__name, reason.getErrorMessage()))
+        self.__mirror.connectionLost(reason)
+
+
+class _ProxyBlock(ExportedState):
+    def __init__(self, mirror, serial, interface_names):
+        self.__mirror = mirror
+        self.__serial = serial
+        self.__cells = {}
+        interfaces = []
+        for name in interface_names:
+            try:
+                interfaces.append(namedAny(name))
+            except (AttributeError, ImportError, ValueError):
+                # interface from a plugin that is not loaded here; clients will not see it
+                pass
+        directlyProvides(self, *interfaces)
+
+    def state_is_dynamic(self):
+        return True
+
+    def state_def(self, callback):
+        super(_ProxyBlock, self).state_def(callback)
+        for cell in self.__cells.itervalues():
+            callback(cell)
+
+    def close(self):
+        """Proxies may stand in for components; the remote side is responsible for closing the real object."""
+
+    # implements IWritableCollection, if the remote object does
+    def create_child(self, desc):
+        """Returns a Deferred for the key of the new child."""
+        return self.__mirror._call(self.__serial, 'create_child', [desc])
+
+    # implements IWritableCollection, if the remote object does
+    def delete_child(self, key):
+        return self.__mirror._call(self.__serial, 'delete_child', [key])
+
+    def _set_cells(self, cells):
+        self.__cells = cells
+        self.state_shape_changed()
+
+
+def _naming_kwargs(description):
+    naming = description[u'metadata'][u'naming']
+    return dict(
+        label=naming[u'label'],
+        description=naming[u'description'],
+        sort_key=naming[u'sort_key'])
+
+
+class _ProxyCell(LooseCell):
+    def __init__(self, mirror, serial, key, description):
+        metadata = description[u'metadata']
+        value_type = type_from_json(metadata[u'value_type'])
+        LooseCell.__init__(self,
+            key=key,
+            value=None if value_type.is_reference() else description[u'current'],
+            type=value_type,
+            persists=metadata[u'persists'],
+            writable=description[u'writable'],
+            **_naming_kwargs(description))
+        self.__mirror = mirror
+        self.__serial = serial
+
+    def set(self, value):
+        if not self.isWritable():
+            raise Exception('Not writable.')
+        return self.__mirror._send_set(self.__serial, value)
+
+
+def _make_proxy_command(mirror, serial, key, description):
+    return Command(
+        target=object(),
+        key=key,
+        function=lambda: mirror._send_set(serial, None),
+        **_naming_kwargs(description))
+
+
+def _is_stream_description(description):
+    value_type = description[u'metadata'][u'value_type']
+    return isinstance(value_type, dict) and value_type.get(u'type') == u'BulkDataT'
+
+
+class _ProxyStreamCell(StreamCell):
+    def __init__(self, mirror, serial, key, description):
+        # pylint: disable=non-parent-init-called, super-init-not-called
+        # StreamCell's constructor expects the local distributor methods.
+        ValueCell.__init__(self,
+            target=object(),
+            key=key,
+            type=type_from_json(description[u'metadata'][u'value_type']),
+            writable=False,
+            persists=False,
+            **_naming_kwargs(description))
+        self.__mirror = mirror
+        self.__serial = serial
+
+    def subscribe_to_stream(self):
+        ring = SharedRing.create(_STREAM_RING_CAPACITY)
+        path = ring.get_path()
+        self.__mirror.send_command('stream_subscribe', self.__serial, path)
+
+        def close():
+            self.__mirror.send_command('stream_unsubscribe', path)
+            ring.close(unlink=True)
+
+        return _RingStreamReader(ring, close, self.type())
+
+    def get(self):
+        # Only the streamed values are available.
+        return None
+
+
+class _RingStreamReader(object):
+    """Counterpart of values._MessageSplitter, reading already-split items from a SharedRing."""
+    def __init__(self, ring, close, type):
+        self.__ring = ring
+        self.__info_struct = struct.Struct(type.get_info_format())
+        self.__dtype = numpy.dtype(type.get_array_format())
+        self.close = close  # provided as method
+
+    def get(self, binary=False):
+        data = self.__ring.read()
+        if data is None:
+            return None
+        elif binary:
+            return (data,)
+        else:
+            info_size = self.__info_struct.size
+            return (
+                self.__info_struct.unpack(data[:info_size]),
+                numpy.frombuffer(data, dtype=self.__dtype, offset=info_size))
+
+
+class _RemoteT(ValueType):
+    """A type known only by its JSON description. Values are not coerced locally; the remote side does that."""
+    def __init__(self, json_description):
+        self.__json = json_description
+
+    def to_json(self):
+        return self.__json
+
+    def __call__(self, specimen):
+        return specimen
+
+
+def type_from_json(json_description):
+    """Reconstruct a ValueType from its to_json() form, as far as is needed to use it locally.
+
+    RangeT, ReferenceT, and BulkDataT are reconstructed because other code inspects them (e.g. Device requires a RangeT VFO cell); other types are opaque.
+    """
+    type_name = json_description.get(u'type') if isinstance(json_description, dict) else None
+    if json_description == u'reference':
+        return ReferenceT()
+    elif type_name == u'RangeT':
+        unit = json_description[u'unit']
+        return RangeT(
+            [tuple(subrange) for subrange in json_description[u'subranges']],
+            unit=Unit(unit[u'symbol'], unit[u'si_prefix_ok']),
+            logarithmic=json_description[u'logarithmic'],
+            integer=json_description[u'integer'])
+    elif type_name == u'BulkDataT':
+        return BulkDataT(
+            info_format=str(json_description[u'info_format']),
+            array_format=str(json_description[u'array_format']))
+    else:
+        return _RemoteT(json_description)
+
+
+__all__.append('type_from_json')
@@ -242,7 +242,8 @@ def _put_session(container_resource, session, wcommon, reactor, title, read_only
     container_resource.putChild('wdb', shinysdr.i.db.DatabaseResource(writable_db))
     
     # Debug graph
-    container_resource.putChild('flow-graph', FlowgraphVizResource(reactor, flowgraph_for_debug))
+    if flowgraph_for_debug is not None:  # None if the flowgraph is in another process
+        container_resource.putChild('flow-graph', FlowgraphVizResource(reactor, flowgraph_for_debug))
     
     # Ephemeris
     container_resource.putChild('ephemeris', EphemerisResource())
@@ -24,7 +24,9 @@ import os.path
 import urllib
 import weakref
 
+from twisted.internet import defer
 from twisted.internet.protocol import ProcessProtocol
+from twisted.python import log
 from twisted.web.resource import Resource
 from twisted.web.server import NOT_DONE_YET
 from twisted.web import template
@@ -131,12 +133,24 @@ class BlockResource(Resource):
             raise Exception('Block is not a writable collection')
         assert request.getHeader('Content-Type') == 'application/json'
         reqjson = json.load(request.content)
-        key = block.create_child(reqjson)  # note may fail
-        url = request.prePathURL() + '/receivers/' + urllib.quote(key, safe='')
-        request.setResponseCode(201)  # Created
-        request.setHeader('Location', url)
-        # TODO consider a more useful response
-        return serialize(url).encode('utf-8')
+        # create_child may return a Deferred if the block is a proxy for one in another process (shinysdr.i.mirror).
+        d = defer.maybeDeferred(block.create_child, reqjson)  # note may fail
+        
+        def created(key):
+            url = request.prePathURL() + '/receivers/' + urllib.quote(key, safe='')
+            request.setResponseCode(201)  # Created
+            request.setHeader('Location', url)
+            # TODO consider a more useful response
+            request.write(serialize(url).encode('utf-8'))
+            request.finish()
+        
+        def failed(failure):
+            log.err(failure, 'Error creating child of %r' % (block,))
+            request.setResponseCode(500)
+            request.finish()
+        
+        d.addCallbacks(created, failed)
+        return NOT_DONE_YET
     
     def render_DELETE(self, request):
         self._deleteSelf()
@@ -19,6 +19,7 @@
 
 from __future__ import absolute_import, division
 
+import cStringIO
 import json
 import struct
 import time
@@ -35,6 +36,7 @@ from shinysdr.i.json import serialize
 from shinysdr.i.network.base import CAP_OBJECT_PATH_ELEMENT
 from shinysdr.i.poller import the_subscription_context
 from shinysdr.signals import SignalType
+from shinysdr.telemetry import ITelemetryStore
 from shinysdr.types import ReferenceT
 from shinysdr.values import BaseCell, Cell, ExportedState, StreamCell
 
@@ -44,8 +46,9 @@ _NOT_SPECIFIED_PUMPKIN = object()
 
 class _StateStreamObjectRegistration(object):
     # TODO messy
-    def __init__(self, ssi, subscription_context, obj, serial, url, refcount):
+    def __init__(self, ssi, subscription_context, obj, serial, url, refcount, stream_cells=True):
         self.__ssi = ssi
+        self.__subscription_context = subscription_context
         self.obj = obj
         self.serial = serial
         self.url = url
@@ -56,7 +59,10 @@ class _StateStreamObjectRegistration(object):
         if isinstance(obj, BaseCell):
             self.__obj_is_cell = True
             if isinstance(obj, StreamCell):  # TODO kludge
-                self.__subscription = obj.subscribe2(self.__listen_binary_stream, subscription_context)
+                if stream_cells:
+                    self.__subscription = obj.subscribe2(self.__listen_binary_stream, subscription_context)
+                else:
+                    self.__subscription = None
                 self.send_now_if_needed = lambda: None
             else:
                 self.__subscription = obj.subscribe2(self.__listen_cell, subscription_context)
@@ -70,6 +76,7 @@ class _StateStreamObjectRegistration(object):
             self.send_now_if_needed = lambda: self.__listen_state(self.obj.state())
         else:
             raise TypeError('not a cell or ExportedState: {!r}'.format(obj))
+        self.__view_area = None
         self.__refcount = refcount
     
     def __str__(self):
@@ -92,6 +99,29 @@ class _StateStreamObjectRegistration(object):
         # should be overridden in instance
         raise Exception('This placeholder should never get called')
     
+    def set_view_area(self, area):
+        """Send only the part of a telemetry store's contents near area, a [south, west, north, east] list in degrees, or all of it if area is None."""
+        obj = self.obj
+        if not ITelemetryStore.providedBy(obj):
+            # e.g. a proxy for a store in another process; the client gets all of its contents.
+            return
+        if area is not None:
+            area = tuple(float(x) for x in area)
+            if len(area) != 4:
+                raise ValueError('view area must have 4 elements, not {!r}'.format(area))
+        if area is not None and self.__view_area is not None:
+            self.__subscription.set_area(area)
+        else:
+            self.__subscription.unsubscribe()
+            if area is None:
+                self.__subscription = obj.state_subscribe(self.__listen_state, self.__subscription_context)
+                self.send_now_if_needed = lambda: self.__listen_state(self.obj.state())
+            else:
+                self.__subscription = obj.state_subscribe_area(area, self.__listen_state, self.__subscription_context)
+                self.send_now_if_needed = lambda: self.__listen_state(self.__subscription.get_state())
+            self.send_now_if_needed()
+        self.__view_area = area
+    
     def get_object_which_is_cell(self):
         if not self.__obj_is_cell:
             raise Exception('This object is not a cell')
@@ -117,7 +147,7 @@ class _StateStreamObjectRegistration(object):
     def __listen_binary_stream(self, value):
         if self.__dead:
             return
-        self.__ssi._send1(True, struct.pack('I', self.serial) + value)
+        self.__ssi._send1(True, (struct.pack('I', self.serial),) + value)
     
     def __listen_state(self, state):
         if self.__dead:
@@ -189,8 +219,10 @@ class _StateStreamObjectRegistration(object):
 
 # TODO: Better name for this category of object
 class StateStreamInner(object):
-    def __init__(self, send, root_object, root_url, subscription_context=the_subscription_context):
+    def __init__(self, send, root_object, root_url, subscription_context=the_subscription_context, stream_cells=True):
+        """If stream_cells is false, then StreamCells are registered but their contents are not sent."""
         self.__subscription_context = subscription_context
+        self.__stream_cells = stream_cells
         self._send = send
         self.__root_object = root_object
         self._cell = Cell(self, '_root_object', type=ReferenceT(), changes='never')
@@ -224,9 +256,16 @@ class StateStreamInner(object):
             t1 = time.time()
             # TODO: Define self.__str__ or similar such that we can easily log which client is sending the command
             log.msg('set %s to %r (%1.2fs)' % (registration, value, t1 - t0))
+        elif op == 'view_area':
+            op, serial, area = command
+            self.__registered_serials[serial].set_view_area(area)
         else:
             log.msg('Unrecognized state stream op received: %r' % (command,))
     
+    def _get_registered_object(self, serial):
+        """Return the cell or block registered with the given serial number. Used by shinysdr.i.mirror."""
+        return self.__registered_serials[serial].obj
+    
     def get__root_object(self):
         """Accessor for implementing self._cell."""
         return self.__root_object
@@ -247,7 +286,7 @@ class StateStreamInner(object):
         else:
             self._lastSerial += 1
             serial = self._lastSerial
-            registration = _StateStreamObjectRegistration(ssi=self, subscription_context=self.__subscription_context, obj=obj, serial=serial, url=url, refcount=0)
+            registration = _StateStreamObjectRegistration(ssi=self, subscription_context=self.__subscription_context, obj=obj, serial=serial, url=url, refcount=0, stream_cells=self.__stream_cells)
             self._registered_objs[obj] = registration
             self.__registered_serials[serial] = registration
             if isinstance(obj, BaseCell):
@@ -272,6 +311,9 @@ class StateStreamInner(object):
             self._send_batch = []
     
     def _send1(self, binary, value):
+        """Send a message.
+        
+        If binary is true, value is a tuple of buffers to be concatenated into one binary message. Otherwise it is a JSON-serializable value to be batched."""
         if binary:
             # preserve order by flushing stored non-binary msgs
             # TODO: Implement batching for binary messages.
@@ -415,9 +457,21 @@ class OurStreamProtocol(Protocol):
                 log.err('Dropping connection due to too much data on stream ' + self.transport.location)
                 self.transport.close(reason='Too much data buffered')
         else:
+            if isinstance(message, tuple):
+                message = _join_buffers(message)
             self.transport.write(message)
 
 
+def _join_buffers(buffers):
+    """Concatenate a sequence of str or buffer objects into one str.
+    
+    This is the one place a binary message's payload is copied after leaving its GNU Radio message. The pieces cannot be given to transport.writeSequence because txWS would send each one as a separate WebSocket message."""
+    out = cStringIO.StringIO()
+    for piece in buffers:
+        out.write(piece)
+    return out.getvalue()
+
+
 def _fqn(class_):
     # per http://stackoverflow.com/questions/2020014/get-fully-qualified-class-name-of-an-object-in-python
     return class_.__module__ + '.' + class_.__name__
@@ -15,15 +15,20 @@
 # You should have received a copy of the GNU General Public License
 # along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Tools for persisting ExportedState state to disk."""
+"""Tools for persisting ExportedState state and telemetry to disk."""
 
 from __future__ import absolute_import, division
 
+import cPickle
+from collections import deque
 import json
 import os.path
 import shutil
+import struct
+import threading
 
 from twisted.internet import defer
+from twisted.internet import task
 from twisted.python import log
 
 from shinysdr.values import ExportedState, SubscriptionContext
@@ -50,6 +55,7 @@ class PersistenceFileGlue(object):
         self.__reactor = reactor
         self.__filename = filename
         self.__delayed_write_call = None
+        self.__last_written_state = None
         
         if filename is None:
             self.__pcd = None
@@ -68,7 +74,7 @@ class PersistenceFileGlue(object):
         
         # Start implicit write-to-disk loop, but don't actually write.
         # This is because it is useful in some failure modes to not immediately overwrite a good state file with a bad one on startup.
-        self.__pcd.get()
+        self.__last_written_state = self.__pcd.get()
     
     def sync(self):
         """Ensure that all pending changes have been written before the returned Deferred fires."""
@@ -93,11 +99,16 @@ class PersistenceFileGlue(object):
             self.__delayed_write_call = self.__reactor.callLater(_PERSISTENCE_DELAY, self.__write_immediately)
     
     def __write_immediately(self):
-        log.msg('Performing state write...')
         current_state = self.__pcd.get()
-        with open(self.__filename, 'w') as f:
-            json.dump(current_state, f)
-        log.msg('...done')
+        # Unchanged subtrees are shared with the previous state, so this comparison is cheap.
+        if current_state == self.__last_written_state:
+            log.msg('Skipping state write; no change.')
+        else:
+            log.msg('Performing state write...')
+            with open(self.__filename, 'w') as f:
+                json.dump(current_state, f)
+            self.__last_written_state = current_state
+            log.msg('...done')
         if self.__delayed_write_call and self.__delayed_write_call.active():
             self.__delayed_write_call.cancel()
 
@@ -107,6 +118,8 @@ class PersistenceChangeDetector(object):
     
     root_object: Object to call .state_to_json() on.
     callback: Called exactly once after each .get() when the result changes.
+    
+    The result is computed incrementally: subscriptions are kept between calls to .get(), and only the parts of the state tree which have changed since the previous .get() are re-read.
     """
     
     # This is not itself a cell because we want to be able to be lazy and not do the potentially expensive state_to_json() immediately every time there is a change, whereas subscribe2 requires that the callback be given the current value. TODO revisit.
@@ -116,23 +129,291 @@ class PersistenceChangeDetector(object):
         self.__root = root_object
         self.__callback = callback
         self.__subscription_context = subscription_context
-        self.__subscriptions = []
+        self.__root_node = None
     
     def get(self):
-        self.__clear_subscriptions()
-        return self.__root.state_to_json(subscriber=self.__add_subscription)
+        if self.__root_node is None:
+            # Not created until now so that there are no subscriptions (and no callbacks) until the first get().
+            self.__root_node = _PersistenceNode(self.__root, self.__callback, self.__subscription_context)
+        return self.__root_node.get()
+
+
+class _PersistenceNode(object):
+    """Support for PersistenceChangeDetector: holds the cached state_to_json() result for one ExportedState object, and the subscriptions which invalidate it.
     
-    def __clear_subscriptions(self):
-        subs = self.__subscriptions
-        self.__subscriptions = []
-        for subscription in subs:
+    A node is 'stale' when its cached result might differ from what state_to_json() would return. The first change to a non-stale node is reported via the 'changed' callback, and no more are reported until the next get(); therefore a stale node's ancestors are always also stale.
+    """
+    
+    def __init__(self, obj, changed, subscription_context):
+        self.obj = obj
+        self.__changed = changed
+        self.__subscription_context = subscription_context
+        self.__closed = False
+        
+        # cached result; never mutated after being returned from get(), so it may be shared by the parent's result
+        self.__json = {}
+        # key -> (cell, subscription)
+        self.__cell_subscriptions = {}
+        # key -> _PersistenceNode, for reference cells
+        self.__children = {}
+        
+        # what needs redoing
+        self.__stale = True
+        self.__shape_dirty = True  # set of cells may have changed
+        self.__dirty_keys = set()  # cell values (or referents) may have changed
+        self.__stale_children = set()  # keys of children which are stale
+        
+        self.__shape_subscription = obj.state_subscribe(self.__shape_changed, subscription_context)
+    
+    def get(self):
+        if not self.__stale:
+            return self.__json
+        json = dict(self.__json)
+        cells = self.obj.state()
+        if self.__shape_dirty or not all(key in cells for key in self.__dirty_keys):
+            # A dirty cell may have been removed before the shape change notification reached us.
+            self.__reconcile_cells(json)
+        else:
+            for key in self.__dirty_keys:
+                self.__read_cell(json, key, cells[key])
+        for key in self.__stale_children:
+            if key in self.__children:
+                json[key] = self.__children[key].get()
+        self.__shape_dirty = False
+        self.__dirty_keys = set()
+        self.__stale_children = set()
+        self.__stale = False
+        self.__json = json
+        return json
+    
+    def close(self):
+        """Drop all subscriptions of this node and its children."""
+        self.__closed = True
+        self.__shape_subscription.unsubscribe()
+        for _cell, subscription in self.__cell_subscriptions.itervalues():
             subscription.unsubscribe()
+        self.__cell_subscriptions = {}
+        for child in self.__children.itervalues():
+            child.close()
+        self.__children = {}
+    
+    def __reconcile_cells(self, json):
+        """Update subscriptions and json to match the current set of cells, keeping any which are unchanged."""
+        old_subscriptions = self.__cell_subscriptions
+        self.__cell_subscriptions = {}
+        for key, cell in self.obj.state().iteritems():
+            if not cell.metadata().persists:
+                continue
+            old = old_subscriptions.pop(key, None)
+            if old is not None and old[0] is cell:
+                self.__cell_subscriptions[key] = old
+                if key not in self.__dirty_keys:
+                    # Neither the cell nor its value has changed, so we need not read it again.
+                    continue
+            else:
+                if old is not None:
+                    old[1].unsubscribe()
+                self.__cell_subscriptions[key] = (cell, cell.subscribe2(self.__make_cell_callback(key), self.__subscription_context))
+            self.__read_cell(json, key, cell)
+        for key, (_cell, subscription) in old_subscriptions.iteritems():
+            subscription.unsubscribe()
+            self.__drop_child(key)
+            del json[key]
+    
+    def __read_cell(self, json, key, cell):
+        if cell.type().is_reference():
+            value = cell.get()
+            child = self.__children.get(key)
+            if child is None or child.obj is not value:
+                self.__drop_child(key)
+                child = self.__children[key] = _PersistenceNode(value, self.__make_child_callback(key), self.__subscription_context)
+            json[key] = child.get()
+        else:
+            json[key] = cell.get()
+    
+    def __drop_child(self, key):
+        child = self.__children.pop(key, None)
+        if child is not None:
+            child.close()
+    
+    def __make_cell_callback(self, key):
+        def cell_callback(_value):
+            # ignore value because we may not be going to read it at all
+            self.__dirty_keys.add(key)
+            self.__mark_stale()
+        
+        return cell_callback
+    
+    def __make_child_callback(self, key):
+        def child_callback():
+            self.__stale_children.add(key)
+            self.__mark_stale()
+        
+        return child_callback
+    
+    def __shape_changed(self, _state):
+        self.__shape_dirty = True
+        self.__mark_stale()
+    
+    def __mark_stale(self):
+        if self.__closed:
+            # A subscription callback may already have been scheduled when we unsubscribed.
+            return
+        if not self.__stale:
+            self.__stale = True
+            self.__changed()
+
+
+# Number of recent messages per telemetry object which are kept in telemetry snapshots.
+_SNAPSHOT_MESSAGES_PER_OBJECT = 3
+
+# Number of objects restored from a telemetry snapshot per reactor turn.
+_SNAPSHOT_RESTORE_CHUNK = 100
+
+_SNAPSHOT_MAGIC = 'ShinySDR telemetry snapshot 1\n'
+
+_SNAPSHOT_RECORD_LENGTH = struct.Struct('>I')
+
+
+class TelemetrySnapshotFile(object):
+    """Periodically save the recent messages of a TelemetryStore's objects to a file, and restore them at startup, so that the objects survive a restart.
+    
+    Snapshots are written by a background thread, to a temporary file which then replaces the snapshot file, so an interrupted write cannot damage the previous snapshot. At startup the file is read by a background thread and the objects are restored a chunk at a time on successive reactor turns, so a large snapshot does not delay startup; objects which would already have expired are skipped. No snapshots are written until restoring has finished.
+    """
+    
+    def __init__(self, reactor, store, filename, interval=60):
+        self.__reactor = reactor
+        self.__store = store
+        self.__filename = filename
+        self.__write_lock = threading.Lock()
+        self.__writing = False
+        self.__loaded = False
+        self.__reading_done = False
+        self.__chunks = deque()
+        self.__restore_call = None
+        
+        store.retain_messages(_SNAPSHOT_MESSAGES_PER_OBJECT)
+        self.__loop = task.LoopingCall(self.__write_in_background)
+        self.__loop.clock = reactor
+        self.__loop.start(interval, now=False)
+        _start_thread('telemetry snapshot reader', self.__read)
+    
+    def close(self):
+        """Stop writing periodically, and write a final snapshot before returning."""
+        if self.__loop.running:
+            self.__loop.stop()
+        if self.__restore_call is not None and self.__restore_call.active():
+            self.__restore_call.cancel()
+        if self.__loaded:
+            with self.__write_lock:
+                write_telemetry_snapshot(self.__filename, self.__store.get_snapshot())
+    
+    def __write_in_background(self):
+        if self.__writing or not self.__loaded:
+            return
+        self.__writing = True
+        records = self.__store.get_snapshot()
+        
+        def write():
+            # RUNS IN A SEPARATE THREAD
+            try:
+                with self.__write_lock:
+                    write_telemetry_snapshot(self.__filename, records)
+            except Exception as e:  # pylint: disable=broad-except
+                log.err(e, 'Failed to write telemetry snapshot %r' % (self.__filename,))
+            finally:
+                self.__reactor.callFromThread(self.__write_finished)
+        
+        _start_thread('telemetry snapshot writer', write)
     
-    def __add_subscription(self, subscribe_fn):
-        # TODO: It would be a reasonable strengthening to arrange so that even if the subscriptions misbehave, we do not ever 
-        self.__subscriptions.append(subscribe_fn(self.__do_callback, self.__subscription_context))
+    def __write_finished(self):
+        self.__writing = False
     
-    def __do_callback(self, _value):
-        # ignore value because it is from an arbitrary element
-        self.__clear_subscriptions()
-        self.__callback()
+    def __read(self):
+        # RUNS IN A SEPARATE THREAD
+        chunk = []
+        try:
+            for record in read_telemetry_snapshot(self.__filename):
+                chunk.append(record)
+                if len(chunk) >= _SNAPSHOT_RESTORE_CHUNK:
+                    self.__reactor.callFromThread(self.__add_chunk, chunk)
+                    chunk = []
+        except Exception as e:  # pylint: disable=broad-except
+            log.err(e, 'Failed to read telemetry snapshot %r' % (self.__filename,))
+        finally:
+            self.__reactor.callFromThread(self.__add_chunk, chunk)
+            self.__reactor.callFromThread(self.__finish_reading)
+    
+    def __add_chunk(self, chunk):
+        self.__chunks.append(chunk)
+        self.__schedule_restore()
+    
+    def __finish_reading(self):
+        self.__reading_done = True
+        self.__schedule_restore()
+    
+    def __schedule_restore(self):
+        if self.__restore_call is None:
+            self.__restore_call = self.__reactor.callLater(0, self.__restore_next)
+    
+    def __restore_next(self):
+        self.__restore_call = None
+        if self.__chunks:
+            now = self.__reactor.seconds()
+            for _object_id, expiry, messages in self.__chunks.popleft():
+                if expiry > now:
+                    self.__store.restore(messages)
+        if self.__chunks:
+            self.__schedule_restore()
+        elif self.__reading_done:
+            log.msg('Restored telemetry snapshot %r.' % (self.__filename,))
+            self.__loaded = True
+
+
+def write_telemetry_snapshot(filename, records):
+    """Write records, as returned by TelemetryStore.get_snapshot(), to filename, replacing it atomically.
+    
+    Records which cannot be pickled are omitted.
+    """
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as f:
+        f.write(_SNAPSHOT_MAGIC)
+        for record in records:
+            try:
+                data = cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL)
+            except (cPickle.PicklingError, TypeError) as e:
+                log.msg('Omitting telemetry object %r from snapshot: %s' % (record[0], e))
+                continue
+            f.write(_SNAPSHOT_RECORD_LENGTH.pack(len(data)))
+            f.write(data)
+    os.rename(temp_filename, filename)
+
+
+def read_telemetry_snapshot(filename):
+    """Iterate over the records in a file written by write_telemetry_snapshot(), or nothing if it does not exist.
+    
+    Records which cannot be unpickled (e.g. because the plugin which defined them is gone) are skipped.
+    """
+    if not os.path.isfile(filename):
+        return
+    with open(filename, 'rb') as f:
+        if f.read(len(_SNAPSHOT_MAGIC)) != _SNAPSHOT_MAGIC:
+            raise ValueError('not a telemetry snapshot file')
+        while True:
+            header = f.read(_SNAPSHOT_RECORD_LENGTH.size)
+            if len(header) < _SNAPSHOT_RECORD_LENGTH.size:
+                return
+            (length,) = _SNAPSHOT_RECORD_LENGTH.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            try:
+                yield cPickle.loads(data)
+            except Exception as e:  # pylint: disable=broad-except
+                log.msg('Skipping unreadable telemetry snapshot record: %s' % (e,))
+
+
+def _start_thread(name, target):
+    thread = threading.Thread(name=name, target=target)
+    thread.daemon = True
+    thread.start()
@@ -0,0 +1,291 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Per-block performance figures from GNU Radio's performance counters.
+
+GNU Radio only maintains the counters if they are enabled in its configuration, by setting "on = True" in the [PerfCounters] section of a GNU Radio config file or GR_CONF_PERFCOUNTERS_ON=True in the environment. Otherwise all figures read as zero.
+
+This module is not an external API and not guaranteed to have a stable
+interface.
+"""
+
+from __future__ import absolute_import, division
+
+from collections import OrderedDict
+import re
+import time
+
+from gnuradio import gr
+
+from shinysdr.values import CellDict, CollectionState, ExportedState, command, exported_value
+
+
+__all__ = []  # appended later
+
+
+# Buffer fullness at or above which a sample counts as an overflow (the block's consumer is not keeping up).
+_FULL_THRESHOLD = 0.95
+
+# Hierarchical blocks nested deeper than this are not searched for primitive blocks.
+_MAX_DEPTH = 8
+
+# Number of entries in Diagnostics' ranking.
+_RANKING_LENGTH = 20
+
+_MANGLED_PREFIX = re.compile(r'^_[A-Za-z0-9]+__|^_+')
+
+
+def perf_counters_enabled():
+    return gr.prefs().get_bool('PerfCounters', 'on', False)
+
+
+__all__.append('perf_counters_enabled')
+
+
+def find_primitive_blocks(block):
+    """Return an OrderedDict of names to the primitive (non-hierarchical) blocks which make up block.
+
+    GNU Radio does not let us list the contents of a hier_block2, so this finds the blocks which are attributes of hierarchical blocks (or in lists, tuples, or dicts which are attributes), which is how ShinySDR's blocks retain their parts. Blocks which are not retained are not found.
+    """
+    found = OrderedDict()
+    _search(block, u'', found, set(), 0)
+    return found
+
+
+__all__.append('find_primitive_blocks')
+
+
+def _search(obj, name, found, seen, depth):
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    if isinstance(obj, gr.hier_block2):
+        if depth >= _MAX_DEPTH:
+            return
+        attributes = sorted(((_MANGLED_PREFIX.sub('', attr), value) for attr, value in vars(obj).iteritems()), key=lambda item: item[0])
+        for attr, value in attributes:
+            _search_value(value, _join_name(name, attr), found, seen, depth + 1)
+    elif hasattr(obj, 'pc_work_time_total'):
+        found[name or unicode(type(obj).__name__)] = obj
+
+
+def _search_value(value, name, found, seen, depth):
+    if isinstance(value, (list, tuple)):
+        for i, item in enumerate(value):
+            _search_value(item, _join_name(name, unicode(i)), found, seen, depth)
+    elif isinstance(value, dict):
+        for key, item in sorted(value.iteritems()):
+            _search_value(item, _join_name(name, unicode(key)), found, seen, depth)
+    elif isinstance(value, gr.hier_block2) or hasattr(value, 'pc_work_time_total'):
+        _search(value, name, found, seen, depth)
+
+
+def _join_name(prefix, name):
+    if prefix:
+        return prefix + u'.' + name
+    else:
+        return unicode(name)
+
+
+def _ticks_per_second():
+    return gr.high_res_timer_tps()
+
+
+class BlockProfile(ExportedState):
+    """Performance figures for one primitive block.
+
+    The counters are read at most once per min_interval however often the cells are polled, so the overflow and underrun counts are of samples at that interval rather than of every occurrence.
+    """
+    def __init__(self, block, min_interval=0.5, clock=time.time):
+        self.__block = block
+        self.__min_interval = min_interval
+        self.__clock = clock
+        self.__ticks_per_second = _ticks_per_second()
+        self.__has_outputs = block.output_signature().max_streams() != 0
+        self.__has_inputs = block.input_signature().max_streams() != 0
+
+        self.__time = clock()
+        self.__last_work_time = self.__read_work_time()
+        self.__last_items = self.__read_items()
+        self.__cpu = 0.0
+        self.__item_rate = 0.0
+        self.__input_fullness = 0.0
+        self.__output_fullness = 0.0
+        self.__overflows = 0
+        self.__underruns = 0
+
+    def get_block(self):
+        return self.__block
+
+    @exported_value(type=unicode, changes='never', label='Block type')
+    def get_block_type(self):
+        return unicode(self.__block.name())
+
+    @exported_value(type=float, changes='continuous', label='CPU',
+        description='Fraction of one CPU spent in this block\'s work function.')
+    def get_cpu(self):
+        self.__update()
+        return self.__cpu
+
+    @exported_value(type=float, changes='continuous', label='Items/s',
+        description='Rate of items produced, or consumed if the block has no outputs.')
+    def get_item_rate(self):
+        self.__update()
+        return self.__item_rate
+
+    @exported_value(type=float, changes='continuous', label='Input buffer fullness')
+    def get_input_fullness(self):
+        self.__update()
+        return self.__input_fullness
+
+    @exported_value(type=float, changes='continuous', label='Output buffer fullness')
+    def get_output_fullness(self):
+        self.__update()
+        return self.__output_fullness
+
+    @exported_value(type=int, changes='continuous', label='Overflows',
+        description='Number of times an output buffer was found full, meaning that downstream blocks are not keeping up.')
+    def get_overflows(self):
+        self.__update()
+        return self.__overflows
+
+    @exported_value(type=int, changes='continuous', label='Underruns',
+        description='Number of times all input buffers were found empty. This is normal for blocks which easily keep up with their input, but for an audio sink it means gaps in the audio.')
+    def get_underruns(self):
+        self.__update()
+        return self.__underruns
+
+    def __update(self):
+        now = self.__clock()
+        elapsed = now - self.__time
+        if elapsed <= self.__min_interval:
+            return
+        block = self.__block
+        work_time = self.__read_work_time()
+        items = self.__read_items()
+        self.__cpu = round((work_time - self.__last_work_time) / self.__ticks_per_second / elapsed, 4)
+        self.__item_rate = round((items - self.__last_items) / elapsed, 2)
+        self.__time = now
+        self.__last_work_time = work_time
+        self.__last_items = items
+
+        if self.__has_inputs:
+            self.__input_fullness = round(max(block.pc_input_buffers_full_avg() or [0]), 4)
+            instantaneous = block.pc_input_buffers_full()
+            if instantaneous and max(instantaneous) == 0:
+                self.__underruns += 1
+        if self.__has_outputs:
+            self.__output_fullness = round(max(block.pc_output_buffers_full_avg() or [0]), 4)
+            if max(block.pc_output_buffers_full() or [0]) >= _FULL_THRESHOLD:
+                self.__overflows += 1
+
+    def __read_work_time(self):
+        return self.__block.pc_work_time_total()
+
+    def __read_items(self):
+        try:
+            if self.__has_outputs:
+                return self.__block.nitems_written(0)
+            elif self.__has_inputs:
+                return self.__block.nitems_read(0)
+        except RuntimeError:
+            # block is not currently part of a running flowgraph
+            pass
+        return 0
+
+
+__all__.append('BlockProfile')
+
+
+class BlockGroupProfile(CollectionState):
+    """Performance figures for the primitive blocks making up one block, such as a receiver."""
+    def __init__(self, block, min_interval=0.5, clock=time.time):
+        self.__block = block
+        self.__min_interval = min_interval
+        self.__clock = clock
+        self.__profiles = CellDict(dynamic=True)
+        CollectionState.__init__(self, self.__profiles)
+        self.refresh()
+
+    def get_block(self):
+        return self.__block
+
+    def refresh(self):
+        """Look for primitive blocks again, since the block's contents may have changed."""
+        blocks = find_primitive_blocks(self.__block)
+        for key in list(self.__profiles):
+            if key not in blocks or self.__profiles[key].get_block() is not blocks[key]:
+                del self.__profiles[key]
+        for key, block in blocks.iteritems():
+            if key not in self.__profiles:
+                self.__profiles[key] = BlockProfile(block, min_interval=self.__min_interval, clock=self.__clock)
+
+    def get_profiles(self):
+        return dict(self.__profiles.iteritems())
+
+    @exported_value(type=float, changes='continuous', label='CPU',
+        description='Total fraction of one CPU spent in this group\'s blocks.')
+    def get_total_cpu(self):
+        return round(sum(profile.get_cpu() for profile in self.__profiles.itervalues()), 4)
+
+
+__all__.append('BlockGroupProfile')
+
+
+class Diagnostics(CollectionState):
+    """Performance figures for a flowgraph, grouped by the blocks returned by get_blocks, a function returning a dict of group names to blocks."""
+    def __init__(self, get_blocks, min_interval=0.5, clock=time.time):
+        self.__get_blocks = get_blocks
+        self.__min_interval = min_interval
+        self.__clock = clock
+        self.__groups = CellDict(dynamic=True)
+        CollectionState.__init__(self, self.__groups)
+
+    def refresh(self):
+        """Update the groups and look for primitive blocks again, reusing existing groups for the same blocks."""
+        blocks = self.__get_blocks()
+        for key in list(self.__groups):
+            if key not in blocks or self.__groups[key].get_block() is not blocks[key]:
+                del self.__groups[key]
+        for key, block in blocks.iteritems():
+            if key in self.__groups:
+                self.__groups[key].refresh()
+            else:
+                self.__groups[key] = BlockGroupProfile(block, min_interval=self.__min_interval, clock=self.__clock)
+
+    @command(label='Rescan blocks',
+        description='Needed only if a block has changed its contents without the flow graph being reconnected, such as a receiver changing mode.')
+    def rescan(self):
+        self.refresh()
+
+    @exported_value(type=bool, changes='never', label='Performance counters enabled')
+    def get_enabled(self):
+        return perf_counters_enabled()
+
+    @exported_value(changes='continuous', label='Most expensive blocks')
+    def get_ranking(self):
+        """The blocks with the highest CPU use, most expensive first, as a list of [group.block name, CPU] pairs."""
+        entries = [
+            (group_key + u'.' + block_key, profile.get_cpu())
+            for group_key, group in self.__groups.iteritems()
+            for block_key, profile in group.get_profiles().iteritems()
+        ]
+        entries.sort(key=lambda entry: (-entry[1], entry[0]))
+        return [list(entry) for entry in entries[:_RANKING_LENGTH]]
+
+
+__all__.append('Diagnostics')
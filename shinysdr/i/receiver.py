@@ -17,6 +17,7 @@
 
 from __future__ import absolute_import, division
 
+from collections import OrderedDict
 import time
 
 from twisted.python import log
@@ -27,6 +28,7 @@ from gnuradio import gr
 from gnuradio import blocks
 
 from shinysdr.i.modes import get_modes, lookup_mode
+from shinysdr.i.recording import AudioRecorder
 from shinysdr.interfaces import ITunableDemodulator
 from shinysdr.math import dB, rotator_inc, to_dB
 from shinysdr.signals import SignalType
@@ -42,6 +44,9 @@ _audio_power_minimum_amplitude = dB(_audio_power_minimum_dB)
 
 _dummy_audio_rate = 2000
 
+# Number of previously used demodulators each receiver keeps for reuse
+_demodulator_cache_size = 3
+
 
 class IReceiver(Interface):
     """
@@ -58,6 +63,7 @@ class Receiver(gr.hier_block2, ExportedState):
             freq_absolute=100.0,
             freq_relative=None,
             freq_linked_to_device=False,
+            decode_always=False,
             audio_destination=None,
             device_name=None,
             audio_gain=-6,
@@ -90,6 +96,9 @@ class Receiver(gr.hier_block2, ExportedState):
         self.audio_gain = audio_gain
         self.audio_pan = min(1, max(-1, audio_pan))
         self.__audio_destination = audio_destination
+        self.__decode_always = bool(decode_always)
+        self.__record = False
+        self.__record_squelch_gated = False
         
         # Receive frequency.
         self.__freq_linked_to_device = bool(freq_linked_to_device)
@@ -100,12 +109,24 @@ class Receiver(gr.hier_block2, ExportedState):
             self.__freq_absolute = float(freq_absolute)
             self.__freq_relative = self.__freq_absolute - self.__get_device().get_freq()
         
+        # Input selection; see __make_demodulator
+        self.__channelized = False
+        self.__input_channel = None
+        
+        # Demodulators not currently in use, most recently used last, keyed by (mode, input rate).
+        self.__demodulator_cache = OrderedDict()
+        self.__demodulator_input_rate = None
+        
         # Blocks
         self.__rotator = blocks.rotator_cc()
         self.__demodulator = self.__make_demodulator(mode, {})
         self.__update_demodulator_info()
         self.__audio_gain_block = blocks.multiply_const_vff([0.0] * audio_channels)
         self.probe_audio = analog.probe_avg_mag_sqrd_f(0, alpha=10.0 / 44100)  # TODO adapt to output audio rate
+        self.__recorder = AudioRecorder(
+            settings=context.get_recording_settings(),
+            get_name=self.__get_recording_name,
+            squelch_open=self.__is_squelch_open)
         
         # Other internals
         self.__last_output_type = None
@@ -128,6 +149,31 @@ class Receiver(gr.hier_block2, ExportedState):
     
     def __do_connect(self, reason):
         # log.msg(u'receiver do_connect: %s' % (reason,))
+        
+        # Construct all needed blocks before locking, so that the flow graph is stopped only while connections are changed.
+        if self.__demod_output:
+            if self.__demod_stereo:
+                # Construct stereo-to-mono conversion (used at least for level probe)
+                splitter = blocks.vector_to_streams(gr.sizeof_float, 2)
+                mono_audio = blocks.multiply_matrix_ff(((0.5, 0.5),))
+            else:
+                splitter = None
+                mono_audio = self.__demodulator
+            if self.__audio_channels == 2 and not self.__demod_stereo:
+                duplicator = blocks.streams_to_vector(gr.sizeof_float, 2)
+            else:
+                duplicator = None
+        else:
+            # Dummy output, ignored by containing block
+            dummy_source = blocks.vector_source_f([], vlen=self.__audio_channels)
+        if self.__record and self.__demod_output:
+            # Recorded before the gain stage, so that it is independent of listening volume.
+            record_sink = self.__recorder.get_sink(
+                sample_rate=self.__output_type.get_sample_rate(),
+                channels=2 if self.__demod_stereo else 1)
+        else:
+            record_sink = None
+        
         self.context.lock()
         try:
             self.disconnect_all()
@@ -139,15 +185,10 @@ class Receiver(gr.hier_block2, ExportedState):
                 self.connect(self, self.__rotator, self.__demodulator)
             
             if self.__demod_output:
-                # Construct stereo-to-mono conversion (used at least for level probe)
-                if self.__demod_stereo:
-                    splitter = blocks.vector_to_streams(gr.sizeof_float, 2)
-                    mono_audio = blocks.multiply_matrix_ff(((0.5, 0.5),))
+                if splitter is not None:
                     self.connect(self.__demodulator, splitter)
                     self.connect((splitter, 0), (mono_audio, 0))
                     self.connect((splitter, 1), (mono_audio, 1))
-                else:
-                    mono_audio = self.__demodulator
                 
                 # Connect mono audio to level probe
                 self.connect(mono_audio, self.probe_audio)
@@ -158,7 +199,6 @@ class Receiver(gr.hier_block2, ExportedState):
                     self.connect(self.__demodulator, self.__audio_gain_block)
                 elif self.__audio_channels == 2 and not self.__demod_stereo:
                     # mono to stereo
-                    duplicator = blocks.streams_to_vector(gr.sizeof_float, 2)
                     self.connect(self.__demodulator, (duplicator, 0))
                     self.connect(self.__demodulator, (duplicator, 1))
                     self.connect(duplicator, self.__audio_gain_block)
@@ -170,17 +210,20 @@ class Receiver(gr.hier_block2, ExportedState):
                     
                 # Connect gain control to output of receiver
                 self.connect(self.__audio_gain_block, self)
+                
+                if record_sink is not None:
+                    self.connect(self.__demodulator, record_sink)
             else:
-                # Dummy output, ignored by containing block
-                self.connect(
-                    blocks.vector_source_f([], vlen=self.__audio_channels),
-                    self)
+                self.connect(dummy_source, self)
             
             if self.__output_type != self.__last_output_type:
                 self.__last_output_type = self.__output_type
                 self.context.changed_needed_connections(u'changed output type')
         finally:
             self.context.unlock()
+        
+        if record_sink is None:
+            self.__recorder.stop()
     
     def get_output_type(self):
         return self.__output_type
@@ -212,7 +255,7 @@ class Receiver(gr.hier_block2, ExportedState):
         if self.__device_name != value:
             self.__device_name = value
             self.changed_device_freq()  # freq
-            self._rebuild_demodulator(reason=u'changed device, thus maybe sample rate')  # rate
+            self._rebuild_demodulator(reason=u'changed device, thus maybe sample rate', reuse=True)  # rate
             self.context.changed_needed_connections(u'changed device')
     
     # type construction is deferred because we don't want loading this file to trigger loading plugins
@@ -231,7 +274,7 @@ class Receiver(gr.hier_block2, ExportedState):
             self.__demodulator.set_mode(mode)
             self.mode = mode
         else:
-            self._rebuild_demodulator(mode=mode, reason=u'changed mode')
+            self._rebuild_demodulator(mode=mode, reason=u'changed mode', reuse=True)
 
     # TODO: rename rec_freq to just freq
     @exported_value(
@@ -275,6 +318,26 @@ class Receiver(gr.hier_block2, ExportedState):
     def set_freq_linked_to_device(self, value):
         self.__freq_linked_to_device = bool(value)
     
+    @exported_value(
+        type=bool,
+        changes='this_setter',
+        label='Decode always',
+        description='Keep this receiver running even when nobody is listening to its audio or watching its output. Receivers in telemetry modes, such as APRS, always run.')
+    def get_decode_always(self):
+        return self.__decode_always
+    
+    @setter
+    def set_decode_always(self, value):
+        value = bool(value)
+        if value != self.__decode_always:
+            self.__decode_always = value
+            self.context.changed_needed_connections(u'changed decode_always')
+    
+    def is_telemetry(self):
+        """Return whether this receiver's mode produces telemetry messages, which are wanted even if nothing consumes its audio."""
+        mode_def = lookup_mode(self.mode)
+        return mode_def is not None and mode_def.telemetry
+    
     # TODO: support non-audio demodulators at which point these controls should be optional
     @exported_value(
         parameter='audio_gain',
@@ -301,6 +364,54 @@ class Receiver(gr.hier_block2, ExportedState):
         self.audio_pan = value
         self.__update_audio_gain()
     
+    @exported_value(
+        type=bool,
+        changes='this_setter',
+        label='Record',
+        description='Record this receiver\'s audio to a file on the server.')
+    def get_record(self):
+        return self.__record
+    
+    @setter
+    def set_record(self, value):
+        value = bool(value)
+        if value == self.__record:
+            return
+        if value and not self.__recorder.is_available():
+            raise ValueError('Recording is not enabled in the server configuration.')
+        self.__record = value
+        self.__do_connect(reason=u'changed record')
+        self.context.changed_needed_connections(u'changed record')
+    
+    @exported_value(
+        type=bool,
+        changes='this_setter',
+        label='Record only when squelch is open')
+    def get_record_squelch_gated(self):
+        return self.__record_squelch_gated
+    
+    @setter
+    def set_record_squelch_gated(self, value):
+        self.__record_squelch_gated = bool(value)
+        self.__recorder.set_squelch_gated(self.__record_squelch_gated)
+    
+    @exported_value(type=ReferenceT(), changes='never')
+    def get_recorder(self):
+        return self.__recorder
+    
+    def close(self):
+        """Stop recording, since this receiver is no longer going to be used."""
+        self.__recorder.stop()
+    
+    def __get_recording_name(self):
+        # called from the recording thread
+        return u'%s-%s-%iHz' % (self.context.get_receiver_key(), self.mode, self.__freq_absolute)
+    
+    def __is_squelch_open(self):
+        # called from the recording thread
+        squelch_block = getattr(self.__demodulator, 'rf_squelch_block', None)  # from SquelchMixin
+        return squelch_block is None or squelch_block.unmuted()
+    
     @exported_value(
         type_fn=lambda self: self.context.get_audio_destination_type(),
         changes='this_setter',
@@ -339,33 +450,65 @@ class Receiver(gr.hier_block2, ExportedState):
             return _audio_power_minimum_dB
     
     def __update_rotator(self):
-        device = self.__get_device()
-        sample_rate = device.get_rx_driver().get_output_type().get_sample_rate()
+        channelizer = self.context.get_channelizer(self.__device_name) if self.__channelized else None
+        if channelizer is not None:
+            (channel, channel_freq) = channelizer.nearest_channel(self.__freq_relative)
+            sample_rate = channelizer.get_output_rate()
+        else:
+            channel = None
+            channel_freq = 0
+            sample_rate = self.__get_device().get_rx_driver().get_output_type().get_sample_rate()
+        if channel != self.__input_channel:
+            self.__input_channel = channel
+            self.context.changed_needed_connections(u'changed input channel')
+        offset = self.__freq_relative - channel_freq
         if self.__demod_tunable:
             # TODO: Method should perhaps be renamed to convey that it is relative
-            self.__demodulator.set_rec_freq(self.__freq_relative)
+            self.__demodulator.set_rec_freq(offset)
         else:
-            self.__rotator.set_phase_inc(rotator_inc(rate=sample_rate, shift=-self.__freq_relative))
+            self.__rotator.set_phase_inc(rotator_inc(rate=sample_rate, shift=-offset))
+    
+    def get_input_channel(self):
+        """Return the index of the device's ChannelizerBank output this receiver should be connected to, or None if it should be connected to the device directly."""
+        return self.__input_channel
+    
+    def explain_filters(self):
+        """Return a description of the channel filtering of this receiver's input, starting with any stage shared with other receivers."""
+        parts = []
+        if self.__input_channel is not None:
+            parts.append(self.context.get_channelizer(self.__device_name).explain_channel(self.__input_channel))
+        band_filter = getattr(self.__demodulator, 'band_filter_block', None)
+        if band_filter is not None and hasattr(band_filter, 'explain'):
+            parts.append(band_filter.explain())
+        return '\n'.join(parts)
     
     def __get_device(self):
         return self.context.get_device(self.__device_name)
     
     # called from facet
-    def _rebuild_demodulator(self, mode=None, reason='<unspecified>'):
-        self.__rebuild_demodulator_nodirty(mode)
+    def _rebuild_demodulator(self, mode=None, reason='<unspecified>', reuse=False):
+        """Replace the demodulator.
+        
+        If reuse is true, then a previously used demodulator for the mode and input rate may be used, and the current one is kept for reuse; otherwise, a new one is constructed and the current one is discarded."""
+        self.__rebuild_demodulator_nodirty(mode, reuse)
         self.__do_connect(reason=u'demodulator rebuilt: %s' % (reason,))
         # TODO write a test showing that revalidate is needed and works
         self.context.revalidate(tuning=False)  # in case our bandwidth changed
         self.state_changed('is_valid')
 
-    def __rebuild_demodulator_nodirty(self, mode=None):
+    def __rebuild_demodulator_nodirty(self, mode=None, reuse=False):
         if self.__demodulator is None:
             defaults = {}
         else:
             defaults = self.__demodulator.state_to_json()
+            if reuse:
+                cache = self.__demodulator_cache
+                cache[(self.mode, self.__demodulator_input_rate)] = self.__demodulator
+                while len(cache) > _demodulator_cache_size:
+                    cache.popitem(last=False)
         if mode is None:
             mode = self.mode
-        self.__demodulator = self.__make_demodulator(mode, defaults)
+        self.__demodulator = self.__make_demodulator(mode, defaults, reuse=reuse)
         self.__update_demodulator_info()
         self.__update_rotator()
         self.mode = mode
@@ -375,9 +518,42 @@ class Receiver(gr.hier_block2, ExportedState):
         self.__audio_gain_block = blocks.multiply_const_vff([0.0] * self.__audio_channels)
         self.__update_audio_gain()
 
-    def __make_demodulator(self, mode, state):
-        """Returns the demodulator."""
+    def __make_demodulator(self, mode, state, reuse=False):
+        """Returns the demodulator.
+        
+        If the device has a ChannelizerBank, the demodulator is first built for its channel rate, and used if its passband fits within a channel; otherwise it is built for the full device rate. Sets self.__channelized accordingly.
+        
+        If reuse is true and a demodulator for an applicable rate is in the cache, it is returned instead of constructing one."""
+        
+        channelizer = self.context.get_channelizer(self.__device_name)
+        device_rate = self.__get_device().get_rx_driver().get_output_type().get_sample_rate()
+        
+        if reuse:
+            candidates = [(device_rate, False)]
+            if channelizer is not None:
+                candidates.insert(0, (channelizer.get_output_rate(), True))
+            for input_rate, channelized in candidates:
+                demodulator = self.__demodulator_cache.pop((mode, input_rate), None)
+                if demodulator is not None:
+                    log.msg('Reusing %s demodulator at %s samples/s.' % (mode, input_rate))
+                    self.__channelized = channelized
+                    self.__demodulator_input_rate = input_rate
+                    return demodulator
+        
+        if channelizer is not None:
+            input_rate = channelizer.get_output_rate()
+            demodulator = self.__make_demodulator_at(mode, state, input_rate)
+            shape = demodulator.get_band_filter_shape()
+            max_half_width = channelizer.get_max_signal_half_width()
+            if -shape['low'] <= max_half_width and shape['high'] <= max_half_width:
+                self.__channelized = True
+                self.__demodulator_input_rate = input_rate
+                return demodulator
+        self.__channelized = False
+        self.__demodulator_input_rate = device_rate
+        return self.__make_demodulator_at(mode, state, device_rate)
 
+    def __make_demodulator_at(self, mode, state, input_rate):
         t0 = time.time()
         
         mode_def = lookup_mode(mode)
@@ -393,7 +569,7 @@ class Receiver(gr.hier_block2, ExportedState):
         
         init_kwargs = dict(
             mode=mode,
-            input_rate=self.__get_device().get_rx_driver().get_output_type().get_sample_rate(),
+            input_rate=input_rate,
             context=facet)
         demodulator = unserialize_exported_state(
             ctor=clas,
@@ -402,7 +578,7 @@ class Receiver(gr.hier_block2, ExportedState):
         
         # until _enabled, ignore any callbacks resulting from unserialization calling setters
         facet._enabled = True
-        log.msg('Constructed %s demodulator: %i ms.' % (mode, (time.time() - t0) * 1000))
+        log.msg('Constructed %s demodulator at %s samples/s: %i ms.' % (mode, input_rate, (time.time() - t0) * 1000))
         return demodulator
 
     def __update_audio_gain(self):
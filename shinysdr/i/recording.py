@@ -0,0 +1,490 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Recording receiver audio and device IQ samples to files.
+
+The flow graph only ever puts samples into an unbounded GNU Radio message queue. A drain thread moves them into a bounded queue, dropping (and counting) samples if that queue is full, and a writer thread writes them to disk; so slow disk I/O never blocks signal processing.
+
+This module is not an external API and not guaranteed to have a stable
+interface.
+"""
+
+from __future__ import absolute_import, division
+
+from collections import namedtuple
+import os
+import os.path
+import json
+import Queue
+import re
+import sys
+import threading
+import time
+import wave
+
+import numpy
+
+from gnuradio import blocks
+from gnuradio import gr
+
+from shinysdr.types import NoticeT
+from shinysdr.values import ExportedState, exported_value, setter
+
+
+__all__ = []  # appended later
+
+
+RECORDING_FORMATS = ('wav', 'raw')
+
+__all__.append('RECORDING_FORMATS')
+
+
+RecordingSettings = namedtuple('RecordingSettings', [
+    'directory',  # where to put files
+    'file_format',  # one of RECORDING_FORMATS
+    'rotate_interval',  # seconds of audio after which a new file is started
+    'min_free_bytes',  # recording pauses when the filesystem has less space than this
+    'queue_length',  # number of chunks of audio which may wait for the writer before audio is dropped
+])
+
+__all__.append('RecordingSettings')
+
+
+# How often the writer checks the free space while writing.
+_SPACE_CHECK_INTERVAL = 10.0
+
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class _Recorder(ExportedState):
+    """Common parts of AudioRecorder and IQRecorder: the current _RecordingSession and the cells describing it."""
+    def __init__(self, settings):
+        self._settings = settings
+        self.__session = None
+        self.__session_format = None
+        self.__ended_dropped = 0
+
+    def is_available(self):
+        return self._settings is not None
+
+    def _get_session_sink(self, session_format, make_session):
+        """Return the sink of the current session if it has the given format, or else stop it and start a new one by calling make_session."""
+        if self.__session is not None and self.__session_format == session_format:
+            return self.__session.get_sink()
+        self.stop()
+        self.__session = make_session()
+        self.__session_format = session_format
+        return self.__session.get_sink()
+
+    def stop(self):
+        """Stop recording. The sink must already have been disconnected.
+
+        The file is finished in the background."""
+        if self.__session is not None:
+            self.__session.stop()
+            self.__ended_dropped += self.__session.get_dropped()
+            self.__session = None
+            self.__session_format = None
+
+    @exported_value(type=NoticeT(always_visible=False), changes='continuous')
+    def get_status(self):
+        if self.__session is None:
+            return u''
+        return self.__session.get_status()
+
+    @exported_value(type=unicode, changes='continuous', label='Recording to')
+    def get_file(self):
+        if self.__session is None:
+            return u''
+        return self.__session.get_file()
+
+    @exported_value(type=int, changes='continuous', label='Dropped samples',
+        description='Samples discarded because they could not be written to disk quickly enough or there was not enough disk space.')
+    def get_dropped(self):
+        dropped = self.__ended_dropped
+        if self.__session is not None:
+            dropped += self.__session.get_dropped()
+        return dropped
+
+
+class AudioRecorder(_Recorder):
+    """Records the audio of one receiver.
+
+    get_name is called whenever a file is started, from the writer thread, and should return a short description of what is being recorded for use in the file name. squelch_open should return whether the receiver's squelch is open, and is called from the drain thread.
+    """
+    def __init__(self, settings, get_name, squelch_open):
+        _Recorder.__init__(self, settings)
+        self.__get_name = get_name
+        self.__squelch_open = squelch_open
+        self.__squelch_gated = False
+
+    def set_squelch_gated(self, value):
+        self.__squelch_gated = bool(value)
+
+    def get_sink(self, sample_rate, channels):
+        """Start recording audio in the given format, if not already doing so, and return the block which the audio should be connected to.
+
+        The audio must be vectors of channels floats.
+        """
+        return self._get_session_sink((sample_rate, channels), lambda: _RecordingSession(
+            files=RotatingFileWriter(
+                settings=self._settings,
+                get_name=self.__get_name,
+                sample_rate=sample_rate,
+                channels=channels),
+            frame_size=gr.sizeof_float * channels,
+            should_record=self.__should_record))
+
+    def __should_record(self):
+        # RUNS IN THE DRAIN THREAD
+        return not self.__squelch_gated or self.__squelch_open()
+
+
+__all__.append('AudioRecorder')
+
+
+class IQRecorder(_Recorder):
+    """Records the complex samples from one RX driver as SigMF recordings, for later playback by shinysdr.plugins.playback.
+
+    get_name is as for AudioRecorder. get_center_freq should return the device's current frequency; it is called from the drain thread. A new file is started whenever the frequency changes. changed_needed_connections is called when the recorder needs to be connected or disconnected.
+    """
+    def __init__(self, settings, get_name, get_center_freq, changed_needed_connections):
+        _Recorder.__init__(self, settings)
+        self.__get_name = get_name
+        self.__get_center_freq = get_center_freq
+        self.__changed_needed_connections = changed_needed_connections
+        self.__record = False
+
+    @exported_value(type=bool, changes='this_setter', persists=False,
+        label='Record IQ',
+        description='Record the unprocessed samples from this device to a file on the server.')
+    def get_record(self):
+        return self.__record
+
+    @setter
+    def set_record(self, value):
+        value = bool(value)
+        if value == self.__record:
+            return
+        if value and not self.is_available():
+            raise ValueError('Recording is not enabled in the server configuration.')
+        self.__record = value
+        self.__changed_needed_connections(u'changed IQ recording')
+
+    def get_sink(self, sample_rate):
+        """Start recording at the given sample rate, if not already doing so, and return the block which the gr_complex samples should be connected to."""
+        return self._get_session_sink(sample_rate, lambda: _RecordingSession(
+            files=RotatingFileWriter(
+                settings=self._settings,
+                get_name=self.__get_name,
+                sample_rate=sample_rate,
+                channels=1,
+                file_format='sigmf'),
+            frame_size=gr.sizeof_gr_complex,
+            should_record=lambda: True,
+            get_center_freq=self.__get_center_freq))
+
+
+__all__.append('IQRecorder')
+
+
+class _RecordingSession(object):
+    """Recording of samples in one format: the sink block, queues, and threads.
+
+    Each chunk of samples is tagged with the time it was received and, if get_center_freq is given, the center frequency at that time, for the file metadata.
+    """
+    def __init__(self, files, frame_size, should_record, get_center_freq=None):
+        self.__files = files
+        self.__frame_size = frame_size
+        self.__should_record = should_record
+        self.__get_center_freq = get_center_freq or (lambda: None)
+        self.__gr_queue = gr.msg_queue()  # unbounded so that the sink never blocks; the drain thread keeps it short
+        self.__pending = Queue.Queue(maxsize=files.get_settings().queue_length)
+        self.__sink = blocks.message_sink(frame_size, self.__gr_queue, True)
+        self.__dropped_frames = 0
+
+        for target in (self.__drain, self.__write):
+            thread = threading.Thread(target=target, name='ShinySDR recording')
+            thread.daemon = True
+            thread.start()
+
+    def get_sink(self):
+        return self.__sink
+
+    def get_status(self):
+        return self.__files.get_status()
+
+    def get_file(self):
+        return self.__files.get_file()
+
+    def get_dropped(self):
+        return self.__dropped_frames + self.__files.get_dropped_frames()
+
+    def stop(self):
+        # An empty message tells the drain thread to stop, and it tells the writer thread.
+        self.__gr_queue.insert_tail(gr.message())
+
+    def __drain(self):
+        # RUNS IN A SEPARATE THREAD
+        after_gap = False
+        while True:
+            message = self.__gr_queue.delete_head()  # blocking call
+            if message.length() == 0:
+                self.__pending.put(None)  # may wait for the writer, but the flow graph is no longer connected to us
+                break
+            if not self.__should_record():
+                after_gap = True
+                continue
+            try:
+                self.__pending.put_nowait((message.to_string(), time.time(), self.__get_center_freq(), after_gap))
+                after_gap = False
+            except Queue.Full:
+                self.__dropped_frames += message.length() // self.__frame_size
+                after_gap = True
+
+    def __write(self):
+        # RUNS IN A SEPARATE THREAD
+        try:
+            while True:
+                item = self.__pending.get()
+                if item is None:
+                    break
+                data, received_time, center_freq, after_gap = item
+                self.__files.write(data, now=received_time, center_freq=center_freq, after_gap=after_gap)
+        finally:
+            self.__files.close()
+
+
+class RotatingFileWriter(object):
+    """Writes samples to a sequence of files in settings.directory, starting a new one every settings.rotate_interval seconds or when the center frequency changes, and discarding the samples while free space is less than settings.min_free_bytes.
+
+    file_format defaults to settings.file_format.
+    """
+    def __init__(self, settings, get_name, sample_rate, channels, file_format=None, clock=time.time, get_free_bytes=None):
+        self.__settings = settings
+        self.__writer_type = _WRITER_TYPES[file_format or settings.file_format]
+        self.__get_name = get_name
+        self.__sample_rate = sample_rate
+        self.__channels = channels
+        self.__clock = clock
+        self.__get_free_bytes = get_free_bytes or _get_free_bytes
+        self.__frame_size = self.__writer_type.item_size * channels
+        self.__writer = None
+        self.__path = u''
+        self.__opened_time = None
+        self.__center_freq = None
+        self.__space_checked_time = None
+        self.__status = u''
+        self.__dropped_frames = 0
+
+    def get_settings(self):
+        return self.__settings
+
+    def get_status(self):
+        return self.__status
+
+    def get_file(self):
+        return self.__path if self.__writer is not None else u''
+
+    def get_dropped_frames(self):
+        return self.__dropped_frames
+
+    def write(self, data, now=None, center_freq=None, after_gap=False):
+        """Write data, which was received at time now (defaulting to the current time). after_gap indicates that samples were discarded immediately before data."""
+        if now is None:
+            now = self.__clock()
+        first_sample_time = now - len(data) // self.__frame_size / self.__sample_rate
+        if self.__writer is not None and (
+                now - self.__opened_time >= self.__settings.rotate_interval or
+                center_freq != self.__center_freq):
+            self.close()
+        if self.__writer is not None and now - self.__space_checked_time >= _SPACE_CHECK_INTERVAL:
+            if not self.__check_space(now):
+                self.close()
+        if self.__writer is None:
+            if not self.__check_space(now):
+                self.__dropped_frames += len(data) // self.__frame_size
+                return
+            self.__open(now, center_freq, first_sample_time)
+        elif after_gap:
+            self.__writer.mark_gap(first_sample_time)
+        self.__writer.write(data)
+
+    def close(self):
+        if self.__writer is not None:
+            self.__writer.close()
+            self.__writer = None
+
+    def __check_space(self, now):
+        self.__space_checked_time = now
+        if self.__get_free_bytes(self.__settings.directory) < self.__settings.min_free_bytes:
+            self.__status = u'Recording paused: less than %i MB of disk space free.' % (self.__settings.min_free_bytes / 1e6,)
+            return False
+        else:
+            self.__status = u''
+            return True
+
+    def __open(self, now, center_freq, first_sample_time):
+        name = _UNSAFE_FILENAME_CHARS.sub(u'_', self.__get_name())
+        base = os.path.join(
+            self.__settings.directory,
+            u'%s-%s' % (time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(now)), name))
+        extension = self.__writer_type.extension
+        path = base + u'.' + extension
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = u'%s-%i.%s' % (base, suffix, extension)
+        self.__path = path
+        self.__opened_time = now
+        self.__center_freq = center_freq
+        self.__writer = self.__writer_type(path,
+            sample_rate=self.__sample_rate,
+            channels=self.__channels,
+            center_freq=center_freq,
+            start_time=first_sample_time)
+
+
+__all__.append('RotatingFileWriter')
+
+
+def _get_free_bytes(directory):
+    stat = os.statvfs(directory)
+    return stat.f_bavail * stat.f_frsize
+
+
+class _WAVWriter(object):
+    """Writes float samples as 16-bit PCM WAV."""
+    extension = u'wav'
+    item_size = gr.sizeof_float
+
+    def __init__(self, path, sample_rate, channels, center_freq, start_time):
+        self.__file = wave.open(path.encode('utf-8'), 'wb')
+        self.__file.setnchannels(channels)
+        self.__file.setsampwidth(2)
+        self.__file.setframerate(int(round(sample_rate)))
+
+    def write(self, data):
+        samples = numpy.frombuffer(data, dtype=numpy.float32)
+        # writeframesraw does not update the header each time; close() does.
+        self.__file.writeframesraw(
+            (numpy.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tostring())
+
+    def mark_gap(self, time_of_next_sample):
+        pass
+
+    def close(self):
+        self.__file.close()
+
+
+class _RawWriter(object):
+    """Writes float samples as-is (native-endian 32-bit float, channels interleaved)."""
+    extension = u'raw'
+    item_size = gr.sizeof_float
+
+    def __init__(self, path, sample_rate, channels, center_freq, start_time):
+        self.__file = open(path, 'wb')
+
+    def write(self, data):
+        self.__file.write(data)
+
+    def mark_gap(self, time_of_next_sample):
+        pass
+
+    def close(self):
+        self.__file.close()
+
+
+class SigMFWriter(object):
+    """Writes complex samples as a SigMF recording: a .sigmf-data file of the samples as-is and a .sigmf-meta file of JSON metadata.
+
+    The metadata has one capture segment, giving the center frequency and the time of its first sample, for the start of the file and after every gap in the samples. It is written when the file is opened and rewritten when it is closed.
+    """
+    extension = u'sigmf-data'
+    item_size = gr.sizeof_gr_complex
+
+    def __init__(self, path, sample_rate, channels, center_freq, start_time):
+        assert channels == 1
+        self.__meta_path = sigmf_meta_path(path)
+        self.__file = open(path, 'wb')
+        self.__center_freq = center_freq
+        self.__samples = 0
+        self.__metadata = {
+            u'global': {
+                u'core:datatype': SIGMF_DATATYPE,
+                u'core:sample_rate': sample_rate,
+                u'core:version': u'0.0.1',
+                u'core:recorder': u'ShinySDR',
+            },
+            u'captures': [],
+            u'annotations': [],
+        }
+        self.mark_gap(start_time)
+        self.__write_metadata()
+
+    def write(self, data):
+        self.__file.write(data)
+        self.__samples += len(data) // self.item_size
+
+    def mark_gap(self, time_of_next_sample):
+        capture = {
+            u'core:sample_start': self.__samples,
+            u'core:datetime': _format_sigmf_datetime(time_of_next_sample),
+        }
+        if self.__center_freq is not None:
+            capture[u'core:frequency'] = self.__center_freq
+        self.__metadata[u'captures'].append(capture)
+
+    def close(self):
+        self.__file.close()
+        self.__write_metadata()
+
+    def __write_metadata(self):
+        # Written by renaming so that a reader never sees a partial file.
+        temp_path = self.__meta_path + u'.tmp'
+        with open(temp_path, 'wb') as f:
+            json.dump(self.__metadata, f, indent=2, sort_keys=True)
+        os.rename(temp_path, self.__meta_path)
+
+
+__all__.append('SigMFWriter')
+
+
+# Datatype of gr_complex in SigMF terms.
+SIGMF_DATATYPE = u'cf32_le' if sys.byteorder == 'little' else u'cf32_be'
+
+__all__.append('SIGMF_DATATYPE')
+
+
+def sigmf_meta_path(data_path):
+    """Return the metadata file path corresponding to a .sigmf-data path."""
+    return os.path.splitext(data_path)[0] + u'.sigmf-meta'
+
+
+__all__.append('sigmf_meta_path')
+
+
+def _format_sigmf_datetime(t):
+    seconds, microseconds = divmod(int(round(t * 1e6)), 1000000)
+    return u'%s.%06iZ' % (time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)), microseconds)
+
+
+_WRITER_TYPES = {
+    'wav': _WAVWriter,
+    'raw': _RawWriter,
+    'sigmf': SigMFWriter,
+}
@@ -0,0 +1,113 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Ring buffers in shared memory, for passing stream data between processes without going through a pipe."""
+
+from __future__ import absolute_import, division
+
+import mmap
+import os
+import struct
+import tempfile
+
+
+__all__ = []  # appended later
+
+
+# Header: total bytes ever written, total bytes ever read. Each is only written by one side (producer or consumer respectively), which is what makes this safe without locking.
+_HEADER = struct.Struct('<QQ')
+_POSITION = struct.Struct('<Q')
+_READ_POSITION_OFFSET = _POSITION.size
+_LENGTH = struct.Struct('<I')
+
+# Shared memory filesystem, if available, so that the ring is never written back to disk.
+_SHM_DIRECTORY = '/dev/shm'
+
+
+class SharedRing(object):
+    """A single-producer, single-consumer queue of byte strings in a memory-mapped file.
+
+    One process creates the ring with SharedRing.create() and passes get_path() to the other, which opens it with SharedRing(path). Either side may be the producer. The producer never blocks: if there is no room for a string, write() discards it and returns False.
+    """
+    def __init__(self, path):
+        self.__path = path
+        with open(path, 'r+b') as f:
+            self.__map = mmap.mmap(f.fileno(), 0)
+        self.__capacity = len(self.__map) - _HEADER.size
+        if self.__capacity <= _LENGTH.size:
+            raise ValueError('Not a ring buffer file: %r' % (path,))
+
+    @classmethod
+    def create(cls, capacity):
+        if os.path.isdir(_SHM_DIRECTORY):
+            directory = _SHM_DIRECTORY
+        else:
+            directory = None
+        fd, path = tempfile.mkstemp(prefix='shinysdr-ring-', dir=directory)
+        try:
+            os.ftruncate(fd, _HEADER.size + capacity)
+        finally:
+            os.close(fd)
+        return cls(path)
+
+    def get_path(self):
+        return self.__path
+
+    def write(self, data):
+        """Append a string to the ring. Returns False, and discards the string, if it does not fit."""
+        written, read = _HEADER.unpack_from(self.__map, 0)
+        needed = _LENGTH.size + len(data)
+        if needed > self.__capacity - (written - read):
+            return False
+        self.__copy_in(written, _LENGTH.pack(len(data)))
+        self.__copy_in(written + _LENGTH.size, data)
+        # Publish only after the data is in place.
+        _POSITION.pack_into(self.__map, 0, written + needed)
+        return True
+
+    def read(self):
+        """Remove and return the oldest string in the ring, or None if it is empty."""
+        written, read = _HEADER.unpack_from(self.__map, 0)
+        if read == written:
+            return None
+        length, = _LENGTH.unpack(self.__copy_out(read, _LENGTH.size))
+        data = self.__copy_out(read + _LENGTH.size, length)
+        _POSITION.pack_into(self.__map, _READ_POSITION_OFFSET, read + _LENGTH.size + length)
+        return data
+
+    def close(self, unlink=False):
+        self.__map.close()
+        if unlink:
+            os.unlink(self.__path)
+
+    def __copy_in(self, position, data):
+        start = _HEADER.size + position % self.__capacity
+        first = min(len(data), _HEADER.size + self.__capacity - start)
+        self.__map[start:start + first] = data[:first]
+        if first < len(data):
+            self.__map[_HEADER.size:_HEADER.size + len(data) - first] = data[first:]
+
+    def __copy_out(self, position, length):
+        start = _HEADER.size + position % self.__capacity
+        first = min(length, _HEADER.size + self.__capacity - start)
+        data = self.__map[start:start + first]
+        if first < length:
+            data += self.__map[_HEADER.size:_HEADER.size + length - first]
+        return data
+
+
+__all__.append('SharedRing')
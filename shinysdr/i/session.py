@@ -25,11 +25,19 @@ from shinysdr.values import ExportedState, exported_value
 
 
 class AppRoot(ExportedState):
-    def __init__(self, devices, audio_config, features):
+    def __init__(self, devices, audio_config, features, channelizers={}, shared_decimations={}, receiver_budget=None, recording=None):
+        # pylint: disable=dangerous-default-value
+        top_kwargs = {}
+        if receiver_budget is not None:
+            top_kwargs['receiver_budget'] = receiver_budget
         self.__receive_flowgraph = Top(
             devices=devices,
             audio_config=audio_config,
-            features=features)
+            features=features,
+            channelizers=channelizers,
+            shared_decimations=shared_decimations,
+            recording=recording,
+            **top_kwargs)
         # TODO: only one session while we sort out other things
         self.__session = Session(
             receive_flowgraph=self.__receive_flowgraph,
@@ -27,14 +27,18 @@ from zope.interface import implements  # available via Twisted
 from gnuradio import blocks
 from gnuradio import gr
 
+from shinysdr.filters import ChannelizerBank, SharedDecimationBank
 from shinysdr.i.audiomux import AudioManager
-from shinysdr.i.blocks import MonitorSink, RecursiveLockBlockMixin, Context
+from shinysdr.i.blocks import IncrementalConnector, MonitorSink, RecursiveLockBlockMixin, Context
 from shinysdr.i.poller import the_subscription_context
+from shinysdr.i.profiling import Diagnostics
 from shinysdr.i.receiver import Receiver
+from shinysdr.i.recording import IQRecorder
 from shinysdr.math import LazyRateCalculator
 from shinysdr.signals import SignalType
 from shinysdr.telemetry import TelemetryStore
-from shinysdr.types import EnumT, NoticeT, ReferenceT
+from shinysdr.types import EnumT, NoticeT, QuantityT, ReferenceT
+from shinysdr import units
 from shinysdr.values import CellDict, ExportedState, CollectionState, exported_value, setter, IWritableCollection, unserialize_exported_state
 
 
@@ -60,17 +64,27 @@ class ReceiverCollection(CollectionState):
 # TODO: Figure out how to stop having to 'declare' this here and in config.py
 _stub_features = {'stereo': True}
 
+# Receivers connected directly to a device each cost 1 from the budget; see Top.__reconnect.
+_default_receiver_budget = 6
+
 
 class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
 
-    def __init__(self, devices={}, audio_config=None, features=_stub_features):
+    def __init__(self, devices={}, audio_config=None, features=_stub_features, channelizers={}, shared_decimations={}, receiver_budget=_default_receiver_budget, recording=None):
         # pylint: disable=dangerous-default-value
         if len(devices) <= 0:
             raise ValueError('Must have at least one RF device')
+        for option_name, keys in [('Channelizer', channelizers.keys()), ('Shared decimation', shared_decimations.keys())]:
+            for key in keys:
+                if key not in devices or not devices[key].can_receive():
+                    raise ValueError('%s specified for %r which is not an RF device' % (option_name, key))
+                if key in channelizers and key in shared_decimations:
+                    raise ValueError('Both channelizer and shared decimation specified for %r' % (key,))
         
         gr.top_block.__init__(self, "SDR top block")
         self.__running = False  # duplicate of GR state we can't reach, see __start_or_stop
         self.__has_a_useful_receiver = False
+        self.__is_recording_iq = False
 
         # Configuration
         # TODO: device refactoring: Remove vestigial 'accessories'
@@ -81,10 +95,15 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
             self.source_name = key
             break
         self.__rx_device_type = EnumT({k: v.get_name() or k for (k, v) in self._sources.iteritems()})
+        self.__receiver_budget = float(receiver_budget)
+        self.__recording = recording
+        
+        # Flow graph connections are made through this so that reconnecting changes only what is needed.
+        self.__connector = IncrementalConnector(self)
         
         # Audio early setup
         self.__audio_manager = AudioManager(  # must be before contexts
-            graph=self,
+            graph=self.__connector,
             audio_config=audio_config,
             stereo=features['stereo'])
 
@@ -96,26 +115,41 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         self.monitor = MonitorSink(
             signal_type=SignalType(sample_rate=10000, kind='IQ'),  # dummy value will be updated in _do_connect
             context=Context(self))
-        self.monitor.get_interested_cell().subscribe2(lambda value: self.__start_or_stop_later, the_subscription_context)
+        self.monitor.get_interested_cell().subscribe2(lambda value: self.__request_reconnect(u'monitor interest changed'), the_subscription_context)
         self.__clip_probe = MaxProbe()
         
+        # Shared input filtering for receivers. Each is a ChannelizerBank or SharedDecimationBank.
+        def device_rate(k):
+            return self._sources[k].get_rx_driver().get_output_type().get_sample_rate()
+        
+        self.__channelizers = {}
+        for k, channels in channelizers.iteritems():
+            self.__channelizers[k] = ChannelizerBank(input_rate=device_rate(k), channels=channels)
+        for k, decimation in shared_decimations.iteritems():
+            self.__channelizers[k] = SharedDecimationBank(input_rate=device_rate(k), decimation=decimation)
+        
         # Receiver blocks (multiple, eventually)
         self._receivers = CellDict(dynamic=True)
         self._receiver_valid = {}
+        self.__receiver_null_sinks = {}
         
         # collections
         # TODO: No longer necessary to have these non-underscore names
         self.sources = CollectionState(CellDict(self._sources))
         self.receivers = ReceiverCollection(self._receivers, self)
         self.accessories = CollectionState(CellDict(accessories))
+        self.__iq_recorders = CellDict({k: self.__make_iq_recorder(k) for k in self._sources})
+        self.__iq_recorders_state = CollectionState(self.__iq_recorders)
         self.__telemetry_store = TelemetryStore()
         
         # Flags, other state
         self.__needs_reconnect = [u'initialization']
+        self.__reconnect_call = None
         self.__in_reconnect = False
         self.receiver_key_counter = 0
         self.receiver_default_state = {}
         self.__cpu_calculator = LazyRateCalculator(lambda: time.clock())
+        self.__diagnostics = Diagnostics(self.__get_profiled_blocks)
         
         # Initialization
         
@@ -148,7 +182,7 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
             defaults = self.receiver_default_state
             
         combined_state = defaults.copy()
-        for do_not_use_default in ['device_name', 'freq_linked_to_device']:
+        for do_not_use_default in ['device_name', 'freq_linked_to_device', 'record']:
             if do_not_use_default in combined_state:
                 del combined_state[do_not_use_default]
         if state is not None:
@@ -166,8 +200,7 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         self._receivers[key] = receiver
         self._receiver_valid[key] = False
         
-        self.__needs_reconnect.append(u'added receiver ' + key)
-        self._do_connect()
+        self.__request_reconnect(u'added receiver ' + key)
 
         # until _enabled, the facet ignores any reconnect/rebuild-triggering callbacks
         facet._enabled = True
@@ -182,23 +215,20 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         if len(self._receivers) == 1:
             self.receiver_default_state = receiver.state_to_json()
         
+        receiver.close()
         del self._receivers[key]
         del self._receiver_valid[key]
-        self.__needs_reconnect.append(u'removed receiver ' + key)
-        self._do_connect()
+        self.__receiver_null_sinks.pop(key, None)
+        self.__request_reconnect(u'removed receiver ' + key)
 
     # TODO move these methods to a facet of AudioManager
     def add_audio_queue(self, queue, queue_rate):
         self.__audio_manager.add_audio_queue(queue, queue_rate)
-        self.__needs_reconnect.append(u'added audio queue')
-        self._do_connect()
-        self.__start_or_stop()
+        self.__request_reconnect(u'added audio queue')
     
     def remove_audio_queue(self, queue):
         self.__audio_manager.remove_audio_queue(queue)
-        self.__start_or_stop()
-        self.__needs_reconnect.append(u'removed audio queue')
-        self._do_connect()
+        self.__request_reconnect(u'removed audio queue')
     
     def get_audio_queue_channels(self):
         """
@@ -206,8 +236,31 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         """
         return self.__audio_manager.get_channels()
 
+    def __request_reconnect(self, reason):
+        """Arrange for the flow graph to be reconnected once all changes made during this reactor turn are done."""
+        if reason not in self.__needs_reconnect:
+            self.__needs_reconnect.append(reason)
+        if self.__reconnect_call is None:
+            self.__reconnect_call = reactor.callLater(0, self.__reconnect_later_fired)
+    
+    def __reconnect_later_fired(self):
+        self.__reconnect_call = None
+        if self.__reconnect():
+            # We are already in a later reactor turn than the change which asked for this, so no need to delay.
+            self.__start_or_stop()
+    
     def _do_connect(self):
-        """Do all reconfiguration operations in the proper order."""
+        """Do all pending reconfiguration operations now, rather than waiting for the scheduled reconnect."""
+        if self.__reconnect_call is not None:
+            self.__reconnect_call.cancel()
+            self.__reconnect_call = None
+        if self.__reconnect():
+            self.__start_or_stop_later()
+    
+    def __reconnect(self):
+        """Do all reconfiguration operations in the proper order.
+        
+        Returns whether any reconnection was done."""
 
         if self.__in_reconnect:
             raise Exception('reentrant reconnect or _do_connect crashed')
@@ -226,60 +279,137 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
             monitor_signal_type = self.__monitor_rx_driver.get_output_type()
             self.monitor.set_signal_type(monitor_signal_type)
             self.monitor.set_input_center_freq(this_source.get_freq())
-            self.__clip_probe.set_window_and_reconnect(0.5 * monitor_signal_type.get_sample_rate())
+            self._recursive_lock()
+            try:
+                self.__clip_probe.set_window_and_reconnect(0.5 * monitor_signal_type.get_sample_rate())
+            finally:
+                self._recursive_unlock()
         
-        if self.__needs_reconnect:
+        did_reconnect = bool(self.__needs_reconnect)
+        if did_reconnect:
             log.msg(u'Flow graph: Rebuilding connections because: %s' % (', '.join(self.__needs_reconnect),))
+            reasons = self.__needs_reconnect
             self.__needs_reconnect = []
             
-            self._recursive_lock()
-            self.disconnect_all()
-            
-            self.connect(
-                self.__monitor_rx_driver,
-                self.monitor)
-            self.connect(
-                self.__monitor_rx_driver,
-                self.__clip_probe)
-
-            # Filter receivers
-            audio_rs = self.__audio_manager.reconnecting()
-            n_valid_receivers = 0
-            has_non_audio_receiver = False
-            for key, receiver in self._receivers.iteritems():
-                self._receiver_valid[key] = receiver.get_is_valid()
-                if not self._receiver_valid[key]:
-                    continue
-                if not self.__audio_manager.validate_destination(receiver.get_audio_destination()):
-                    log.err('Flow graph: receiver audio destination %r is not available' % (receiver.get_audio_destination(),))
-                    continue
-                n_valid_receivers += 1
-                if n_valid_receivers > 6:
-                    # Sanity-check to avoid burning arbitrary resources
-                    # TODO: less arbitrary constant; communicate this restriction to client
-                    log.err('Flow graph: Refusing to connect more than 6 receivers')
-                    break
-                self.connect(self._sources[receiver.get_device_name()].get_rx_driver(), receiver)
-                receiver_output_type = receiver.get_output_type()
-                if receiver_output_type.get_sample_rate() <= 0:
-                    # Demodulator has no output, but receiver has a dummy output, so connect it to something to satisfy flow graph structure.
-                    self.connect(receiver, blocks.null_sink(gr.sizeof_float * self.__audio_manager.get_channels()))
-                    # Note that we have a non-audio receiver which may be useful even if there is no audio output
-                    has_non_audio_receiver = True
-                else:
-                    assert receiver_output_type.get_kind() == 'STEREO'
-                    audio_rs.input(receiver, receiver_output_type.get_sample_rate(), receiver.get_audio_destination())
-            
-            self.__has_a_useful_receiver = audio_rs.finish_bus_connections() or \
-                has_non_audio_receiver
-            
-            self._recursive_unlock()
+            # Connections are only recorded (and any new blocks created) until connector.finish(), so we need not hold the lock until then.
+            connector = self.__connector
+            connector.begin()
+            try:
+                if self.monitor.get_interested_cell().get():
+                    # Otherwise, the monitor is suspended.
+                    connector.connect(
+                        self.__monitor_rx_driver,
+                        self.monitor)
+                connector.connect(
+                    self.__monitor_rx_driver,
+                    self.__clip_probe)
+                
+                self.__is_recording_iq = False
+                for key, recorder in self.__iq_recorders.iteritems():
+                    if recorder.get_record():
+                        rx_driver = self._sources[key].get_rx_driver()
+                        connector.connect(
+                            rx_driver,
+                            recorder.get_sink(rx_driver.get_output_type().get_sample_rate()))
+                        self.__is_recording_iq = True
+    
+                # Filter receivers
+                audio_rs = self.__audio_manager.reconnecting()
+                budget_used = 0
+                n_suspended_receivers = 0
+                channels_used = {}
+                has_non_audio_receiver = False
+                for key, receiver in self._receivers.iteritems():
+                    self._receiver_valid[key] = receiver.get_is_valid()
+                    if not self._receiver_valid[key]:
+                        continue
+                    if not self.__audio_manager.validate_destination(receiver.get_audio_destination()):
+                        log.err('Flow graph: receiver audio destination %r is not available' % (receiver.get_audio_destination(),))
+                        continue
+                    if not self.__receiver_has_consumers(receiver):
+                        # Suspend the receiver; it will be reconnected when a consumer appears.
+                        n_suspended_receivers += 1
+                        continue
+                    device_name = receiver.get_device_name()
+                    rx_driver = self._sources[device_name].get_rx_driver()
+                    channel = receiver.get_input_channel()
+                    if channel is None:
+                        receiver_cost = 1
+                    else:
+                        # A channelized receiver costs in proportion to its input rate, plus any new shared filtering it needs.
+                        channelizer = self.__channelizers[device_name]
+                        device_channels_used = channels_used.setdefault(device_name, set())
+                        receiver_cost = (
+                            channelizer.get_output_rate() / channelizer.get_input_rate() +
+                            channelizer.get_channel_cost(channel, device_channels_used))
+                    if budget_used + receiver_cost > self.__receiver_budget:
+                        # Sanity-check to avoid burning arbitrary resources
+                        # TODO: communicate this restriction to client
+                        log.err('Flow graph: Not connecting receiver %s; it would exceed the receiver budget of %s' % (key, self.__receiver_budget))
+                        continue
+                    budget_used += receiver_cost
+                    if channel is None:
+                        connector.connect(rx_driver, receiver)
+                    else:
+                        device_channels_used.add(channel)
+                        connector.connect(channelizer.connect_channel(connector, rx_driver, channel), receiver)
+                    receiver_output_type = receiver.get_output_type()
+                    if receiver_output_type.get_sample_rate() <= 0:
+                        # Demodulator has no output, but receiver has a dummy output, so connect it to something to satisfy flow graph structure.
+                        connector.connect(receiver, self.__get_receiver_null_sink(key))
+                        # Note that we have a non-audio receiver which may be useful even if there is no audio output
+                        has_non_audio_receiver = True
+                    else:
+                        assert receiver_output_type.get_kind() == 'STEREO'
+                        audio_rs.input(receiver, receiver_output_type.get_sample_rate(), receiver.get_audio_destination())
+                
+                self.__has_a_useful_receiver = audio_rs.finish_bus_connections() or \
+                    has_non_audio_receiver
+                
+                self._recursive_lock()
+                try:
+                    n_removed, n_added = connector.finish()
+                finally:
+                    self._recursive_unlock()
+            except Exception:
+                # Forget the partial set of connections so that a later reconnect can begin() again, and keep the reasons so that it will happen.
+                connector.abort()
+                self.__needs_reconnect = reasons + self.__needs_reconnect
+                self.__in_reconnect = False
+                raise
+            for recorder in self.__iq_recorders.itervalues():
+                if not recorder.get_record():
+                    recorder.stop()
             # (this is in an if block but it can't not execute if anything else did)
-            log.msg('Flow graph: ...done reconnecting (%i ms).' % ((time.time() - t0) * 1000,))
-            
-            self.__start_or_stop_later()
+            log.msg('Flow graph: ...done reconnecting (%i ms, of which %i ms locked; %i edges removed, %i added; %i receivers suspended).' % ((time.time() - t0) * 1000, self._get_lock_durations()[0] * 1000, n_removed, n_added, n_suspended_receivers))
+            self.__diagnostics.refresh()
         
         self.__in_reconnect = False
+        return did_reconnect
+
+    def __receiver_has_consumers(self, receiver):
+        """Return whether anything would use the output of the receiver if it were connected."""
+        if receiver.get_decode_always() or receiver.get_record() or receiver.is_telemetry():
+            # Telemetry is kept by the telemetry store for clients which are not yet connected, so it is always wanted.
+            return True
+        if receiver.get_output_type().get_sample_rate() <= 0:
+            # A receiver without audio output is producing cell values, which are wanted if any client is connected; and clients are connected exactly when there are audio queues.
+            return self.__audio_manager.has_clients()
+        return self.__audio_manager.destination_has_consumers(receiver.get_audio_destination())
+    
+    def __make_iq_recorder(self, key):
+        device = self._sources[key]
+        return IQRecorder(
+            settings=self.__recording,
+            get_name=lambda: u'%s-%iHz' % (key, device.get_freq()),
+            get_center_freq=device.get_freq,
+            changed_needed_connections=lambda reason: self.__request_reconnect(u'device %s: %s' % (key, reason)))
+    
+    def __get_receiver_null_sink(self, key):
+        # Kept per receiver so that the connection is unchanged from one reconnect to the next.
+        if key not in self.__receiver_null_sinks:
+            self.__receiver_null_sinks[key] = blocks.null_sink(gr.sizeof_float * self.__audio_manager.get_channels())
+        return self.__receiver_null_sinks[key]
 
     def __device_vfo_callback(self, device_key):
         reactor.callLater(
@@ -295,14 +425,33 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         for rec_key, receiver in self._receivers.iteritems():
             if receiver.get_device_name() == device_key:
                 receiver.changed_device_freq()
+                # If multiple receivers change validity, the reconnects they request are coalesced.
                 self._update_receiver_validity(rec_key)
-            # TODO: If multiple receivers change validity we'll do redundant reconnects in this loop; avoid that.
 
+    def __get_profiled_blocks(self):
+        """Name the blocks in the flow graph, for Diagnostics."""
+        names = {id(self.monitor): u'monitor', id(self.__clip_probe): u'clip_probe'}
+        for key, device in self._sources.iteritems():
+            names[id(device.get_rx_driver())] = u'device_' + key
+        for key, receiver in self._receivers.iteritems():
+            names[id(receiver)] = u'receiver_' + key
+        profiled = {}
+        for block in self.__connector.get_blocks():
+            name = names.get(id(block))
+            if name is None:
+                # Audio and channelizer blocks
+                base = name = unicode(block.name())
+                i = 1
+                while name in profiled:
+                    i += 1
+                    name = u'%s_%i' % (base, i)
+            profiled[name] = block
+        return profiled
+    
     def _update_receiver_validity(self, key):
         receiver = self._receivers[key]
         if receiver.get_is_valid() != self._receiver_valid[key]:
-            self.__needs_reconnect.append(u'receiver %s validity changed' % (key,))
-            self._do_connect()
+            self.__request_reconnect(u'receiver %s validity changed' % (key,))
     
     @exported_value(type=ReferenceT(), changes='never')
     def get_monitor(self):
@@ -325,11 +474,22 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
     def get_accessories(self):
         return self.accessories
     
+    @exported_value(type=ReferenceT(), persists=False, changes='never', label='IQ recording')
+    def get_iq_recorders(self):
+        return self.__iq_recorders_state
+    
     @exported_value(type=ReferenceT(), changes='never', label='Telemetry')
     def get_telemetry_store(self):
         return self.__telemetry_store
     
+    @exported_value(type=ReferenceT(), persists=False, changes='never', label='Diagnostics')
+    def get_diagnostics(self):
+        return self.__diagnostics
+    
     def start(self, **kwargs):
+        # don't start with a stale graph
+        self._do_connect()
+        
         # trigger reconnect/restart notification
         self._recursive_lock()
         self._recursive_unlock()
@@ -342,16 +502,11 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         self.__running = False
 
     def __start_or_stop(self):
-        # TODO: Improve start/stop conditions:
-        #
-        # * run if a client is watching an audio-having receiver's cell-based outputs (e.g. VOR) but not listening to audio
-        #
-        # * don't run if no client is watching a pure telemetry receiver
-        #   (maybe a user preference since having a history when you connect is useful)
-        #
-        # Both of these refinements require becoming aware of cell subscriptions.
+        # Receivers and the monitor with no consumers have already been disconnected by __reconnect, so we need only check whether anything is left.
+        # TODO: Consider actual cell subscriptions rather than the presence of clients for receivers without audio.
         should_run = (
             self.__has_a_useful_receiver or
+            self.__is_recording_iq or
             self.monitor.get_interested_cell().get())
         if should_run != self.__running:
             if should_run:
@@ -367,6 +522,10 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         """Close all devices in preparation for a clean shutdown.
         
         Makes this top block unusable"""
+        for receiver in self._receivers.itervalues():
+            receiver.close()
+        for recorder in self.__iq_recorders.itervalues():
+            recorder.stop()
         for device in self._sources.itervalues():
             device.close()
         for device in self._accessories.itervalues():
@@ -404,17 +563,32 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
     def get_cpu_use(self):
         return round(self.__cpu_calculator.get(), 2)
     
+    @exported_value(
+        type=QuantityT(units.s),
+        changes='continuous',
+        label='Lock time',
+        description='Duration of the most recent flow graph reconfiguration, during which all signal processing is stopped.')
+    def get_lock_time(self):
+        return round(self._get_lock_durations()[0], 4)
+    
     def _get_rx_device_type(self):
         """for ContextForReceiver only"""
         return self.__rx_device_type
     
+    def _get_recording_settings(self):
+        """for ContextForReceiver only"""
+        return self.__recording
+    
+    def _get_channelizer(self, device_key):
+        """for ContextForReceiver only"""
+        return self.__channelizers.get(device_key)
+    
     def _get_audio_destination_type(self):
         """for ContextForReceiver only"""
         return self.__audio_manager.get_destination_type()
     
     def _trigger_reconnect(self, reason):
-        self.__needs_reconnect.append(reason)
-        self._do_connect()
+        self.__request_reconnect(reason)
     
     def _recursive_lock_hook(self):
         for source in self._sources.itervalues():
@@ -435,9 +609,20 @@ class ContextForReceiver(Context):
     def get_rx_device_type(self):
         return self.__top._get_rx_device_type()
 
+    def get_channelizer(self, device_key):
+        """Return the ChannelizerBank or SharedDecimationBank for the given device, or None if it does not have one."""
+        return self.__top._get_channelizer(device_key)
+
     def get_audio_destination_type(self):
         return self.__top._get_audio_destination_type()
 
+    def get_recording_settings(self):
+        """Return the RecordingSettings for receiver audio, or None if recording is not allowed."""
+        return self.__top._get_recording_settings()
+
+    def get_receiver_key(self):
+        return self._key
+
     def revalidate(self, tuning):
         if not self._enabled: return
 
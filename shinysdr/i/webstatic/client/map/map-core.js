@@ -34,6 +34,7 @@ define(['events', 'gltools', 'math', 'network', 'types', 'values', 'widget',
   const Clock = events.Clock;
   const ConstantCell = values.ConstantCell;
   const DerivedCell = values.DerivedCell;
+  const LocalReadCell = values.LocalReadCell;
   const PickWidget = widgets_basic.PickWidget;
   const SmallKnob = widgets_basic.SmallKnob;
   const StorageCell = values.StorageCell;
@@ -56,6 +57,44 @@ define(['events', 'gltools', 'math', 'network', 'types', 'values', 'widget',
   function dcos(x) { return cos(RADIANS_PER_DEGREE * x); }
   function dsin(x) { return sin(RADIANS_PER_DEGREE * x); }
   
+  // A view whose visible part extends more than this many degrees of latitude from its center is treated as showing the whole globe, for the purpose of asking the server for only the telemetry objects in view.
+  var MAX_VIEW_AREA_HALF_HEIGHT = 30;
+  
+  // The area requested from telemetry stores is this many times the size of the visible area, so that small movements of the view do not need a new request.
+  var VIEW_AREA_MARGIN = 2;
+  
+  // Given the value of a MapCamera's viewAreaCell, return the [south, west, north, east] area to request from telemetry stores, or null for everything.
+  function telemetryViewArea(view) {
+    if (view === null) return null;
+    var halfHeight = view.halfHeight * VIEW_AREA_MARGIN;
+    var halfWidth = view.halfWidth * VIEW_AREA_MARGIN;
+    var south = Math.max(-90, view.latitude - halfHeight);
+    var north = Math.min(90, view.latitude + halfHeight);
+    if (south === -90 || north === 90 || halfWidth >= 180) {
+      return [south, -180, north, 180];
+    }
+    return [south, view.longitude - halfWidth, north, view.longitude + halfWidth];
+  }
+  
+  // Whether the area (as returned by telemetryViewArea) contains the view and is not excessively larger than it.
+  function telemetryViewAreaCovers(area, view) {
+    if (area === null || view === null) {
+      return area === view;
+    }
+    var south = area[0], west = area[1], north = area[2], east = area[3];
+    if (view.latitude - view.halfHeight < south || view.latitude + view.halfHeight > north) {
+      return false;
+    }
+    if (north - south > 4 * VIEW_AREA_MARGIN * view.halfHeight) {
+      // zoomed in since the request
+      return false;
+    }
+    if (west === -180 && east === 180) {
+      return true;
+    }
+    return view.longitude - view.halfWidth >= west && view.longitude + view.halfWidth <= east;
+  }
+  
   function mean(array) {
     return array.reduce(function (a, b) { return a + b; }, 0) / array.length;
   }
@@ -1092,6 +1131,9 @@ define(['events', 'gltools', 'math', 'network', 'types', 'values', 'widget',
     // If not null, a cell holding a trackT object which we are locking the view to
     var trackingCell = null;
     
+    // [w, h], once known
+    var sizeCell = new LocalReadCell(anyT, null);
+    
     // TODO: No standard cell class is suitable (write side effects, goes to storage, doesn't reparse on every read); fix.
     var latitudeCell = this.latitudeCell = new Cell(numberT);
     this.latitudeCell.get = function () { return viewCenterLat; };
@@ -1245,7 +1287,11 @@ define(['events', 'gltools', 'math', 'network', 'types', 'values', 'widget',
     this.setSize = function setSize(newW, newH) {
       w = newW;
       h = newH;
-      // no callback because currently this is called only when drawing. TODO refactor
+      // Only viewAreaCell is notified, because currently this is called only when drawing. TODO refactor
+      var size = sizeCell.get();
+      if (!size || size[0] !== w || size[1] !== h) {
+        sizeCell._update(Object.freeze([w, h]));
+      }
     };
     
     this.getCameraMatrix = function getCameraMatrix() {
@@ -1293,6 +1339,24 @@ define(['events', 'gltools', 'math', 'network', 'types', 'values', 'widget',
       updateFromCell();
     });
     
+    // The center of the view, and the distances from it to the edges, in degrees, or null if the view is too large for this to be a useful description of what is visible.
+    this.viewAreaCell = new DerivedCell(anyT, scheduler, function (dirty) {
+      var latitude = latitudeCell.depend(dirty);
+      var longitude = longitudeCell.depend(dirty);
+      zoomCell.depend(dirty);
+      var size = sizeCell.depend(dirty);
+      if (!size) return null;
+      var angleScales = getAngleScales();
+      var halfHeight = size[1] / 2 * angleScales.y;
+      if (!(halfHeight <= MAX_VIEW_AREA_HALF_HEIGHT)) return null;
+      return Object.freeze({
+        latitude: latitude,
+        longitude: longitude,
+        halfHeight: halfHeight,
+        halfWidth: size[0] / 2 * -angleScales.x
+      });
+    });
+    
     changedView();
   }
 
@@ -1439,6 +1503,30 @@ define(['events', 'gltools', 'math', 'network', 'types', 'values', 'widget',
     // TODO: Once we have overlays, put the listeners on the overlay container...?
     mapCamera.addDragListeners(canvas);
     
+    // Ask the server to send only the telemetry objects near what is visible.
+    var telemetryStoresCell = config.index.implementing('shinysdr.telemetry.ITelemetryStore');
+    var requestedStores = [];
+    var requestedArea = null;
+    function updateTelemetryViewArea() {
+      var stores = telemetryStoresCell.depend(updateTelemetryViewArea);
+      var view = mapCamera.viewAreaCell.depend(updateTelemetryViewArea);
+      var sameStores = stores.length === requestedStores.length && stores.every(function (store, i) {
+        return store === requestedStores[i];
+      });
+      if (sameStores && telemetryViewAreaCovers(requestedArea, view)) {
+        return;
+      }
+      requestedStores = stores;
+      requestedArea = telemetryViewArea(view);
+      stores.forEach(function (store) {
+        if (store.setViewArea) {  // absent if not from the server
+          store.setViewArea(requestedArea);
+        }
+      });
+    }
+    updateTelemetryViewArea.scheduler = scheduler;
+    updateTelemetryViewArea();
+    
     var pickingColorAllocatorBase = new FreeListAllocator(1, function() {});
     pickingColorAllocatorBase.allocate();  // reserve 0 === NO_PICKING_COLOR for not-an-object
     var pickingObjects = [null];
@@ -1590,13 +1678,26 @@ define(['events', 'gltools', 'math', 'network', 'types', 'values', 'widget',
   // TODO: Instead of making this global state, make track-valued cells keep the histories.
   var trackPositionHistories = new WeakMap();
   
-  function renderTrackFeature(dirty, trackCell, label) {
-    var history = trackPositionHistories.get(trackCell);
-    if (!history) {
-      trackPositionHistories.set(trackCell, history = []);
-    }
-    if (history.length > 1000) {  // TODO better implementation
-      history = history.slice(500);
+  // historyCell, if given, is a track history cell from the server; otherwise the history is accumulated here.
+  function renderTrackFeature(dirty, trackCell, label, historyCell) {
+    var history;
+    if (historyCell) {
+      history = [];
+      const [info, data] = historyCell.depend(dirty);
+      const fields = info.fields;
+      if (fields) {
+        for (let i = 0; i + fields <= data.length; i += fields) {
+          history.push({position: [data[i], data[i + 1]]});
+        }
+      }
+    } else {
+      history = trackPositionHistories.get(trackCell);
+      if (!history) {
+        trackPositionHistories.set(trackCell, history = []);
+      }
+      if (history.length > 1000) {  // TODO better implementation
+        history = history.slice(500);
+      }
     }
     var lastHistory = history[history.length - 1] || [null, null];
     
@@ -1610,7 +1711,7 @@ define(['events', 'gltools', 'math', 'network', 'types', 'values', 'widget',
       position = [lat, lon];
     }
     
-    if (position && (!lastHistory || (position[0] !== lastHistory[0] && position[1] !== lastHistory[1]))) {
+    if (!historyCell && position && (!lastHistory || (position[0] !== lastHistory[0] && position[1] !== lastHistory[1]))) {
       history.push({position: position});
     }
     
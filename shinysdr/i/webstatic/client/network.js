@@ -175,6 +175,14 @@ define(['./types', './values', './events'],
           newValue = [{rate:rate}, data];
           break;
         }
+        case 'track-float': {
+          // rows of [latitude, longitude, altitude, time relative to originTime]
+          const originTime = view.getFloat64(4, true);
+          const fields = view.getUint32(4+8, true);
+          const data = new Float32Array(buffer, 4+8+4);
+          newValue = [{originTime:originTime, fields:fields}, data];
+          break;
+        }
         default:
           throw new Error('Unknown bulk data format');
       }
@@ -326,8 +334,14 @@ define(['./types', './values', './events'],
           case 'register_block': {
             const url = message[2];
             const interfaces = message[3];
-            updaterMap[id] = idMap[id] = makeBlock(url, interfaces);
+            const block = updaterMap[id] = idMap[id] = makeBlock(url, interfaces);
             isCellMap[id] = false;
+            if (block['_implements_shinysdr.telemetry.ITelemetryStore']) {
+              // Ask for only the objects in area, a [south, west, north, east] array in degrees, or all objects if area is null.
+              setNonEnum(block, 'setViewArea', function (area) {
+                ws.send(JSON.stringify(['view_area', id, area]));
+              });
+            }
             break;
           }
           case 'register_cell': {
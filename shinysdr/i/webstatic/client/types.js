@@ -223,6 +223,8 @@ define([], () => {
         this.dataFormat = 'spectrum-byte';
       } else if (info_format === 'd' && array_format === 'f') {
         this.dataFormat = 'scope-float';
+      } else if (info_format === 'dI' && array_format === 'f') {
+        this.dataFormat = 'track-float';
       } else {
         throw new Error('Unexpected bulk data format: ' + info_format + ' ' + array_format);
       }
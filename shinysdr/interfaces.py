@@ -124,7 +124,8 @@ class ModeDef(object):
             info,
             demod_class,
             mod_class=None,
-            available=True):
+            available=True,
+            telemetry=False):
         """
         mode: String uniquely identifying this mode, typically a standard abbreviation written in uppercase letters (e.g. "USB", "WFM").
         info: An EnumRow object with a label for the mode, or a string.
@@ -133,12 +134,14 @@ class ModeDef(object):
         mod_class: Class to instantiate to create a modulator for this mode.
         (TODO: cite demodulator and modulator interface docs)
         available: If false, this mode definition will be ignored.
+        telemetry: If true, the demodulator's output is mainly messages for the telemetry store, which are wanted whether or not any client is connected, so receivers in this mode are never suspended for lack of listeners.
         """
         self.mode = unicode(mode)
         self.info = EnumRow(info)
         self.demod_class = demod_class
         self.mod_class = mod_class
         self.available = bool(available)
+        self.telemetry = bool(telemetry)
 
 
 __all__.append('ModeDef')
@@ -35,7 +35,7 @@ from twisted.python import log
 # Note that gnuradio-dependent modules are loaded later, to avoid the startup time if all we're going to do is give a usage message
 from shinysdr.config import Config, write_default_config, execute_config
 from shinysdr.i.dependencies import DependencyTester
-from shinysdr.i.persistence import PersistenceFileGlue
+from shinysdr.i.persistence import PersistenceFileGlue, TelemetrySnapshotFile
 
 __all__ = []  # appended later
 
@@ -73,6 +73,8 @@ def _main_async(reactor, argv=None, _abort_for_test=False):
         help='open the UI in a web browser')
     argParser.add_argument('--force-run', dest='force_run', action='store_true',
         help='Run DSP even if no client is connected (for debugging).')
+    argParser.add_argument('--dsp-process', dest='dsp_process', action='store_true',
+        help='Run the devices and DSP in a separate process from the web server.')
     args = argParser.parse_args(args=argv[1:])
 
     # Verify we can actually run.
@@ -89,21 +91,17 @@ def _main_async(reactor, argv=None, _abort_for_test=False):
         sys.exit(0)  # TODO: Consider using a return value or something instead
     
     # ... else read config file
-    config_obj = Config(reactor)
-    execute_config(config_obj, args.config_path)
-    yield config_obj._wait_and_validate()
-    
-    log.msg('Constructing...')
-    app = config_obj._create_app()
-    
-    reactor.addSystemEventTrigger('during', 'shutdown', app.close_all_devices)
-    
-    log.msg('Restoring state...')
-    pfg = PersistenceFileGlue(
-        reactor=reactor,
-        root_object=app,
-        filename=config_obj._state_filename,
-        get_defaults=_app_defaults)
+    if args.dsp_process:
+        # The configuration is executed by the DSP process, not here.
+        from shinysdr.i.dsp_process import spawn_dsp_process
+        log.msg('Starting DSP process...')
+        app, config_obj = yield spawn_dsp_process(reactor, args.config_path, force_run=args.force_run)
+        pfg = None
+    else:
+        config_obj = Config(reactor)
+        execute_config(config_obj, args.config_path)
+        yield config_obj._wait_and_validate()
+        app, pfg = _make_app(reactor, config_obj)
     
     log.msg('Starting web server...')
     services = MultiService()
@@ -117,7 +115,7 @@ def _main_async(reactor, argv=None, _abort_for_test=False):
         # TODO: should have an interface (currently no proper module to put it in)
         service.announce(args.openBrowser)
     
-    if args.force_run:
+    if args.force_run and not args.dsp_process:  # the DSP process handles force_run itself
         log.msg('force_run')
         from gnuradio.gr import msg_queue
         # TODO kludge, make this less digging into guts
@@ -125,12 +123,51 @@ def _main_async(reactor, argv=None, _abort_for_test=False):
     
     if _abort_for_test:
         services.stopService()
-        yield pfg.sync()
+        if pfg is not None:
+            yield pfg.sync()
         defer.returnValue(app)
     else:
         yield defer.Deferred()  # never fires
 
 
+def _make_app(reactor, config_obj):
+    """Construct the app (devices and flowgraph) from a finished config, and restore its state.
+    
+    Returns (app, persistence glue)."""
+    from shinysdr.filters import design_cache, load_filter_calibration  # deferred import, see top of file
+    if config_obj._filter_calibration_filename is not None:
+        # must precede loading the design cache, since it clears the cache
+        load_filter_calibration(config_obj._filter_calibration_filename)
+    if config_obj._filter_design_cache_filename is not None:
+        design_cache.load(config_obj._filter_design_cache_filename)
+        reactor.addSystemEventTrigger('during', 'shutdown', design_cache.save)
+    
+    log.msg('Constructing...')
+    app = config_obj._create_app()
+    
+    reactor.addSystemEventTrigger('during', 'shutdown', app.close_all_devices)
+    
+    log.msg('Restoring state...')
+    pfg = PersistenceFileGlue(
+        reactor=reactor,
+        root_object=app,
+        filename=config_obj._state_filename,
+        get_defaults=_app_defaults)
+    
+    if config_obj._telemetry_snapshot is not None:
+        filename, interval = config_obj._telemetry_snapshot
+        snapshot = TelemetrySnapshotFile(
+            reactor=reactor,
+            store=app.get_receive_flowgraph().get_telemetry_store(),
+            filename=filename,
+            interval=interval)
+        reactor.addSystemEventTrigger('during', 'shutdown', snapshot.close)
+    
+    design_cache.save()
+    
+    return app, pfg
+
+
 def _app_defaults(app):
     """Return a friendly initial state for the app using knowledge of the default config file."""
     state = {}
@@ -46,7 +46,7 @@ from zope.interface import Interface, implements  # available via Twisted
 import shinysdr
 from shinysdr.devices import Device, IComponent
 from shinysdr.interfaces import ClientResourceDef
-from shinysdr.telemetry import ITelemetryMessage, ITelemetryObject, TelemetryItem, TelemetryStore, Track, empty_track
+from shinysdr.telemetry import IPersistableTelemetryMessage, ITrackedTelemetryObject, TelemetryItem, TelemetryStore, Track, TrackHistory, empty_track
 from shinysdr.types import NoticeT, TimestampT
 from shinysdr.values import ExportedState, exported_value
 
@@ -88,7 +88,11 @@ class IAPRSStation(Interface):
 
 
 class APRSStation(ExportedState):
-    implements(IAPRSStation, ITelemetryObject)
+    implements(IAPRSStation, ITrackedTelemetryObject)
+    
+    # There may be many thousands of stations, so avoid a per-instance dict. ExportedState's own attributes, which would need one, are created only once a client looks at the station's cells.
+    __slots__ = (
+        '__last_heard_time', '__address', '__track', '__status', '__symbol', '__last_comment', '__last_parse_error', '__track_history', '__changed_keys')
     
     def __init__(self, object_id):
         self.__last_heard_time = None
@@ -98,10 +102,20 @@ class APRSStation(ExportedState):
         self.__symbol = u''
         self.__last_comment = u''
         self.__last_parse_error = u''
+        self.__track_history = TrackHistory()
+        self.__changed_keys = None  # set of keys changed since flush_changes, if any
+    
+    def state_def(self, callback):
+        super(APRSStation, self).state_def(callback)
+        callback(self.__track_history.cell())
 
     def receive(self, message):
         """implement ITelemetryObject"""
+        changed_keys = self.__changed_keys
+        if changed_keys is None:
+            changed_keys = self.__changed_keys = set()
         self.__last_heard_time = message.receive_time
+        changed_keys.add('last_heard_time')
         for fact in message.facts:
             if isinstance(fact, KillObject):
                 # Kill by pretending the object is ancient.
@@ -111,28 +125,45 @@ class APRSStation(ExportedState):
                     latitude=TelemetryItem(fact.latitude, message.receive_time),
                     longitude=TelemetryItem(fact.longitude, message.receive_time),
                 )
+                changed_keys.add('track')
             if isinstance(fact, Altitude):
                 conversion = _FEET_TO_METERS if fact.feet_not_meters else 1
                 self.__track = self.__track._replace(
                     altitude=TelemetryItem(fact.value * conversion, message.receive_time),
                 )
+                changed_keys.add('track')
             if isinstance(fact, Velocity):
                 self.__track = self.__track._replace(
                     h_speed=TelemetryItem(fact.speed_knots * _KNOTS_TO_METERS_PER_SECOND, message.receive_time),
                     track_angle=TelemetryItem(fact.course_degrees, message.receive_time),
                 )
+                changed_keys.add('track')
             elif isinstance(fact, Status):
                 # TODO: Empirically, not always ASCII. Move this implicit decoding off into parse stages.
                 self.__status = unicode(fact.text)
+                changed_keys.add('status')
             elif isinstance(fact, Symbol):
                 self.__symbol = unicode(fact.id)
+                changed_keys.add('symbol')
             else:
                 # TODO: Warn somewhere in this case (recognized by parser but not here)
                 pass
         self.__last_comment = unicode(message.comment)
+        changed_keys.add('last_comment')
         if len(message.errors) > 0:
             self.__last_parse_error = '; '.join(message.errors)
-        self.state_changed()
+            changed_keys.add('last_parse_error')
+    
+    def flush_changes(self):
+        """implement ITelemetryObject"""
+        changed_keys = self.__changed_keys
+        if changed_keys is None:
+            return
+        self.__changed_keys = None
+        if 'track' in changed_keys:
+            self.__track_history.record(self.__track)
+        for key in changed_keys:
+            self.state_changed(key)
     
     def is_interesting(self):
         """implement ITelemetryObject"""
@@ -183,7 +214,7 @@ class APRSMessage(namedtuple('APRSMessage', [
     'errors',  # list: of strings describing parse failures
     'comment',  # APRS comment text
 ])):
-    implements(ITelemetryMessage)
+    implements(IPersistableTelemetryMessage)
     
     def get_object_id(self):
         # TODO: Fail on object/item facts which should never be seen here
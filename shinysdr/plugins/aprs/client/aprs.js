@@ -38,6 +38,7 @@ define(['events',  'map/map-core', 'types', 'values', 'widgets',
     Block.call(this, config, function (block, addWidget, ignore, setInsertion, setToDetails, getAppend) {
       ignore('address'); // in header
       addWidget('track', widgets.TrackWidget);
+      ignore('track_history');  // drawn on the map
       
       ignore('symbol');
       const symbolCell = block.symbol;
@@ -77,7 +78,7 @@ define(['events',  'map/map-core', 'types', 'values', 'widgets',
           (station.status.depend(dirty) || station.last_comment.depend(dirty))
         ].filter(t => t.trim() !== '').join(' • ');
         
-        const f = renderTrackFeature(dirty, station.track, text);
+        const f = renderTrackFeature(dirty, station.track, text, station.track_history);
         
         const symbol = station.symbol.depend(dirty);
         if (symbol) {
@@ -42,7 +42,7 @@ from shinysdr.filters import MultistageChannelFilter
 from shinysdr.interfaces import ClientResourceDef, IDemodulator, ModeDef
 from shinysdr.math import LazyRateCalculator
 from shinysdr.signals import no_signal
-from shinysdr.telemetry import ITelemetryMessage, ITelemetryObject, TelemetryItem, Track, empty_track
+from shinysdr.telemetry import ITelemetryMessage, ITrackedTelemetryObject, TelemetryItem, Track, TrackHistory, empty_track
 from shinysdr.types import EnumRow, RangeT, TimestampT
 from shinysdr import units
 from shinysdr.values import ExportedState, exported_value, setter
@@ -172,7 +172,11 @@ class IAircraft(Interface):
 
 
 class Aircraft(ExportedState):
-    implements(IAircraft, ITelemetryObject)
+    implements(IAircraft, ITrackedTelemetryObject)
+    
+    # There may be many thousands of aircraft, so avoid a per-instance dict. ExportedState's own attributes, which would need one, are created only once a client looks at the aircraft's cells.
+    __slots__ = (
+        '__last_heard_time', '__track', '__call', '__ident', '__aircraft_type', '__track_history', '__changed_keys')
     
     def __init__(self, object_id):
         """Implements ITelemetryObject. object_id is the hex formatted address."""
@@ -181,26 +185,40 @@ class Aircraft(ExportedState):
         self.__call = None
         self.__ident = None
         self.__aircraft_type = None
+        self.__track_history = TrackHistory()
+        self.__changed_keys = None  # set of keys changed since flush_changes, if any
+    
+    def state_def(self, callback):
+        super(Aircraft, self).state_def(callback)
+        callback(self.__track_history.cell())
     
     # not exported
     def receive(self, message_wrapper):
+        """Implements ITelemetryObject."""
         message = message_wrapper.message
         cpr_decoder = message_wrapper.cpr_decoder
         receive_time = message_wrapper.receive_time
+        changed_keys = self.__changed_keys
+        if changed_keys is None:
+            changed_keys = self.__changed_keys = set()
         self.__last_heard_time = receive_time
+        changed_keys.add('last_heard_time')
         # Unfortunately, gr-air-modes doesn't provide a function to implement this gunk -- imitating its output_flightgear code which
         data = message.data
         t = data.get_type()
         if t == 0:
             self.__track = self.__track._replace(
                 altitude=TelemetryItem(air_modes.decode_alt(data['ac'], True) * _METERS_PER_FEET, receive_time))
+            changed_keys.add('track')
             # TODO more info available here
         elif t == 4:
             self.__track = self.__track._replace(
                 altitude=TelemetryItem(air_modes.decode_alt(data['ac'], True) * _METERS_PER_FEET, receive_time))
+            changed_keys.add('track')
             # TODO more info available here
         elif t == 5:
             self.__ident = air_modes.decode_id(data['id'])
+            changed_keys.add('ident')
             # TODO more info available here
         elif t == 17:  # ADS-B
             bdsreg = data['me'].get_type()
@@ -212,6 +230,7 @@ class Aircraft(ExportedState):
                     latitude=TelemetryItem(latitude, receive_time),
                     longitude=TelemetryItem(longitude, receive_time),
                 )
+                changed_keys.add('track')
             elif bdsreg == 0x06:
                 # TODO use unused info
                 (_ground_track, latitude, longitude, _range, _bearing) = air_modes.parseBDS06(data, cpr_decoder)
@@ -219,8 +238,10 @@ class Aircraft(ExportedState):
                     latitude=TelemetryItem(latitude, receive_time),
                     longitude=TelemetryItem(longitude, receive_time),
                 )
+                changed_keys.add('track')
             elif bdsreg == 0x08:
                 (self.__call, self.__aircraft_type) = air_modes.parseBDS08(data)
+                changed_keys.update(['call', 'aircraft_type'])
             elif bdsreg == 0x09:
                 subtype = data['bds09'].get_type()
                 if subtype == 0:
@@ -233,6 +254,7 @@ class Aircraft(ExportedState):
                         v_speed=TelemetryItem(vertical_speed, receive_time),
                         # TODO add turn rate
                     )
+                    changed_keys.add('track')
                 elif subtype == 1:
                     (velocity, heading, vertical_speed) = air_modes.parseBDS09_1(data)
                     self.__track = self.__track._replace(
@@ -242,6 +264,7 @@ class Aircraft(ExportedState):
                         v_speed=TelemetryItem(vertical_speed, receive_time),
                         # TODO reset turn rate?
                     )
+                    changed_keys.add('track')
                 else:
                     # TODO report
                     pass
@@ -251,7 +274,17 @@ class Aircraft(ExportedState):
         else:
             # TODO report
             pass
-        self.state_changed()
+    
+    def flush_changes(self):
+        """Implements ITelemetryObject."""
+        changed_keys = self.__changed_keys
+        if changed_keys is None:
+            return
+        self.__changed_keys = None
+        if 'track' in changed_keys:
+            self.__track_history.record(self.__track)
+        for key in changed_keys:
+            self.state_changed(key)
     
     def is_interesting(self):
         """
@@ -292,7 +325,8 @@ class Aircraft(ExportedState):
 plugin_mode = ModeDef(mode='MODE-S',
     info=EnumRow(label='Mode S', description='Aviation telemetry found at 1090 MHz'),
     demod_class=ModeSDemodulator,
-    available=_available)
+    available=_available,
+    telemetry=True)
 plugin_client = ClientResourceDef(
     key=__name__,
     resource=static.File(os.path.join(os.path.split(__file__)[0], 'client')),
@@ -27,6 +27,7 @@ define(['map/map-core', 'widgets'], function (mapCore, widgets) {
   function AircraftWidget(config) {
     Block.call(this, config, function (block, addWidget, ignore, setInsertion, setToDetails, getAppend) {
       addWidget('track', widgets.TrackWidget);
+      ignore('track_history');  // drawn on the map
     }, false);
   }
   
@@ -52,7 +53,7 @@ define(['map/map-core', 'widgets'], function (mapCore, widgets) {
           labelParts.push(altitude.toFixed(0) + ' m');
         }
         var f = renderTrackFeature(dirty, trackCell,
-          labelParts.join(' • '));
+          labelParts.join(' • '), aircraft.track_history);
         f.iconURL = '/client/plugins/shinysdr.plugins.mode_s/aircraft.svg';
         return f;
       }
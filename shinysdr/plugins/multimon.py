@@ -263,4 +263,5 @@ _multimon_available = test_subprocess('multimon-ng -h; exit 0', 'available demod
 pluginDef_APRS = ModeDef(mode='APRS',  # TODO: Rename mode to be more accurate
     info='APRS',
     demod_class=FMAPRSDemodulator,
-    available=_multimon_available)
+    available=_multimon_available,
+    telemetry=True)
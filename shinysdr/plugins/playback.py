@@ -0,0 +1,288 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Playback of recorded IQ samples as a device.
+
+The recording is memory-mapped and a thread copies it in chunks into a bounded GNU Radio message queue feeding a message_source block; so the recording is never read into memory all at once, and no Python code runs in the flow graph. In real-time mode the thread paces itself by the clock, and otherwise the flow graph consumes samples as fast as it can process them.
+"""
+
+from __future__ import absolute_import, division
+
+import calendar
+import json
+import mmap
+import os.path
+import threading
+import time
+
+from zope.interface import implements  # available via Twisted
+
+from gnuradio import blocks
+from gnuradio import gr
+
+from shinysdr.devices import Device, IRXDriver
+from shinysdr.i.recording import SIGMF_DATATYPE, sigmf_meta_path
+from shinysdr.signals import SignalType
+from shinysdr.types import RangeT
+from shinysdr import units
+from shinysdr.values import ExportedState, LooseCell, exported_value, setter
+
+
+__all__ = []  # appended later
+
+
+# Number of samples copied into the flow graph at once.
+_CHUNK_SAMPLES = 8192
+
+# Number of chunks which may be waiting in the flow graph's queue. This bounds how far the playback position runs ahead of the samples being processed, and how long a seek takes to be heard.
+_QUEUE_CHUNKS = 4
+
+# If real-time playback falls further behind the clock than this many seconds (for example, because the flow graph was stopped), it resumes from the current time rather than trying to catch up.
+_MAX_LAG = 0.5
+
+
+def PlaybackDevice(path, name=None, realtime=True, loop=True):
+    """Play back a SigMF recording, such as one made by the IQ recorder.
+
+    path may name either the .sigmf-data or .sigmf-meta file. The device's frequency is that of the recording's first capture segment.
+    """
+    data_path = os.path.splitext(path)[0] + '.sigmf-data'
+    recording = _read_recording_metadata(data_path)
+    rx_driver = _PlaybackRXDriver(data_path, recording, realtime=realtime, loop=loop)
+    return Device(
+        name=name or unicode(os.path.basename(data_path)),
+        vfo_cell=LooseCell(
+            key='freq',
+            value=recording.center_freq,
+            type=RangeT([(recording.center_freq, recording.center_freq)]),
+            writable=False,
+            persists=False),
+        rx_driver=rx_driver)
+
+
+__all__.append('PlaybackDevice')
+
+
+class _RecordingMetadata(object):
+    def __init__(self, sample_rate, center_freq, captures):
+        self.sample_rate = sample_rate
+        self.center_freq = center_freq
+        self.captures = captures  # list of (first sample index, time of that sample or None)
+
+
+def _read_recording_metadata(data_path):
+    with open(sigmf_meta_path(data_path), 'rb') as f:
+        metadata = json.load(f)
+    global_info = metadata.get(u'global', {})
+    datatype = global_info.get(u'core:datatype')
+    if datatype != SIGMF_DATATYPE:
+        raise ValueError('PlaybackDevice: %s: sample format %r is not supported; only %r is' % (data_path, datatype, SIGMF_DATATYPE))
+    sample_rate = global_info.get(u'core:sample_rate')
+    if not sample_rate > 0:
+        raise ValueError('PlaybackDevice: %s: sample rate is missing' % (data_path,))
+    captures = metadata.get(u'captures') or [{}]
+    return _RecordingMetadata(
+        sample_rate=float(sample_rate),
+        center_freq=float(captures[0].get(u'core:frequency', 0.0)),
+        captures=[
+            (int(capture.get(u'core:sample_start', 0)), _parse_sigmf_datetime(capture.get(u'core:datetime')))
+            for capture in captures])
+
+
+def _parse_sigmf_datetime(text):
+    if text is None:
+        return None
+    whole, _, fraction = text.rstrip(u'Z').partition(u'.')
+    return calendar.timegm(time.strptime(whole, '%Y-%m-%dT%H:%M:%S')) + float(u'0.' + (fraction or u'0'))
+
+
+class _PlaybackRXDriver(ExportedState, gr.hier_block2):
+    implements(IRXDriver)
+
+    def __init__(self, data_path, recording, realtime, loop):
+        gr.hier_block2.__init__(
+            self, type(self).__name__,
+            gr.io_signature(0, 0, 0),
+            gr.io_signature(1, 1, gr.sizeof_gr_complex * 1),
+        )
+
+        self.__recording = recording
+        self.__sample_rate = recording.sample_rate
+        with open(data_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < gr.sizeof_gr_complex:
+                raise ValueError('PlaybackDevice: %s: recording is empty' % (data_path,))
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__length = len(self.__map) // gr.sizeof_gr_complex
+
+        self.__signal_type = SignalType(
+            kind='IQ',
+            sample_rate=self.__sample_rate)
+        self.__usable_bandwidth = RangeT([(-self.__sample_rate / 2, self.__sample_rate / 2)])
+
+        # State shared with the feeder thread, guarded by self.__condition.
+        self.__condition = threading.Condition()
+        self.__position = 0
+        self.__realtime = bool(realtime)
+        self.__loop = bool(loop)
+        self.__closed = False
+        self.__seek_generation = 0  # incremented by each seek, so that the feeder can tell a chunk it was blocked on inserting is stale
+        self.__pace_start = None  # time at which __paced_samples started being played in real-time mode
+        self.__paced_samples = 0
+
+        self.__queue = gr.msg_queue(_QUEUE_CHUNKS)
+        self.__source = blocks.message_source(gr.sizeof_gr_complex, self.__queue)
+        self.connect(self.__source, self)
+
+        self.__thread = threading.Thread(target=self.__feed, name='ShinySDR playback')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    # implement IRXDriver
+    @exported_value(type=SignalType, changes='never')
+    def get_output_type(self):
+        return self.__signal_type
+
+    # implement IRXDriver
+    def get_tune_delay(self):
+        return 0.0
+
+    # implement IRXDriver
+    def get_usable_bandwidth(self):
+        return self.__usable_bandwidth
+
+    # implement IRXDriver
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+        # The feeder may be waiting for room in the queue.
+        self.__queue.flush()
+        self.__thread.join()
+        self.__map.close()
+        self.disconnect_all()
+
+    # implement IRXDriver
+    def notify_reconnecting_or_restarting(self):
+        # The flow graph may have been stopped, so don't try to catch up on the time that passed.
+        with self.__condition:
+            self.__pace_start = None
+
+    @exported_value(
+        type_fn=lambda self: RangeT([(0, self.__length / self.__sample_rate)], unit=units.s, strict=False),
+        changes='continuous',
+        persists=False,
+        label='Position',
+        description='Time from the start of the recording which is being played, approximately.')
+    def get_position(self):
+        return round(self.__position / self.__sample_rate, 3)
+
+    @setter
+    def set_position(self, value):
+        position = int(round(value * self.__sample_rate))
+        with self.__condition:
+            self.__position = min(max(0, position), self.__length - 1)
+            self.__seek_generation += 1
+            self.__pace_start = None
+            self.__condition.notify_all()
+        # Discard samples read from the old position, so that the seek is immediate.
+        self.__queue.flush()
+
+    @exported_value(type=unicode, changes='continuous', label='Recorded at')
+    def get_recorded_time(self):
+        position = self.__position
+        start_sample, start_time = self.__recording.captures[0]
+        for capture in self.__recording.captures:
+            if capture[0] > position:
+                break
+            start_sample, start_time = capture
+        if start_time is None:
+            return u''
+        t = start_time + (position - start_sample) / self.__sample_rate
+        return unicode(time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))) + u'Z'
+
+    @exported_value(type=bool, changes='this_setter', label='Real time',
+        description='Play at the recorded sample rate. Otherwise, play as fast as the samples can be processed.')
+    def get_realtime(self):
+        return self.__realtime
+
+    @setter
+    def set_realtime(self, value):
+        with self.__condition:
+            self.__realtime = bool(value)
+            self.__pace_start = None
+            self.__condition.notify_all()
+
+    @exported_value(type=bool, changes='this_setter', label='Loop')
+    def get_loop(self):
+        return self.__loop
+
+    @setter
+    def set_loop(self, value):
+        with self.__condition:
+            self.__loop = bool(value)
+            self.__condition.notify_all()
+
+    def __feed(self):
+        # RUNS IN A SEPARATE THREAD
+        while True:
+            with self.__condition:
+                chunk = self.__next_chunk()
+                if chunk is None:
+                    return
+                start, end = chunk
+                generation = self.__seek_generation
+            # Copying out of the map lets the OS page the file in as needed.
+            self.__queue.insert_tail(gr.message_from_string(
+                self.__map[start * gr.sizeof_gr_complex:end * gr.sizeof_gr_complex]))  # blocks while the queue is full
+            with self.__condition:
+                if generation != self.__seek_generation:
+                    # A seek happened while we were blocked, after it flushed the queue, so the chunk we just inserted (and nothing else, since we are the only writer) is from the old position.
+                    self.__queue.flush()
+
+    def __next_chunk(self):
+        """Wait until a chunk should be played, and return its (start, end) sample indexes, or None if closed.
+
+        Must be called with self.__condition held."""
+        while True:
+            if self.__closed:
+                return None
+            if self.__position >= self.__length:
+                if not self.__loop:
+                    # Stopped at the end; wait for a seek or loop to be turned on.
+                    self.__condition.wait()
+                    continue
+                self.__position = 0
+            start = self.__position
+            end = min(start + _CHUNK_SAMPLES, self.__length)
+            if self.__realtime:
+                delay = self.__pacing_delay()
+                if delay > 0:
+                    # May be interrupted by a seek or other change, which is then obeyed.
+                    self.__condition.wait(delay)
+                    continue
+                self.__paced_samples += end - start
+            self.__position = end
+            return (start, end)
+
+    def __pacing_delay(self):
+        """Return how long to wait before playing the next chunk in real-time mode."""
+        now = time.time()
+        if self.__pace_start is None or now - (self.__pace_start + self.__paced_samples / self.__sample_rate) > _MAX_LAG:
+            self.__pace_start = now
+            self.__paced_samples = 0
+        # Keep the flow graph supplied with one chunk ahead of the clock.
+        return self.__pace_start + (self.__paced_samples - _CHUNK_SAMPLES) / self.__sample_rate - now
@@ -34,7 +34,7 @@ from shinysdr.filters import MultistageChannelFilter
 from shinysdr.math import dB
 from shinysdr.interfaces import ModeDef, IDemodulator
 from shinysdr.signals import no_signal
-from shinysdr.telemetry import ITelemetryMessage, ITelemetryObject
+from shinysdr.telemetry import IPersistableTelemetryMessage, ITelemetryObject
 from shinysdr.twisted_ext import test_subprocess
 from shinysdr.types import EnumRow, TimestampT
 from shinysdr.values import ExportedState, LooseCell, exported_value
@@ -256,7 +256,7 @@ _message_field_is_id = {
 
 
 class RTL433MessageWrapper(object):
-    implements(ITelemetryMessage)
+    implements(IPersistableTelemetryMessage)
     
     def __init__(self, message, receive_time):
         self.message = message  # a parsed rtl_433 JSON-format message
@@ -277,10 +277,15 @@ class RTL433MessageWrapper(object):
 class RTL433MsgGroup(ExportedState):
     implements(ITelemetryObject)
     
+    # There may be many thousands of groups, so avoid a per-instance dict. ExportedState's own attributes, which would need one, are created only once a client looks at the group's cells.
+    __slots__ = ('__values', '__cells', '__last_heard_time', '__shape_changed')
+    
     def __init__(self, object_id):
         """Implements ITelemetryObject."""
-        self.__cells = {}
+        self.__values = {}  # message field name -> latest value
+        self.__cells = None  # message field name -> LooseCell, created when state_def is first called
         self.__last_heard_time = None
+        self.__shape_changed = False
     
     def state_is_dynamic(self):
         """Overrides ExportedState."""
@@ -289,29 +294,45 @@ class RTL433MsgGroup(ExportedState):
     def state_def(self, callback):
         """Overrides ExportedState."""
         super(RTL433MsgGroup, self).state_def(callback)
+        if self.__cells is None:
+            self.__cells = {}
+            for k, v in self.__values.iteritems():
+                self.__add_cell(k, v)
         for cell in self.__cells.itervalues():
             callback(cell)
     
+    def __add_cell(self, k, v):
+        self.__cells[k] = LooseCell(
+            key=k,
+            value=v,
+            type=object,
+            writable=False,
+            persists=False,
+            label=k)
+    
     # not exported
     def receive(self, message_wrapper):
         """Implements ITelemetryObject."""
         self.__last_heard_time = message_wrapper.receive_time
-        shape_changed = False
+        cells = self.__cells
         for k, v in message_wrapper.message.iteritems():
             if _message_field_is_id.get(k, False) or k == u'time':
                 continue
-            if k not in self.__cells:
-                shape_changed = True
-                self.__cells[k] = LooseCell(
-                    key=k,
-                    value=None,
-                    type=object,
-                    writable=False,
-                    persists=False,
-                    label=k)
-            self.__cells[k].set_internal(v)
-        self.state_changed()
-        if shape_changed:
+            if k not in self.__values:
+                self.__shape_changed = True
+            self.__values[k] = v
+            if cells is not None:
+                if k in cells:
+                    cells[k].set_internal(v)
+                else:
+                    self.__add_cell(k, v)
+    
+    def flush_changes(self):
+        """Implements ITelemetryObject."""
+        # The message field cells, if they exist, announced their own changes.
+        self.state_changed('last_heard_time')
+        if self.__shape_changed:
+            self.__shape_changed = False
             self.state_shape_changed()
     
     def is_interesting(self):
@@ -337,4 +358,5 @@ _rtl_433_available = test_subprocess(
 plugin_mode = ModeDef(mode='433',
     info=EnumRow(label='rtl_433', description='OOK telemetry decoded by rtl_433 mostly found at 433 MHz'),
     demod_class=RTL433Demodulator,
-    available=_rtl_433_available)
+    available=_rtl_433_available,
+    telemetry=True)
@@ -23,13 +23,20 @@ TODO: This doesn't actually deserve its own module; it's just not clear where to
 from __future__ import absolute_import, division
 
 from collections import namedtuple
+import heapq
+import math
+
+import numpy
 
 from twisted.internet import reactor as the_reactor
 from twisted.internet.interfaces import IReactorTime
 from zope.interface import Interface, implements
 
-from shinysdr.types import python_type_registry
-from shinysdr.values import CellDict, CollectionState
+from gnuradio import gr
+
+from shinysdr.i.math import geodesic_distance
+from shinysdr.types import BulkDataT, python_type_registry
+from shinysdr.values import CellDict, CollectionState, StreamCell
 
 
 __all__ = []  # appended later
@@ -106,6 +113,132 @@ empty_track = Track(
 __all__.append('empty_track')
 
 
+# Number of values stored per position in a TrackHistory: latitude, longitude, altitude, and time relative to the history's origin time.
+_TRACK_HISTORY_FIELDS = 4
+
+# Number of positions a TrackHistory has room for at first. Most objects are heard only a few times, so the buffer starts small and doubles as needed up to its capacity.
+_TRACK_HISTORY_INITIAL_ROWS = 4
+
+
+class TrackHistory(object):
+    """
+    Recent positions of a tracked object, kept in a bounded ring buffer of packed float32 values so that the client need not accumulate the trail itself.
+    
+    A position is recorded only if it is at least min_distance meters and min_interval seconds from the last recorded position, so that the capacity covers a useful length of trail however often the object reports, and a stationary object does not fill the buffer with copies of one position.
+    
+    Exported as a StreamCell (see cell()) whose value is the entire history, oldest first, with the origin time and number of values per position as the info. A snapshot is sent to each subscriber when it subscribes and whenever a position is recorded.
+    """
+    
+    # There may be one of these for each of many thousands of objects.
+    __slots__ = (
+        '__capacity', '__min_distance', '__min_interval', '__points', '__next_index', '__count', '__origin_time', '__last', '__queues')
+    
+    def __init__(self, capacity=256, min_distance=50.0, min_interval=10.0):
+        self.__capacity = capacity
+        self.__min_distance = min_distance
+        self.__min_interval = min_interval
+        self.__points = None  # allocated when the first position is recorded, and grown until it reaches capacity
+        self.__next_index = 0
+        self.__count = 0
+        self.__origin_time = None
+        self.__last = None  # (latitude, longitude, time) of the last recorded position
+        self.__queues = ()  # a tuple rather than a set since there are rarely any
+    
+    def record(self, track):
+        """Record the current position of the Track, if it is far enough from the last recorded position. Return whether it was recorded."""
+        latitude = track.latitude.value
+        longitude = track.longitude.value
+        time = track.longitude.timestamp
+        if latitude is None or longitude is None or time is None:
+            return False
+        last = self.__last
+        if last is not None:
+            if time - last[2] < self.__min_interval:
+                return False
+            if geodesic_distance((latitude, longitude), last[:2]) < self.__min_distance:
+                return False
+        
+        if self.__points is None:
+            self.__points = numpy.zeros((min(_TRACK_HISTORY_INITIAL_ROWS, self.__capacity), _TRACK_HISTORY_FIELDS), dtype=numpy.float32)
+            self.__origin_time = time
+        elif self.__next_index == len(self.__points) < self.__capacity:
+            # Not yet wrapped around, so the rows are in order and can be copied as is.
+            self.__points = numpy.concatenate((
+                self.__points,
+                numpy.zeros((min(len(self.__points), self.__capacity - len(self.__points)), _TRACK_HISTORY_FIELDS), dtype=numpy.float32)))
+        altitude = track.altitude.value
+        self.__points[self.__next_index] = (
+            latitude,
+            longitude,
+            float('nan') if altitude is None else altitude,
+            time - self.__origin_time)
+        self.__next_index = (self.__next_index + 1) % self.__capacity
+        self.__count = min(self.__count + 1, self.__capacity)
+        self.__last = (latitude, longitude, time)
+        
+        if self.__queues:
+            data = self.get().tostring()
+            for queue in self.__queues:
+                queue.insert_tail(_make_history_message(data))
+        return True
+    
+    def get(self):
+        """Return the recorded positions, oldest first, as an array of rows of latitude, longitude, altitude (NaN if unknown), and time relative to the origin time."""
+        if self.__points is None:
+            return numpy.zeros((0, _TRACK_HISTORY_FIELDS), dtype=numpy.float32)
+        rows = len(self.__points)
+        start = (self.__next_index - self.__count) % rows
+        if start + self.__count <= rows:
+            return self.__points[start:start + self.__count].copy()
+        else:
+            return numpy.concatenate((self.__points[start:], self.__points[:self.__next_index]))
+    
+    def get_origin_time(self):
+        """Return the Unix time which the stored times are relative to, or None if nothing is recorded."""
+        return self.__origin_time
+    
+    def cell(self):
+        """Return a StreamCell, with key 'track_history', to be exported by the tracked object."""
+        return StreamCell(self, 'track_history',
+            type=track_history_type,
+            label='Track history')
+    
+    # for StreamCell
+    def get_track_history_distributor(self):
+        return self
+    
+    # for StreamCell
+    def get_track_history_info(self):
+        return (self.__origin_time or 0.0, _TRACK_HISTORY_FIELDS)
+    
+    # distributor protocol
+    def subscribe(self, queue):
+        assert queue not in self.__queues
+        self.__queues += (queue,)
+        if self.__count > 0:
+            queue.insert_tail(_make_history_message(self.get().tostring()))
+    
+    # distributor protocol
+    def unsubscribe(self, queue):
+        queues = list(self.__queues)
+        queues.remove(queue)
+        self.__queues = tuple(queues)
+
+
+__all__.append('TrackHistory')
+
+
+track_history_type = BulkDataT(info_format='dI', array_format='f')
+
+
+__all__.append('track_history_type')
+
+
+def _make_history_message(data):
+    # The whole history is a single item.
+    return gr.message_from_string(data, 0, len(data), 1)
+
+
 class ITelemetryObject(Interface):
     """
     An object that can be in an TelemetryStore.
@@ -113,7 +246,14 @@ class ITelemetryObject(Interface):
     
     def receive(message):
         """
-        TODO document
+        Update the object from the message.
+        
+        This should not announce changes to the object's cells; the store calls flush_changes() after the object has received all of the messages in a batch.
+        """
+    
+    def flush_changes():
+        """
+        Announce (by state_changed or similar) changes to cells which may have been made by receive() since the last call.
         """
     
     def is_interesting():
@@ -149,6 +289,29 @@ class ITelemetryMessage(Interface):
 __all__.append('ITelemetryMessage')
 
 
+class IPersistableTelemetryMessage(ITelemetryMessage):
+    """
+    A telemetry message which may be pickled into a telemetry snapshot, to be received again after a restart.
+    """
+
+
+__all__.append('IPersistableTelemetryMessage')
+
+
+class ITrackedTelemetryObject(ITelemetryObject):
+    """
+    A telemetry object which has a position, which TelemetryStore indexes for area queries.
+    """
+    
+    def get_track():
+        """
+        Return the object's current Track.
+        """
+
+
+__all__.append('ITrackedTelemetryObject')
+
+
 class ITelemetryStore(Interface):
     """
     Marker interface for client. Only implementation is TelemetryStore.
@@ -158,6 +321,13 @@ class ITelemetryStore(Interface):
 __all__.append('ITelemetryStore')
 
 
+# The expiry queue is rebuilt when it has more than this many entries beyond twice the number of objects.
+_EXPIRY_QUEUE_SLACK = 100
+
+# Size, in degrees of latitude and longitude, of the cells of TelemetryStore's spatial index.
+_GRID_DEGREES = 0.25
+
+
 class TelemetryStore(CollectionState):
     """
     Accepts telemetry messages and exports the accumulated information obtained from them.
@@ -169,55 +339,403 @@ class TelemetryStore(CollectionState):
         CollectionState.__init__(self, self.__interesting_objects)
         self.__objects = {}
         self.__expiry_times = {}
+        # Heap of (expiry time, object id). Entries are not removed when an object's expiry time changes, but are discarded when they reach the front and no longer match __expiry_times.
+        self.__expiry_queue = []
         self.__time_source = IReactorTime(time_source)
         self.__flush_call = None
+        self.__pending_messages = []
+        self.__apply_call = None
+        self.__retained_message_count = 0
+        self.__retained_messages = {}  # object ID -> tuple of recent IPersistableTelemetryMessages
+        self.__pending_restores = []
+        self.__spatial_index = _SpatialIndex(_GRID_DEGREES)
+        self.__area_subscriptions = set()
+    
+    # not exported
+    def query_area(self, south, west, north, east):
+        """Return a dict of object IDs to the objects whose latest position is within the given bounds, in degrees.
+        
+        Only interesting objects with positions (ITrackedTelemetryObject) are included. If west is greater than east, the area crosses the 180th meridian.
+        """
+        objects = self.__interesting_objects
+        return {
+            object_id: objects[object_id]
+            for object_id in self.__spatial_index.query(_Area(south, west, north, east))
+        }
+    
+    # not exported
+    def subscribe_area(self, south, west, north, east, enter, leave, include_unpositioned=False):
+        """Be notified of objects entering and leaving an area, as in query_area.
+        
+        enter(object_id, obj) is called for each object in the area, including immediately for the objects already there, and leave(object_id) when an object moves out of the area or expires. Notifications happen after each batch of messages is applied.
+        
+        If include_unpositioned is true, interesting objects with no known position are treated as being inside the area.
+        
+        Returns a subscription object with unsubscribe() and set_area(south, west, north, east) methods; set_area notifies of the difference between the old and new areas.
+        """
+        return _AreaSubscription(
+            self.__spatial_index,
+            self.__interesting_objects,
+            self.__area_subscriptions,
+            _Area(south, west, north, east),
+            enter,
+            leave,
+            include_unpositioned)
+    
+    # not exported
+    def state_subscribe_area(self, area, callback, context):
+        """Like state_subscribe, but for a view of this store containing only the objects near what a client is displaying on a map.
+        
+        area is a (south, west, north, east) tuple as for query_area. Objects with no known position are always included, since they cannot be placed inside or outside the area.
+        
+        Returns a subscription object with get_state(), set_area(area), and unsubscribe() methods. get_state() returns the cells of the objects currently in the view.
+        """
+        return _AreaStateSubscription(self.__interesting_objects, self.subscribe_area, area, callback, context)
+    
+    # not exported
+    def retain_messages(self, count):
+        """Keep the last count persistable messages received by each object, for get_snapshot()."""
+        self.__retained_message_count = count
+    
+    # not exported
+    def get_snapshot(self):
+        """Return a list of (object ID, expiry time, tuple of recent messages oldest first) for each object which has retained messages.
+        
+        Receiving the messages again (by restore()) approximately recreates the object.
+        """
+        expiry_times = self.__expiry_times
+        return [
+            (object_id, expiry_times[object_id], messages)
+            for object_id, messages in self.__retained_messages.iteritems()
+        ]
+    
+    # not exported
+    def restore(self, messages):
+        """Receive messages previously received by one object (e.g. from get_snapshot()), oldest first, unless that object already exists.
+        
+        Restored messages are applied before messages given to receive() in the same batch, so they cannot overwrite newer information.
+        """
+        if not messages:
+            return
+        self.__pending_restores.append(map(ITelemetryMessage, messages))
+        self.__schedule_apply()
     
     # not exported
     def receive(self, message):
-        """Store the supplied telemetry message object."""
-        message = ITelemetryMessage(message)
-        object_id = unicode(message.get_object_id())
+        """Store the supplied telemetry message object.
         
-        if object_id in self.__objects:
-            obj = self.__objects[object_id]
-        else:
+        Messages are applied in a batch on the next reactor turn, so that an object which receives several messages in that time announces its changes only once.
+        """
+        self.__pending_messages.append(ITelemetryMessage(message))
+        self.__schedule_apply()
+    
+    def __schedule_apply(self):
+        if self.__apply_call is None:
+            self.__apply_call = self.__time_source.callLater(0, self.__apply_pending)
+    
+    def __apply_pending(self):
+        self.__apply_call = None
+        restores = self.__pending_restores
+        self.__pending_restores = []
+        messages = self.__pending_messages
+        self.__pending_messages = []
+        
+        updated = {}
+        changed = []
+        for restored_messages in restores:
+            if unicode(restored_messages[0].get_object_id()) in self.__objects:
+                continue
+            for message in restored_messages:
+                self.__apply_message(message, updated)
+        for message in messages:
+            self.__apply_message(message, updated)
+        
+        for object_id, obj in updated.iteritems():
+            obj.flush_changes()
+            expiry = obj.get_object_expiry()
+            if self.__expiry_times.get(object_id) != expiry:
+                self.__expiry_times[object_id] = expiry
+                heapq.heappush(self.__expiry_queue, (expiry, object_id))
+            became_interesting = obj.is_interesting() and object_id not in self.__interesting_objects
+            if became_interesting:
+                self.__interesting_objects[object_id] = obj
+            moved = (
+                object_id in self.__interesting_objects and
+                ITrackedTelemetryObject.providedBy(obj) and
+                self.__spatial_index.update(object_id, _track_position(obj.get_track())))
+            if became_interesting or moved:
+                changed.append(object_id)
+        
+        self.__notify_area_subscriptions(changed)
+        self.__maybe_schedule_flush()
+    
+    def __notify_area_subscriptions(self, object_ids):
+        if not object_ids:
+            return
+        for subscription in list(self.__area_subscriptions):
+            subscription._update(object_ids)
+    
+    def __apply_message(self, message, updated):
+        object_id = unicode(message.get_object_id())
+        obj = self.__objects.get(object_id)
+        if obj is None:
             obj = self.__objects[object_id] = ITelemetryObject(
                 # TODO: Should probably have a context object supplying last message time and delete_me()
                 message.get_object_constructor()(object_id=object_id))
-
         obj.receive(message)
-        expiry = obj.get_object_expiry()
-        self.__expiry_times[object_id] = expiry
-        if obj.is_interesting():
-            self.__interesting_objects[object_id] = obj
-        
-        self.__maybe_schedule_flush()
+        updated[object_id] = obj
+        count = self.__retained_message_count
+        if count and IPersistableTelemetryMessage.providedBy(message):
+            retained = self.__retained_messages
+            retained[object_id] = (retained.get(object_id, ()) + (message,))[-count:]
     
     def __flush_expired(self):
+        self.__flush_call = None
         current_time = self.__time_source.seconds()
-        deletes = []
-        for object_id, expiry in self.__expiry_times.iteritems():
-            if expiry <= current_time:
-                deletes.append(object_id)
-        for object_id in deletes:
+        queue = self.__expiry_queue
+        removed = []
+        while queue and queue[0][0] <= current_time:
+            expiry, object_id = heapq.heappop(queue)
+            if self.__expiry_times.get(object_id) != expiry:
+                # Stale entry; the object has since been updated.
+                continue
             del self.__objects[object_id]
             del self.__expiry_times[object_id]
+            self.__retained_messages.pop(object_id, None)
+            self.__spatial_index.update(object_id, None)
             if object_id in self.__interesting_objects:
                 del self.__interesting_objects[object_id]
+                removed.append(object_id)
         
+        # Subscriptions only look up objects which are inside their areas, so it is fine that the removed objects are already gone.
+        self.__notify_area_subscriptions(removed)
         self.__maybe_schedule_flush()
     
     def __maybe_schedule_flush(self):
-        """Schedule a call to __flush_expired if there is not one already."""
-        if self.__flush_call and self.__flush_call.active():
-            # Could need to schedule one earlier than already scheduled.
-            self.__flush_call.cancel()
+        """Schedule a call to __flush_expired for the earliest expiry time, if there is not one already scheduled at or before it."""
+        queue = self.__expiry_queue
+        expiry_times = self.__expiry_times
+        while queue and expiry_times.get(queue[0][1]) != queue[0][0]:
+            heapq.heappop(queue)
+        if len(queue) > 2 * len(expiry_times) + _EXPIRY_QUEUE_SLACK:
+            # Too many stale entries; rebuilding takes time proportional to the number of updates since the last rebuild.
+            queue[:] = [(expiry, object_id) for object_id, expiry in expiry_times.iteritems()]
+            heapq.heapify(queue)
         
-        if self.__expiry_times:
-            next_expiry = min(self.__expiry_times.itervalues())
-            self.__flush_call = self.__time_source.callLater(
-                next_expiry - self.__time_source.seconds(),
-                self.__flush_expired)
+        flush_call = self.__flush_call
+        if not queue:
+            if flush_call is not None and flush_call.active():
+                flush_call.cancel()
+            self.__flush_call = None
+            return
+        next_expiry = queue[0][0]
+        if flush_call is not None and flush_call.active():
+            if flush_call.getTime() <= next_expiry:
+                # If it is early because an object's expiry was extended, it will find nothing to do and reschedule.
+                return
+            flush_call.cancel()
+        self.__flush_call = self.__time_source.callLater(
+            next_expiry - self.__time_source.seconds(),
+            self.__flush_expired)
 
 
 __all__.append('TelemetryStore')
+
+
+def _track_position(track):
+    latitude = track.latitude.value
+    longitude = track.longitude.value
+    if latitude is None or longitude is None:
+        return None
+    return (latitude, longitude)
+
+
+class _Area(namedtuple('_Area', ['south', 'west', 'north', 'east'])):
+    """A latitude-longitude box, which crosses the 180th meridian if west > east."""
+    def __new__(cls, south, west, north, east):
+        return super(_Area, cls).__new__(cls, south, _normalize_longitude(west), north, _normalize_longitude(east))
+    
+    def contains(self, position):
+        latitude, longitude = position
+        if not self.south <= latitude <= self.north:
+            return False
+        longitude = _normalize_longitude(longitude)
+        if self.west <= self.east:
+            return self.west <= longitude <= self.east
+        return longitude >= self.west or longitude <= self.east
+    
+    def longitude_ranges(self):
+        if self.west <= self.east:
+            return [(self.west, self.east)]
+        return [(self.west, 180.0), (-180.0, self.east)]
+
+
+def _normalize_longitude(longitude):
+    """Convert longitude to the range [-180, 180) (except that exactly 180 is left alone, so that areas may extend to it)."""
+    if -180 <= longitude <= 180:
+        return longitude
+    return (longitude + 180) % 360 - 180
+
+
+class _SpatialIndex(object):
+    """Grid of object IDs by position, for TelemetryStore."""
+    def __init__(self, cell_degrees):
+        self.__cell_degrees = cell_degrees
+        self.__cells = {}  # (row, column) -> set of object IDs
+        self.__positions = {}  # object ID -> (latitude, longitude)
+    
+    def __cell_key(self, latitude, longitude):
+        d = self.__cell_degrees
+        return (int(math.floor(latitude / d)), int(math.floor(_normalize_longitude(longitude) / d)))
+    
+    def get_position(self, object_id):
+        return self.__positions.get(object_id)
+    
+    def update(self, object_id, position):
+        """Set or (if position is None) remove the position of an object. Return whether it changed."""
+        old_position = self.__positions.get(object_id)
+        if position == old_position:
+            return False
+        if old_position is not None:
+            key = self.__cell_key(*old_position)
+            ids = self.__cells[key]
+            ids.discard(object_id)
+            if not ids:
+                del self.__cells[key]
+            del self.__positions[object_id]
+        if position is not None:
+            self.__positions[object_id] = position
+            self.__cells.setdefault(self.__cell_key(*position), set()).add(object_id)
+        return True
+    
+    def query(self, area):
+        """Return a list of the IDs of objects within the _Area."""
+        (south_row, _) = self.__cell_key(max(-90.0, area.south), 0)
+        (north_row, _) = self.__cell_key(min(90.0, area.north), 0)
+        column_ranges = []
+        cell_count = 0
+        for west, east in area.longitude_ranges():
+            west_column = self.__cell_key(0, west)[1]
+            east_column = self.__cell_key(0, east)[1]
+            column_ranges.append((west_column, east_column))
+            cell_count += (north_row - south_row + 1) * (east_column - west_column + 1)
+        
+        cells = self.__cells
+        if cell_count > len(cells):
+            # Large area; cheaper to look at every occupied cell.
+            candidate_cells = [
+                ids for (row, column), ids in cells.iteritems()
+                if south_row <= row <= north_row and any(w <= column <= e for w, e in column_ranges)]
+        else:
+            candidate_cells = [
+                cells[(row, column)]
+                for row in xrange(south_row, north_row + 1)
+                for w, e in column_ranges
+                for column in xrange(w, e + 1)
+                if (row, column) in cells]
+        
+        positions = self.__positions
+        return [
+            object_id
+            for ids in candidate_cells
+            for object_id in ids
+            if area.contains(positions[object_id])]
+
+
+class _AreaSubscription(object):
+    def __init__(self, index, objects, subscription_set, area, enter, leave, include_unpositioned):
+        self.__index = index
+        self.__objects = objects
+        self.__subscription_set = subscription_set
+        self.__area = area
+        self.__enter = enter
+        self.__leave = leave
+        self.__include_unpositioned = include_unpositioned
+        self.__inside = set()
+        subscription_set.add(self)
+        self.__enter_all(self.__query())
+    
+    def set_area(self, south, west, north, east):
+        self.__area = _Area(south, west, north, east)
+        now_inside = self.__query()
+        for object_id in self.__inside - now_inside:
+            self.__inside.remove(object_id)
+            self.__leave(object_id)
+        self.__enter_all(now_inside - self.__inside)
+    
+    def unsubscribe(self):
+        self.__subscription_set.remove(self)
+    
+    def _update(self, object_ids):
+        for object_id in object_ids:
+            is_inside = self.__contains(object_id)
+            was_inside = object_id in self.__inside
+            if is_inside and not was_inside:
+                self.__enter_all([object_id])
+            elif was_inside and not is_inside:
+                self.__inside.remove(object_id)
+                self.__leave(object_id)
+    
+    def __query(self):
+        inside = set(self.__index.query(self.__area))
+        if self.__include_unpositioned:
+            get_position = self.__index.get_position
+            inside.update(object_id for object_id in self.__objects if get_position(object_id) is None)
+        return inside
+    
+    def __contains(self, object_id):
+        if object_id not in self.__objects:
+            return False
+        position = self.__index.get_position(object_id)
+        if position is None:
+            return self.__include_unpositioned
+        return self.__area.contains(position)
+    
+    def __enter_all(self, object_ids):
+        for object_id in object_ids:
+            self.__inside.add(object_id)
+            self.__enter(object_id, self.__objects[object_id])
+
+
+class _AreaStateSubscription(object):
+    """Maintains the state of the view of a TelemetryStore for state_subscribe_area."""
+    def __init__(self, objects, subscribe_area, area, callback, context):
+        self.__objects = objects
+        self.__reactor = context.reactor
+        self.__state = {}
+        self.__fire_call = None
+        self.__callback = None  # no notifications for the initial contents
+        self.__area_subscription = subscribe_area(*area,
+            enter=self.__enter,
+            leave=self.__leave,
+            include_unpositioned=True)
+        self.__callback = callback
+    
+    def get_state(self):
+        return self.__state.copy()
+    
+    def set_area(self, area):
+        self.__area_subscription.set_area(*area)
+    
+    def unsubscribe(self):
+        self.__area_subscription.unsubscribe()
+        if self.__fire_call is not None and self.__fire_call.active():
+            self.__fire_call.cancel()
+        self.__fire_call = None
+    
+    def __enter(self, object_id, obj):
+        self.__state[object_id] = self.__objects.get_cell(object_id)
+        self.__changed()
+    
+    def __leave(self, object_id):
+        del self.__state[object_id]
+        self.__changed()
+    
+    def __changed(self):
+        # Coalesce the changes from one batch of messages or one set_area into one notification, as state_subscribe does for shape changes.
+        if self.__callback is not None and self.__fire_call is None:
+            self.__fire_call = self.__reactor.callLater(0, self.__fire)
+    
+    def __fire(self):
+        self.__fire_call = None
+        self.__callback(self.get_state())
@@ -0,0 +1,91 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+# 
+# This file is part of ShinySDR.
+# 
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Runs the benchmarks and optionally saves the results or compares them against saved results.
+
+Examples:
+    python -m shinysdr.test.benchmark --output baseline.json
+    python -m shinysdr.test.benchmark --compare baseline.json 'demod.*'
+"""
+
+from __future__ import absolute_import, division
+
+import argparse
+import json
+import sys
+
+from shinysdr.test.benchmark.runner import compare_results, format_comparisons, get_benchmark_names, run_benchmarks
+
+from shinysdr.test.benchmark import db, dsp, state, telemetry, top
+
+
+# Imported only for their benchmark registrations.
+_benchmark_modules = [db, dsp, state, telemetry, top]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m shinysdr.test.benchmark',
+        description='Run ShinySDR benchmarks.')
+    parser.add_argument('patterns', metavar='PATTERN', nargs='*',
+        help='only run benchmarks whose names match these glob patterns')
+    parser.add_argument('--list', action='store_true',
+        help='list benchmark names and exit')
+    parser.add_argument('--repeat', type=int, default=5,
+        help='number of times to run each benchmark; the fastest run is reported')
+    parser.add_argument('--output', metavar='FILE',
+        help='write results as JSON to FILE')
+    parser.add_argument('--compare', metavar='BASELINE',
+        help='compare results against a previously written results file, and exit with status 1 if there are regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+        help='fraction by which a benchmark must be slower than the baseline to count as a regression (default %(default)s)')
+    args = parser.parse_args(argv[1:])
+    
+    if args.list:
+        for name in get_benchmark_names():
+            print name
+        return 0
+    
+    baseline = None
+    if args.compare:
+        # read early so that a bad filename is reported before spending time running benchmarks
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    
+    def log(line):
+        print line
+        sys.stdout.flush()
+    
+    results = run_benchmarks(patterns=args.patterns, repeat=args.repeat, log=log)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    
+    if baseline is not None:
+        comparisons = compare_results(baseline, results, threshold=args.threshold)
+        print
+        print '%-40s %12s %12s  %7s' % ('benchmark', 'baseline', 'current', 'change')
+        print format_comparisons(comparisons)
+        if any(is_regression for _, _, _, _, is_regression in comparisons):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,52 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+# 
+# This file is part of ShinySDR.
+# 
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of the frequency database.
+"""
+
+from __future__ import absolute_import, division
+
+from StringIO import StringIO
+
+from shinysdr.i.db import _parse_csv_file, write_csv_file
+from shinysdr.test.benchmark.runner import benchmark
+
+
+_record_count = 10000
+
+
+def _make_csv():
+    lines = ['Location,Mode,Frequency,Name,Latitude,Longitude,Comment']
+    for i in xrange(_record_count):
+        if i % 10 == 0:
+            lines.append('%i,,%s-%s,Band %i,,,' % (i + 1, 100 + i / 1000, 100.5 + i / 1000, i))
+        else:
+            lines.append('%i,NFM,%s,Channel %i,37.%i,-122.%i,Some notes' % (i + 1, 100 + i / 1000, i, i, i))
+    return '\r\n'.join(lines) + '\r\n'
+
+
+@benchmark('db.load', items=_record_count)
+def _setup_db_load():
+    text = _make_csv()
+    return lambda: _parse_csv_file(StringIO(text))
+
+
+@benchmark('db.serialize', items=_record_count)
+def _setup_db_serialize():
+    records, _diagnostics = _parse_csv_file(StringIO(_make_csv()))
+    return lambda: write_csv_file(StringIO(), records)
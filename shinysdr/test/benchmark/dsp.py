@@ -0,0 +1,129 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+# 
+# This file is part of ShinySDR.
+# 
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of signal processing: channel filters, resamplers, demodulators, and the spectrum monitor.
+"""
+
+from __future__ import absolute_import, division
+
+from gnuradio import analog
+from gnuradio import blocks
+from gnuradio import gr
+
+from shinysdr.filters import MultistageChannelFilter, make_resampler
+from shinysdr.i.blocks import MonitorSink
+from shinysdr.interfaces import ModeDef
+from shinysdr.plugins import basic_demod
+from shinysdr.signals import SignalType
+from shinysdr.test.benchmark.runner import benchmark
+
+
+_samples = 2000000
+
+
+class _DummyContext(object):
+    """Context for blocks under test which are not reconfigured while running."""
+    def lock(self):
+        pass
+    
+    def unlock(self):
+        pass
+    
+    def rebuild_me(self):
+        pass
+    
+    def output_message(self, message):
+        pass
+    
+    def get_absolute_frequency(self):
+        return 0.0
+
+
+def _flowgraph_runner(block, input_itemsize, output_itemsize, complex_input=True):
+    """Return a function which runs _samples samples of noise through block."""
+    top = gr.top_block()
+    if complex_input:
+        source = analog.noise_source_c(analog.GR_GAUSSIAN, 0.3, 0)
+    else:
+        source = analog.noise_source_f(analog.GR_GAUSSIAN, 0.3, 0)
+    head = blocks.head(input_itemsize, _samples)
+    top.connect(source, head, block)
+    if output_itemsize is not None:
+        top.connect(block, blocks.null_sink(output_itemsize))
+    
+    def run():
+        head.reset()
+        top.run()
+    
+    return run
+
+
+def _define_filter_benchmark(name, **kwargs):
+    @benchmark('filter.' + name, items=_samples)
+    def _setup():
+        return _flowgraph_runner(MultistageChannelFilter(**kwargs), gr.sizeof_gr_complex, gr.sizeof_gr_complex)
+
+
+# Same configurations as channel_filter_benchmark.py.
+_define_filter_benchmark('ssb', input_rate=3200000, output_rate=8000, cutoff_freq=3000, transition_width=1200)
+_define_filter_benchmark('wfm', input_rate=2400000, output_rate=240000, cutoff_freq=80000, transition_width=20000)
+_define_filter_benchmark('resampling', input_rate=1000000, output_rate=48000, cutoff_freq=5000, transition_width=1000)
+
+
+def _define_resampler_benchmark(in_rate, out_rate):
+    @benchmark('resampler.%i_to_%i' % (in_rate, out_rate), items=_samples)
+    def _setup():
+        return _flowgraph_runner(make_resampler(in_rate, out_rate), gr.sizeof_float, gr.sizeof_float, complex_input=False)
+
+
+_define_resampler_benchmark(48000, 44100)
+_define_resampler_benchmark(10000, 48000)
+_define_resampler_benchmark(250000, 48000)
+
+
+_demodulator_input_rate = 480000
+
+
+def _define_demodulator_benchmark(mode_def):
+    @benchmark('demod.' + mode_def.mode, items=_samples)
+    def _setup():
+        demodulator = mode_def.demod_class(
+            mode=mode_def.mode,
+            input_rate=_demodulator_input_rate,
+            context=_DummyContext())
+        return _flowgraph_runner(demodulator, gr.sizeof_gr_complex, demodulator.get_output_type().get_itemsize())
+
+
+for _mode_def in sorted(
+        (value for value in vars(basic_demod).itervalues() if isinstance(value, ModeDef)),
+        key=lambda mode_def: mode_def.mode):
+    _define_demodulator_benchmark(_mode_def)
+
+
+def _define_monitor_benchmark(freq_resolution):
+    @benchmark('monitor.%i' % (freq_resolution,), items=_samples)
+    def _setup():
+        monitor = MonitorSink(
+            signal_type=SignalType(kind='IQ', sample_rate=2400000),
+            freq_resolution=freq_resolution,
+            context=_DummyContext())
+        return _flowgraph_runner(monitor, gr.sizeof_gr_complex, None)
+
+
+for _freq_resolution in [1024, 4096, 16384]:
+    _define_monitor_benchmark(_freq_resolution)
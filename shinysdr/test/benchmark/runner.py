@@ -0,0 +1,186 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+# 
+# This file is part of ShinySDR.
+# 
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Framework for benchmarks: registration, timing, JSON results, and comparison against a baseline.
+
+The benchmarks themselves are in the sibling modules; run them with
+    python -m shinysdr.test.benchmark --help
+"""
+
+from __future__ import absolute_import, division
+
+from collections import OrderedDict
+import fnmatch
+import gc
+import platform
+import sys
+import time
+import types
+
+__all__ = []  # appended later
+
+
+_RESULTS_FORMAT_VERSION = 1
+
+_benchmarks = OrderedDict()
+
+
+def benchmark(name, items=1, measure_memory=False):
+    """
+    Decorator to register a benchmark.
+    
+    The decorated function should do any setup and return a function which performs the work to be timed. items is the number of units of work (samples, messages, records...) that the returned function processes, so that results may be compared as time per item.
+    
+    If measure_memory is true, the returned function should return the data structure it built, and the memory retained by that value (see measure_size) is also reported, as bytes per item.
+    
+    The decorated function may instead return a tuple of the work function and a cleanup function, which is called after the last run (for example, to stop a running flow graph so that it does not disturb later benchmarks).
+    """
+    def decorator(setup):
+        if name in _benchmarks:
+            raise ValueError('benchmark %r already defined' % (name,))
+        _benchmarks[name] = (setup, items, measure_memory)
+        return setup
+    return decorator
+
+
+__all__.append('benchmark')
+
+
+def get_benchmark_names():
+    return _benchmarks.keys()
+
+
+__all__.append('get_benchmark_names')
+
+
+def run_benchmarks(patterns=None, repeat=5, log=None):
+    """
+    Run the benchmarks whose names match any of the glob patterns (or all of them) and return a results structure suitable for JSON serialization.
+    
+    Each benchmark is run repeat times and the fastest run is reported, since slower runs are most likely slowed by something other than the code being measured.
+    """
+    results = OrderedDict()
+    for name, (setup, items, measure_memory) in _benchmarks.iteritems():
+        if patterns and not any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+            continue
+        run = setup()
+        cleanup = None
+        if isinstance(run, tuple):
+            run, cleanup = run
+        wall_times = []
+        cpu_times = []
+        size = None
+        try:
+            for _ in xrange(repeat):
+                w0 = time.time()
+                c0 = time.clock()
+                retained = run()
+                c1 = time.clock()
+                w1 = time.time()
+                wall_times.append(w1 - w0)
+                cpu_times.append(c1 - c0)
+                if measure_memory and size is None:
+                    size = measure_size(retained)
+                del retained
+        finally:
+            if cleanup is not None:
+                cleanup()
+        results[name] = result = OrderedDict([
+            (u'seconds', min(wall_times)),
+            (u'cpu_seconds', min(cpu_times)),
+            (u'items', items),
+            (u'seconds_per_item', min(wall_times) / items),
+            (u'repeat', repeat),
+        ])
+        if size is not None:
+            result[u'bytes_per_item'] = size / items
+        if log is not None:
+            log('%-40s %10.6f s  %12.3g s/item%s' % (
+                name, result[u'seconds'], result[u'seconds_per_item'],
+                '  %10.0f bytes/item' % (size / items,) if size is not None else ''))
+    return OrderedDict([
+        (u'version', _RESULTS_FORMAT_VERSION),
+        (u'time', time.time()),
+        (u'python', platform.python_version()),
+        (u'platform', platform.platform()),
+        (u'benchmarks', results),
+    ])
+
+
+__all__.append('run_benchmarks')
+
+
+# Objects of these types are shared by all instances of a program's data structures, so they are not counted as retained by any one value.
+_SHARED_TYPES = (type, types.ClassType, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+
+def measure_size(value):
+    """
+    Return the approximate number of bytes of memory retained by value: the total sys.getsizeof of every object reachable from it, other than classes, modules, and functions.
+    
+    Objects which are also reachable from elsewhere are counted, so for a meaningful figure value should be the only user of what it refers to.
+    """
+    seen = set()
+    stack = [value]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+
+__all__.append('measure_size')
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """
+    Compare two results structures as returned by run_benchmarks.
+    
+    Returns a list of (name, baseline seconds per item, current seconds per item, ratio, is_regression) for each benchmark present in both. A benchmark is considered a regression if it is slower than the baseline by more than the fraction threshold.
+    """
+    for results in [baseline, current]:
+        if results.get(u'version') != _RESULTS_FORMAT_VERSION:
+            raise ValueError('unsupported benchmark results version %r' % (results.get(u'version'),))
+    comparisons = []
+    current_benchmarks = current[u'benchmarks']
+    for name, baseline_result in baseline[u'benchmarks'].iteritems():
+        if name not in current_benchmarks:
+            continue
+        old = baseline_result[u'seconds_per_item']
+        new = current_benchmarks[name][u'seconds_per_item']
+        ratio = new / old if old > 0 else float('inf')
+        comparisons.append((name, old, new, ratio, ratio > 1 + threshold))
+    return comparisons
+
+
+__all__.append('compare_results')
+
+
+def format_comparisons(comparisons):
+    lines = []
+    for name, old, new, ratio, is_regression in comparisons:
+        lines.append('%-40s %12.3g %12.3g  %+6.1f%%%s' % (
+            name, old, new, (ratio - 1) * 100, '  REGRESSION' if is_regression else ''))
+    return '\n'.join(lines)
+
+
+__all__.append('format_comparisons')
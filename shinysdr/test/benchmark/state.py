@@ -0,0 +1,115 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+# 
+# This file is part of ShinySDR.
+# 
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of the state export machinery: polling, state streams to clients, and JSON serialization.
+"""
+
+from __future__ import absolute_import, division
+
+from twisted.internet.task import Clock
+
+from shinysdr.i.json import serialize
+from shinysdr.i.network.export_ws import StateStreamInner
+from shinysdr.i.poller import Poller
+from shinysdr.telemetry import TelemetryItem, empty_track
+from shinysdr.test.benchmark.runner import benchmark
+from shinysdr.values import CellDict, CollectionState, ExportedState, SubscriptionContext, exported_value
+
+
+class _Specimen(ExportedState):
+    def __init__(self):
+        self.__value = 0.0
+    
+    def advance(self):
+        self.__value += 1
+    
+    @exported_value(type=float, changes='continuous')
+    def get_value(self):
+        return self.__value
+
+
+def _make_specimens(count):
+    return CollectionState(CellDict({unicode(i): _Specimen() for i in xrange(count)}))
+
+
+def _define_poller_benchmark(subscription_count):
+    @benchmark('poller.%i_subscriptions' % (subscription_count,), items=subscription_count)
+    def _setup():
+        poller = Poller()
+        context = SubscriptionContext(reactor=Clock(), poller=poller)
+        specimens = [_Specimen() for _ in xrange(subscription_count)]
+        for specimen in specimens:
+            specimen.state()['value'].subscribe2(lambda value: None, context)
+        
+        def run():
+            for specimen in specimens:
+                specimen.advance()
+            poller.poll(True)
+        
+        return run
+
+
+for _count in [100, 1000, 10000]:
+    _define_poller_benchmark(_count)
+
+
+def _define_state_stream_benchmark(client_count, cell_count=100):
+    @benchmark('state_stream.%i_clients' % (client_count,), items=client_count * cell_count)
+    def _setup():
+        poller = Poller()
+        context = SubscriptionContext(reactor=Clock(), poller=poller)
+        root = _make_specimens(cell_count)
+        specimens = [cell.get() for cell in root.state().itervalues()]
+        streams = [
+            StateStreamInner(lambda message: None, root, 'urlroot', subscription_context=context)
+            for _ in xrange(client_count)]
+        
+        def run():
+            for specimen in specimens:
+                specimen.advance()
+            poller.poll(True)
+            for stream in streams:
+                stream._flush()
+        
+        run()  # complete initial registration
+        return run
+
+
+for _count in [1, 10, 50]:
+    _define_state_stream_benchmark(_count)
+
+
+_serialize_count = 1000
+
+
+@benchmark('serialize.tracks', items=_serialize_count)
+def _setup_serialize_tracks():
+    tracks = [
+        empty_track._replace(
+            latitude=TelemetryItem(37.0 + i / 1000, 1000 + i),
+            longitude=TelemetryItem(-122.0, 1000 + i),
+            altitude=TelemetryItem(i, 1000 + i))
+        for i in xrange(_serialize_count)]
+    return lambda: serialize(tracks)
+
+
+@benchmark('serialize.cell_descriptions', items=_serialize_count)
+def _setup_serialize_cell_descriptions():
+    root = _make_specimens(_serialize_count)
+    cells = [specimen_cell.get().state()['value'] for specimen_cell in root.state().itervalues()]
+    return lambda: serialize([cell.description() for cell in cells])
@@ -0,0 +1,141 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+# 
+# This file is part of ShinySDR.
+# 
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of telemetry message handling.
+"""
+
+from __future__ import absolute_import, division
+
+from twisted.internet.task import Clock
+
+from shinysdr.plugins.aprs import drop_unheard_timeout_seconds, parse_tnc2
+from shinysdr.telemetry import TelemetryStore
+from shinysdr.test.benchmark.runner import benchmark
+from shinysdr.values import StreamCell, SubscriptionContext
+
+
+_receive_time = 1000000000.0
+
+# Number of messages received per reactor turn, as if they arrived together from one source.
+_BATCH_SIZE = 50
+
+
+def _make_messages(object_count, message_count):
+    return [
+        parse_tnc2(
+            'N%iX>APU25N,WIDE2-1:=%02i%05.2fN/122%05.2fW>comment' % (
+                i % object_count, 37 + i % 3, (i % 6000) / 100, (i % 5000) / 100),
+            _receive_time + i / 100)
+        for i in xrange(message_count)]
+
+
+def _receive_all(clock, store, messages):
+    for i, message in enumerate(messages):
+        store.receive(message)
+        if i % _BATCH_SIZE == _BATCH_SIZE - 1:
+            clock.advance(0)
+    clock.advance(0)
+
+
+def _define_ingest_benchmark(object_count, message_count):
+    @benchmark('telemetry.ingest_%i_objects' % (object_count,), items=message_count)
+    def _setup():
+        messages = _make_messages(object_count, message_count)
+        
+        def run():
+            clock = Clock()
+            clock.advance(_receive_time)
+            store = TelemetryStore(time_source=clock)
+            _receive_all(clock, store, messages)
+        
+        return run
+
+
+_define_ingest_benchmark(100, 10000)
+_define_ingest_benchmark(10000, 10000)
+
+
+@benchmark('telemetry.ingest_10_objects_subscribed', items=10000)
+def _setup_subscribed():
+    """Ingest with every cell of every object subscribed to, so that each batch of messages to an object costs one notification."""
+    messages = _make_messages(10, 10000)
+    clock = Clock()
+    clock.advance(_receive_time)
+    store = TelemetryStore(time_source=clock)
+    _receive_all(clock, store, messages[:10])
+    context = SubscriptionContext(reactor=clock, poller=None)
+    for object_cell in store.state().itervalues():
+        for cell in object_cell.get().state().itervalues():
+            if isinstance(cell, StreamCell):
+                # needs a poller, and is not what this is measuring
+                continue
+            cell.subscribe2(lambda value: None, context)
+    
+    def run():
+        _receive_all(clock, store, messages)
+    
+    return run
+
+
+@benchmark('telemetry.ingest_and_expire_10000_objects', items=10000)
+def _setup_expire():
+    messages = _make_messages(10000, 10000)
+    
+    def run():
+        clock = Clock()
+        clock.advance(_receive_time)
+        store = TelemetryStore(time_source=clock)
+        _receive_all(clock, store, messages)
+        # The messages span 100 seconds, so this expires them in 100 batches.
+        clock.advance(drop_unheard_timeout_seconds - 1)
+        for _ in xrange(101):
+            clock.advance(1)
+        assert not store.state()
+    
+    return run
+
+
+@benchmark('telemetry.memory_10000_objects', items=10000, measure_memory=True)
+def _setup_memory():
+    """Memory per object of a store which no client has looked at."""
+    messages = _make_messages(10000, 10000)
+    
+    def run():
+        clock = Clock()
+        clock.advance(_receive_time)
+        store = TelemetryStore(time_source=clock)
+        _receive_all(clock, store, messages)
+        return store
+    
+    return run
+
+
+@benchmark('telemetry.query_area_10000_objects', items=100)
+def _setup_query_area():
+    """Query a city-sized area among objects spread over a continent."""
+    messages = _make_messages(10000, 10000)
+    clock = Clock()
+    clock.advance(_receive_time)
+    store = TelemetryStore(time_source=clock)
+    _receive_all(clock, store, messages)
+    
+    def run():
+        for i in xrange(100):
+            assert store.query_area(37 + i % 3, -122.5, 37.5 + i % 3, -122)
+    
+    return run
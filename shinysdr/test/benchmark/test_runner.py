@@ -0,0 +1,102 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+# 
+# This file is part of ShinySDR.
+# 
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, division
+
+from twisted.trial import unittest
+
+from shinysdr.test.benchmark.runner import benchmark, compare_results, measure_size, run_benchmarks
+
+
+def _results(**seconds_per_item):
+    return {
+        u'version': 1,
+        u'benchmarks': {
+            name: {u'seconds_per_item': value}
+            for name, value in seconds_per_item.iteritems()
+        },
+    }
+
+
+class TestCompareResults(unittest.TestCase):
+    def test_compare(self):
+        comparisons = compare_results(
+            _results(a=1.0, b=1.0, c=1.0, removed=1.0),
+            _results(a=0.5, b=1.1, c=1.5, added=1.0),
+            threshold=0.2)
+        self.assertEqual(sorted(comparisons), [
+            ('a', 1.0, 0.5, 0.5, False),
+            ('b', 1.0, 1.1, 1.1, False),
+            ('c', 1.0, 1.5, 1.5, True),
+        ])
+    
+    def test_version(self):
+        bad = _results()
+        bad[u'version'] = 2
+        self.assertRaises(ValueError, lambda: compare_results(_results(), bad))
+
+
+class TestRunBenchmarks(unittest.TestCase):
+    def test_memory_not_measured(self):
+        result = run_benchmarks(['test_runner.returns_value'], repeat=1)[u'benchmarks'][u'test_runner.returns_value']
+        self.assertEqual(10, result[u'items'])
+        self.assertNotIn(u'bytes_per_item', result)
+    
+    def test_memory_measured(self):
+        result = run_benchmarks(['test_runner.measures_memory'], repeat=1)[u'benchmarks'][u'test_runner.measures_memory']
+        self.assertGreater(result[u'bytes_per_item'], 0)
+    
+    def test_cleanup(self):
+        del _cleanup_log[:]
+        run_benchmarks(['test_runner.cleanup'], repeat=3)
+        self.assertEqual(_cleanup_log, ['run', 'run', 'run', 'cleanup'])
+
+
+@benchmark('test_runner.returns_value', items=10)
+def _setup_returns_value():
+    return lambda: [[] for _ in xrange(10)]
+
+
+_cleanup_log = []
+
+
+@benchmark('test_runner.cleanup')
+def _setup_cleanup():
+    return (lambda: _cleanup_log.append('run'), lambda: _cleanup_log.append('cleanup'))
+
+
+@benchmark('test_runner.measures_memory', items=10, measure_memory=True)
+def _setup_measures_memory():
+    return lambda: [[] for _ in xrange(10)]
+
+
+class TestMeasureSize(unittest.TestCase):
+    def test_retained(self):
+        small = measure_size([])
+        self.assertGreater(measure_size([[] for _ in xrange(100)]), small + 100 * small)
+    
+    def test_shared(self):
+        value = SizeSpecimen()
+        # Neither the class nor the module is counted, nor is the same object twice.
+        self.assertEqual(
+            measure_size([value, SizeSpecimen, unittest]),
+            measure_size([value, value, value]))
+
+
+class SizeSpecimen(object):
+    def __init__(self):
+        self.value = 1
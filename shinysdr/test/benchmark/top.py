@@ -0,0 +1,89 @@
+# Copyright 2026 Kevin Reid <kpreid@switchb.org>
+# 
+# This file is part of ShinySDR.
+# 
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of reconfiguring a running flow graph, during which it is locked (and therefore stopped) for part of the time.
+"""
+
+from __future__ import absolute_import, division
+
+from shinysdr.i.top import Top
+from shinysdr.plugins import simulate
+from shinysdr.test.benchmark.runner import benchmark
+
+
+_modes = ['NFM', 'WFM', 'USB', 'AM']
+_receiver_count = 4
+_freq_resolutions = [1024, 4096]
+
+
+def _running_top():
+    """Return a started Top and a function to stop it."""
+    top = Top(devices={'s1': simulate.SimulatedDevice(freq=0)})
+    top.start()
+    
+    def cleanup():
+        top.stop()
+        top.wait()
+    
+    return top, cleanup
+
+
+@benchmark('reconfigure.add_receiver', items=_receiver_count * 2)
+def _setup_add_receiver():
+    top, cleanup = _running_top()
+    
+    def run():
+        keys = []
+        for _ in xrange(_receiver_count):
+            (key, receiver) = top.add_receiver('AM')
+            # Otherwise the receiver is suspended for lack of consumers and never connected.
+            receiver.set_decode_always(True)
+            top._do_connect()
+            keys.append(key)
+        for key in keys:
+            top.delete_receiver(key)
+            top._do_connect()
+    
+    return run, cleanup
+
+
+@benchmark('reconfigure.set_mode', items=len(_modes))
+def _setup_set_mode():
+    top, cleanup = _running_top()
+    (_key, receiver) = top.add_receiver('AM')
+    receiver.set_decode_always(True)
+    top._do_connect()
+    
+    def run():
+        for mode in _modes:
+            receiver.set_mode(mode)
+            top._do_connect()
+    
+    return run, cleanup
+
+
+@benchmark('reconfigure.monitor_resolution', items=len(_freq_resolutions))
+def _setup_monitor_resolution():
+    top, cleanup = _running_top()
+    
+    def run():
+        for freq_resolution in _freq_resolutions:
+            top.monitor.set_freq_resolution(freq_resolution)
+            top._do_connect()
+    
+    return run, cleanup
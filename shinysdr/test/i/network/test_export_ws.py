@@ -19,13 +19,16 @@ from __future__ import absolute_import, division
 
 import json
 
+from twisted.internet.task import Clock
 from twisted.trial import unittest
 from zope.interface import Interface, implements  # available via Twisted
 
 from shinysdr.i.json import transform_for_json
 # TODO: StateStreamInner is an implementation detail; arrange a better interface to test
 from shinysdr.i.network.export_ws import StateStreamInner
+from shinysdr.plugins.aprs import parse_tnc2
 from shinysdr.signals import SignalType
+from shinysdr.telemetry import TelemetryStore
 from shinysdr.test.testutil import SubscriptionTester
 from shinysdr.types import ReferenceT
 from shinysdr.values import CellDict, CollectionState, ExportedState, NullExportedState, exported_value, nullExportedState, setter
@@ -161,6 +164,32 @@ class TestStateStream(StateStreamTestCase):
         self.assertRaises(KeyError, lambda:
             self.stream.dataReceived(json.dumps(['set', 99999, 100.0, 1234])))
         self.assertEqual(self.getUpdates(), [])
+    
+    def test_telemetry_view_area(self):
+        clock = Clock()
+        store = TelemetryStore(time_source=clock)
+        store.receive(parse_tnc2('N1X>APU25N,WIDE2-1:=3730.00N/12230.00W>', 1000000000.0))
+        store.receive(parse_tnc2('N2X>APU25N,WIDE2-1:=4030.00N/07400.00W>', 1000000000.0))
+        clock.advance(0)
+        self.setUpForObject(store)
+        
+        def store_keys(updates):
+            values = [message[2] for message in updates if message[:2] == ['value', 1]]
+            self.assertEqual(1, len(values), updates)
+            return set(values[0].keys())
+        
+        self.assertEqual({'N1X', 'N2X'}, store_keys(self.getUpdates()))
+        self.stream.dataReceived(json.dumps(['view_area', 1, [37, -123, 38, -122]]))
+        updates = self.getUpdates()
+        self.assertEqual({'N1X'}, store_keys(updates))
+        self.assertIn('delete', [message[0] for message in updates])
+        
+        # moving the area within the same view
+        self.stream.dataReceived(json.dumps(['view_area', 1, [40, -75, 41, -73]]))
+        self.assertEqual({'N2X'}, store_keys(self.getUpdates()))
+        
+        self.stream.dataReceived(json.dumps(['view_area', 1, None]))
+        self.assertEqual({'N1X', 'N2X'}, store_keys(self.getUpdates()))
 
 
 class IFoo(Interface):
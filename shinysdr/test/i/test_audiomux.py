@@ -22,7 +22,8 @@ from twisted.trial import unittest
 from gnuradio import blocks
 from gnuradio import gr
 
-from shinysdr.i.audiomux import AudioManager
+from shinysdr.i.audiomux import AudioManager, BusPlumber
+from shinysdr.i.blocks import IncrementalConnector, VectorResampler
 
 
 class TestAudioManager(unittest.TestCase):
@@ -52,6 +53,62 @@ class TestAudioManager(unittest.TestCase):
         self.tb.stop()
         self.tb.wait()
 
+    def test_consumers(self):
+        self.assertFalse(self.p.has_clients())
+        self.assertFalse(self.p.destination_has_consumers('client'))
+        queue = gr.msg_queue()
+        self.p.add_audio_queue(queue, 10000)
+        self.assertTrue(self.p.has_clients())
+        self.assertTrue(self.p.destination_has_consumers('client'))
+        self.p.remove_audio_queue(queue)
+        self.assertFalse(self.p.destination_has_consumers('client'))
+        self.assertFalse(self.p.destination_has_consumers('bogusname'))
+
+
+class TestBusPlumber(unittest.TestCase):
+    def setUp(self):
+        self.graph = NullGraph()
+        self.connector = IncrementalConnector(self.graph)
+        self.plumber = BusPlumber(graph=self.connector, nchannels=1)
+        self.output = object()
+    
+    def __connect(self, *inputs):
+        self.connector.begin()
+        self.plumber.connect(
+            inputs=[(10000, block) for block in inputs],
+            outputs=[(10000, self.output)])
+        return self.connector.finish()
+    
+    def test_input_churn(self):
+        a, b = object(), object()
+        self.assertEqual(self.__connect(a, b), (0, 3))
+        # b's input is fed zeros instead, and nothing else changes
+        self.assertEqual(self.__connect(a), (1, 1))
+        self.assertEqual(self.__connect(a, b), (1, 1))
+        self.assertEqual(self.__connect(a, b), (0, 0))
+    
+    def test_rate_groups(self):
+        self.connector.begin()
+        self.plumber.connect(
+            inputs=[(8000, object()), (16000, object()), (8000, object()), (8000, object())],
+            outputs=[(16000, self.output)])
+        self.connector.finish()
+        resamplers = [block for block in self.connector.get_blocks() if isinstance(block, VectorResampler)]
+        self.assertEqual(len(resamplers), 1)
+    
+    def test_no_inputs(self):
+        self.__connect(object())
+        self.assertEqual(self.__connect(), (2, 0))
+
+
+class NullGraph(object):
+    """Stands in for a flow graph, for use with an IncrementalConnector."""
+    def connect(self, src, dst):
+        pass
+    
+    def disconnect(self, src, dst):
+        pass
+
 
 def ConnectionCanarySource(graph):
     """
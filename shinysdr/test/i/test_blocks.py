@@ -0,0 +1,125 @@
+# Copyright 2016 Kevin Reid <kpreid@switchb.org>
+# 
+# This file is part of ShinySDR.
+# 
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, division
+
+from twisted.trial import unittest
+
+from shinysdr.i.blocks import IncrementalConnector, RecursiveLockBlockMixin
+
+
+class TestIncrementalConnector(unittest.TestCase):
+    def setUp(self):
+        self.graph = RecordingGraph()
+        self.connector = IncrementalConnector(self.graph)
+    
+    def __reconnect(self, *chains):
+        self.connector.begin()
+        for chain in chains:
+            self.connector.connect(*chain)
+        return self.connector.finish()
+    
+    def test_initial(self):
+        self.assertEqual((0, 2), self.__reconnect(['a', 'b', ('c', 1)]))
+        self.assertEqual(self.graph.log, [
+            ('connect', ('a', 0), ('b', 0)),
+            ('connect', ('b', 0), ('c', 1)),
+        ])
+    
+    def test_unchanged(self):
+        self.__reconnect(['a', 'b'], ['a', 'c'])
+        self.graph.log = []
+        self.assertEqual((0, 0), self.__reconnect(['a', 'c'], ['a', 'b']))
+        self.assertEqual(self.graph.log, [])
+    
+    def test_diff(self):
+        self.__reconnect(['a', 'b'], ['a', 'c'])
+        self.graph.log = []
+        self.assertEqual((1, 1), self.__reconnect(['a', 'b'], ['a', 'd']))
+        self.assertEqual(self.graph.log, [
+            ('disconnect', ('a', 0), ('c', 0)),
+            ('connect', ('a', 0), ('d', 0)),
+        ])
+    
+    def test_disconnect_all(self):
+        self.__reconnect(['a', 'b'])
+        self.connector.disconnect_all()
+        self.graph.log = []
+        self.assertEqual((0, 1), self.__reconnect(['a', 'b']))
+    
+    def test_get_blocks(self):
+        self.assertEqual(self.connector.get_blocks(), [])
+        self.__reconnect(['a', 'b'], ['a', ('c', 1)])
+        self.assertEqual(self.connector.get_blocks(), ['a', 'b', 'c'])
+
+    def test_connect_outside(self):
+        self.assertRaises(Exception, lambda: self.connector.connect('a', 'b'))
+    
+    def test_abort(self):
+        self.__reconnect(['a', 'b'])
+        self.graph.log = []
+        self.connector.begin()
+        self.connector.connect('a', 'c')
+        self.connector.abort()
+        self.assertEqual(self.graph.log, [])
+        self.assertRaises(Exception, lambda: self.connector.connect('a', 'c'))
+        # can begin again after aborting
+        self.assertEqual((1, 1), self.__reconnect(['a', 'c']))
+
+
+class TestRecursiveLockBlockMixin(unittest.TestCase):
+    def test_nesting_and_duration(self):
+        block = LockRecordingBlock()
+        self.assertEqual(block._get_lock_durations(), (0.0, 0.0))
+        block._recursive_lock()
+        block._recursive_lock()
+        block._recursive_unlock()
+        self.assertEqual(block.log, ['lock', 'hook'])
+        self.assertEqual(block._get_lock_durations(), (0.0, 0.0))
+        block._recursive_unlock()
+        self.assertEqual(block.log, ['lock', 'hook', 'unlock'])
+        (last, maximum) = block._get_lock_durations()
+        self.assertTrue(last >= 0)
+        self.assertEqual(last, maximum)
+
+
+class LockRecordingBlock(RecursiveLockBlockMixin):
+    def __init__(self):
+        self.log = []
+    
+    def lock(self):
+        self.log.append('lock')
+    
+    def unlock(self):
+        self.log.append('unlock')
+    
+    def _recursive_lock_hook(self):
+        self.log.append('hook')
+
+
+class RecordingGraph(object):
+    def __init__(self):
+        self.log = []
+    
+    def connect(self, src, dst):
+        self.log.append(('connect', src, dst))
+    
+    def disconnect(self, src, dst):
+        self.log.append(('disconnect', src, dst))
+    
+    def disconnect_all(self):
+        self.log.append(('disconnect_all',))
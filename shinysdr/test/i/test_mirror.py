@@ -0,0 +1,257 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, division
+
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial import unittest
+from zope.interface import Interface, implements  # available via Twisted
+
+from shinysdr.i.json import transform_for_json
+from shinysdr.i.mirror import StateMirrorClientProtocol, StateMirrorServerProtocol, type_from_json
+from shinysdr.test.testutil import SubscriptionTester
+from shinysdr.types import RangeT, ReferenceT
+from shinysdr import units
+from shinysdr.values import CellDict, CollectionState, ExportedState, IWritableCollection, command, exported_value, setter
+
+
+class TestStateMirror(unittest.TestCase):
+    def setUp(self):
+        self.object = MirrorSpecimen()
+        self.st = SubscriptionTester()
+        self.server = StateMirrorServerProtocol(self.object, subscription_context=self.st.context)
+        self.client = StateMirrorClientProtocol()
+        self.server_transport = StringTransport()
+        self.client_transport = StringTransport()
+        self.server.makeConnection(self.server_transport)
+        self.client.makeConnection(self.client_transport)
+        self.proxy = None
+        self.client.when_ready().addCallback(self.__got_proxy)
+        self.pump()
+
+    def tearDown(self):
+        self.server.connectionLost(None)
+
+    def __got_proxy(self, proxy):
+        self.proxy = proxy
+
+    def pump(self):
+        self.st.advance()
+        self.server._flush()  # warning: implementation poking
+        self.client.dataReceived(self.server_transport.value())
+        self.server_transport.clear()
+        self.server.dataReceived(self.client_transport.value())
+        self.client_transport.clear()
+        self.st.advance()
+        self.server._flush()
+        self.client.dataReceived(self.server_transport.value())
+        self.server_transport.clear()
+
+    def test_initial_state(self):
+        self.assertTrue(self.proxy is not None)
+        self.assertEqual(
+            sorted(self.proxy.state().keys()),
+            ['child', 'fixed', 'freq', 'poke', 'rw'])
+        self.assertEqual(self.proxy.state()['rw'].get(), 1.0)
+        self.assertEqual(self.proxy.state()['fixed'].get(), u'hello')
+        self.assertTrue(IMirrorSpecimen.providedBy(self.proxy))
+
+    def test_description(self):
+        for key in ['fixed', 'freq', 'poke', 'rw']:
+            self.assertEqual(
+                transform_for_json(self.proxy.state()[key].description()),
+                transform_for_json(self.object.state()[key].description()))
+
+    def test_nested(self):
+        child = self.proxy.state()['child'].get()
+        self.assertEqual(child.state()['value'].get(), 10)
+        self.assertEqual(
+            self.proxy.state_to_json(),
+            self.object.state_to_json())
+
+    def test_remote_change(self):
+        self.object.set_rw(2.0)
+        self.pump()
+        self.assertEqual(self.proxy.state()['rw'].get(), 2.0)
+
+    def test_set(self):
+        d = self.proxy.state()['rw'].set(3.0)
+        done = []
+        d.addCallback(done.append)
+        self.assertEqual(self.proxy.state()['rw'].get(), 1.0)
+        self.pump()
+        self.assertEqual(self.object.get_rw(), 3.0)
+        self.assertEqual(self.proxy.state()['rw'].get(), 3.0)
+        self.assertEqual(done, [None])
+
+    def test_command(self):
+        self.proxy.state()['poke'].set(None)
+        self.pump()
+        self.assertEqual(self.object.pokes, 1)
+
+    def test_reference_change(self):
+        self.object.child = ChildSpecimen(20)
+        self.object.state_changed('child')
+        self.pump()
+        self.assertEqual(self.proxy.state()['child'].get().state()['value'].get(), 20)
+
+    def test_range_type(self):
+        freq_type = self.proxy.state()['freq'].type()
+        self.assertTrue(isinstance(freq_type, RangeT))
+        self.assertEqual(
+            transform_for_json(freq_type),
+            transform_for_json(self.object.state()['freq'].type()))
+
+
+class TestStateMirrorCollection(unittest.TestCase):
+    def setUp(self):
+        self.object = CollectionSpecimen()
+        self.st = SubscriptionTester()
+        self.server = StateMirrorServerProtocol(self.object, subscription_context=self.st.context)
+        self.client = StateMirrorClientProtocol()
+        self.server_transport = StringTransport()
+        self.client_transport = StringTransport()
+        self.server.makeConnection(self.server_transport)
+        self.client.makeConnection(self.client_transport)
+        self.proxy = None
+        self.client.when_ready().addCallback(self.__got_proxy)
+        self.pump()
+
+    def tearDown(self):
+        self.server.connectionLost(None)
+
+    def __got_proxy(self, proxy):
+        self.proxy = proxy
+
+    def pump(self):
+        self.st.advance()
+        self.server._flush()  # warning: implementation poking
+        self.client.dataReceived(self.server_transport.value())
+        self.server_transport.clear()
+        self.server.dataReceived(self.client_transport.value())
+        self.client_transport.clear()
+        self.st.advance()
+        self.server._flush()
+        self.client.dataReceived(self.server_transport.value())
+        self.server_transport.clear()
+
+    def test_interface(self):
+        self.assertTrue(IWritableCollection.providedBy(self.proxy))
+
+    def test_create_child(self):
+        results = []
+        self.proxy.create_child({u'value': 5}).addCallback(results.append)
+        self.pump()
+        self.assertEqual(results, [u'a'])
+        self.assertEqual(self.proxy.state()['a'].get().state()['value'].get(), 5)
+
+    def test_delete_child(self):
+        self.proxy.create_child({u'value': 5})
+        self.pump()
+        self.proxy.delete_child(u'a')
+        self.pump()
+        self.assertEqual(self.proxy.state().keys(), [])
+
+    def test_error(self):
+        failures = []
+        self.proxy.delete_child(u'nonexistent').addErrback(failures.append)
+        self.pump()
+        self.assertEqual(len(failures), 1)
+        self.flushLoggedErrors(KeyError)
+
+
+class TestTypeFromJson(unittest.TestCase):
+    def test_reference(self):
+        self.assertTrue(type_from_json(ReferenceT().to_json()).is_reference())
+
+    def test_range(self):
+        range_json = transform_for_json(RangeT([(1, 2), (3, 4)], unit=units.Hz, logarithmic=True))
+        self.assertEqual(transform_for_json(type_from_json(range_json)), range_json)
+
+    def test_opaque(self):
+        t = type_from_json({u'type': u'Unknown'})
+        self.assertEqual(t.to_json(), {u'type': u'Unknown'})
+        self.assertEqual(t(1), 1)
+
+
+class IMirrorSpecimen(Interface):
+    pass
+
+
+class MirrorSpecimen(ExportedState):
+    implements(IMirrorSpecimen)
+
+    def __init__(self):
+        self.rw = 1.0
+        self.freq = 0.0
+        self.pokes = 0
+        self.child = ChildSpecimen(10)
+
+    @exported_value(type=float, changes='this_setter')
+    def get_rw(self):
+        return self.rw
+
+    @setter
+    def set_rw(self, value):
+        self.rw = value
+
+    @exported_value(type=RangeT([(0, 1e9)], unit=units.Hz), changes='this_setter')
+    def get_freq(self):
+        return self.freq
+
+    @setter
+    def set_freq(self, value):
+        self.freq = value
+
+    @exported_value(type=unicode, changes='never')
+    def get_fixed(self):
+        return u'hello'
+
+    @exported_value(type=ReferenceT(), changes='explicit')
+    def get_child(self):
+        return self.child
+
+    @command()
+    def poke(self):
+        self.pokes += 1
+
+
+class ChildSpecimen(ExportedState):
+    def __init__(self, value):
+        self.value = value
+
+    @exported_value(type=int, changes='never')
+    def get_value(self):
+        return self.value
+
+
+class CollectionSpecimen(CollectionState):
+    implements(IWritableCollection)
+
+    def __init__(self):
+        self.table = CellDict(dynamic=True)
+        CollectionState.__init__(self, self.table)
+
+    def create_child(self, desc):
+        key = unicode(chr(ord('a') + len(self.table)))
+        self.table[key] = ChildSpecimen(desc[u'value'])
+        return key
+
+    def delete_child(self, key):
+        if key not in self.table:
+            raise KeyError(key)
+        del self.table[key]
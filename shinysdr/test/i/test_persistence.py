@@ -24,9 +24,11 @@ import tempfile
 from twisted.internet.task import Clock
 from twisted.trial import unittest
 
-from shinysdr.i.persistence import PersistenceFileGlue, PersistenceChangeDetector
+from shinysdr.i.persistence import PersistenceFileGlue, PersistenceChangeDetector, read_telemetry_snapshot, write_telemetry_snapshot
+from shinysdr.plugins.aprs import parse_tnc2
+from shinysdr.telemetry import TelemetryStore
 from shinysdr.test.testutil import SubscriptionTester
-from shinysdr.values import ExportedState, ReferenceT, exported_value, nullExportedState, setter
+from shinysdr.values import CellDict, CollectionState, ExportedState, ReferenceT, exported_value, nullExportedState, setter
 
 
 class TestPersistenceFileGlue(unittest.TestCase):
@@ -129,6 +131,74 @@ class TestPersistenceChangeDetector(unittest.TestCase):
             },
         })
 
+    def test_unchanged_branch_not_reread(self):
+        counter = GetCounterSpecimen()
+        o = ValueAndBlockSpecimen(ValueAndBlockSpecimen(counter))
+        d = PersistenceChangeDetector(o, self.__callback, subscription_context=self.st.context)
+        d.get()
+        self.assertEqual(1, counter.count)
+        o.set_value(1)
+        self.st.advance()
+        self.assertEqual(1, self.calls)
+        self.assertEqual(d.get(), {
+            u'value': 1,
+            u'block': {
+                u'value': 0,
+                u'block': {u'value': 0},
+            },
+        })
+        self.assertEqual(1, counter.count)
+        counter.set_value(5)
+        self.st.advance()
+        self.assertEqual(2, self.calls)
+        self.assertEqual(d.get()[u'block'][u'block'], {u'value': 5})
+    
+    def test_replaced_block(self):
+        o = ReplaceableBlockSpecimen(ValueAndBlockSpecimen(value=1))
+        d = PersistenceChangeDetector(o, self.__callback, subscription_context=self.st.context)
+        self.assertEqual(d.get(), {u'block': {u'value': 1, u'block': {}}})
+        old_block = o.get_block()
+        o.replace_block(ValueAndBlockSpecimen(value=2))
+        self.st.advance()
+        self.assertEqual(1, self.calls)
+        self.assertEqual(d.get(), {u'block': {u'value': 2, u'block': {}}})
+        # changes to the replaced block are no longer relevant
+        old_block.set_value(3)
+        self.st.advance()
+        self.assertEqual(1, self.calls)
+        self.assertEqual(d.get(), {u'block': {u'value': 2, u'block': {}}})
+    
+    def test_dynamic_shape(self):
+        cd = CellDict(dynamic=True)
+        o = CollectionState(cd)
+        d = PersistenceChangeDetector(o, self.__callback, subscription_context=self.st.context)
+        self.assertEqual(d.get(), {})
+        cd['a'] = ValueAndBlockSpecimen(value=1)
+        self.st.advance()
+        self.assertEqual(1, self.calls)
+        self.assertEqual(d.get(), {u'a': {u'value': 1, u'block': {}}})
+        cd['a'].set_value(2)
+        self.st.advance()
+        self.assertEqual(2, self.calls)
+        self.assertEqual(d.get(), {u'a': {u'value': 2, u'block': {}}})
+        del cd['a']
+        self.st.advance()
+        self.assertEqual(3, self.calls)
+        self.assertEqual(d.get(), {})
+    
+    def test_dirty_cell_removed(self):
+        cd = CellDict(dynamic=True)
+        o = CollectionState(cd)
+        d = PersistenceChangeDetector(o, self.__callback, subscription_context=self.st.context)
+        cd['a'] = ValueAndBlockSpecimen(value=1)
+        self.st.advance()
+        self.assertEqual(d.get(), {u'a': {u'value': 1, u'block': {}}})
+        cd['a'] = ValueAndBlockSpecimen(value=2)
+        self.st.advance()
+        del cd['a']
+        # the shape change has not been delivered yet
+        self.assertEqual(d.get(), {})
+
 
 class ValueAndBlockSpecimen(ExportedState):
     def __init__(self, block=nullExportedState, value=0):
@@ -148,6 +218,79 @@ class ValueAndBlockSpecimen(ExportedState):
         self.__value = value
 
 
+class TestTelemetrySnapshot(unittest.TestCase):
+    def setUp(self):
+        self.__temp_dir = tempfile.mkdtemp(prefix='shinysdr_test_persistence_tmp')
+        self.__filename = os.path.join(self.__temp_dir, 'telemetry')
+    
+    def tearDown(self):
+        shutil.rmtree(self.__temp_dir)
+    
+    def test_missing(self):
+        self.assertEqual([], list(read_telemetry_snapshot(self.__filename)))
+    
+    def test_not_snapshot(self):
+        with open(self.__filename, 'wb') as f:
+            f.write('{}')
+        self.assertRaises(ValueError, lambda: list(read_telemetry_snapshot(self.__filename)))
+    
+    def test_round_trip(self):
+        message = parse_tnc2('FOO>RX:!4903.50N/07201.75W-Test', 1000.0)
+        write_telemetry_snapshot(self.__filename, [
+            (u'FOO', 2800.0, (message,)),
+            (u'BAR', 2800.0, (lambda: None,)),  # not picklable, omitted
+        ])
+        self.assertEqual([(u'FOO', 2800.0, (message,))], list(read_telemetry_snapshot(self.__filename)))
+        self.assertFalse(os.path.exists(self.__filename + '.tmp'))
+    
+    def test_restore_store(self):
+        clock = Clock()
+        clock.advance(1000)
+        store = TelemetryStore(time_source=clock)
+        store.retain_messages(2)
+        for line in ['FOO>RX:>status', 'FOO>RX:!4903.50N/07201.75W-Test', 'FOO>RX:>comment']:
+            store.receive(parse_tnc2(line, 1000.0))
+        clock.advance(0)
+        write_telemetry_snapshot(self.__filename, store.get_snapshot())
+        
+        new_store = TelemetryStore(time_source=clock)
+        for _object_id, _expiry, messages in read_telemetry_snapshot(self.__filename):
+            self.assertEqual(2, len(messages))
+            new_store.restore(messages)
+        clock.advance(0)
+        self.assertEqual(
+            store.state()['FOO'].get().get_track(),
+            new_store.state()['FOO'].get().get_track())
+
+
+class ReplaceableBlockSpecimen(ExportedState):
+    def __init__(self, block):
+        self.__block = block
+    
+    @exported_value(type=ReferenceT(), changes='explicit')
+    def get_block(self):
+        return self.__block
+    
+    def replace_block(self, block):
+        self.__block = block
+        self.state_changed('block')
+
+
+class GetCounterSpecimen(ExportedState):
+    def __init__(self):
+        self.count = 0
+        self.__value = 0
+    
+    @exported_value(type=float, changes='this_setter')
+    def get_value(self):
+        self.count += 1
+        return self.__value
+    
+    @setter
+    def set_value(self, value):
+        self.__value = value
+
+
 def advance_until(clock, d, limit=10, timestep=0.001):
     ret = []
     err = []
@@ -0,0 +1,162 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, division
+
+from twisted.trial import unittest
+
+from gnuradio import gr
+
+from shinysdr.i.profiling import BlockProfile, Diagnostics, find_primitive_blocks
+from shinysdr.test.testutil import state_smoke_test
+
+
+class TestFindPrimitiveBlocks(unittest.TestCase):
+    def test_nested(self):
+        outer = OuterSpecimen()
+        found = find_primitive_blocks(outer)
+        self.assertEqual(found.keys(), [u'inner.leaf', u'leaves.0', u'leaves.1', u'source'])
+        self.assertIs(found[u'source'], outer.source)
+        self.assertIs(found[u'inner.leaf'], outer.inner.leaf)
+
+    def test_primitive(self):
+        block = FakeBlock()
+        self.assertEqual(find_primitive_blocks(block).items(), [(u'FakeBlock', block)])
+
+
+class TestBlockProfile(unittest.TestCase):
+    def setUp(self):
+        self.time = 0.0
+        self.block = FakeBlock()
+        self.profile = BlockProfile(self.block, min_interval=0.5, clock=lambda: self.time)
+
+    def test_smoke(self):
+        state_smoke_test(self.profile)
+
+    def test_rates(self):
+        self.time = 2.0
+        self.block.work_seconds = 1.0
+        self.block.items = 1000
+        self.assertAlmostEqual(self.profile.get_cpu(), 0.5)
+        self.assertEqual(self.profile.get_item_rate(), 500)
+
+    def test_rate_limited(self):
+        self.time = 0.25
+        self.block.items = 1000
+        self.assertEqual(self.profile.get_item_rate(), 0)
+
+    def test_buffers(self):
+        self.time = 1.0
+        self.block.input_full = (0.0,)
+        self.block.output_full = (1.0,)
+        self.block.output_full_avg = (0.5,)
+        self.assertEqual(self.profile.get_output_fullness(), 0.5)
+        self.assertEqual(self.profile.get_overflows(), 1)
+        self.assertEqual(self.profile.get_underruns(), 1)
+
+
+class TestDiagnostics(unittest.TestCase):
+    def setUp(self):
+        self.time = 0.0
+        self.blocks = {u'a': OuterSpecimen(), u'b': FakeBlock()}
+        self.diagnostics = Diagnostics(lambda: self.blocks, clock=lambda: self.time)
+        self.diagnostics.refresh()
+
+    def test_smoke(self):
+        state_smoke_test(self.diagnostics)
+
+    def test_refresh(self):
+        group = self.diagnostics.state()[u'a'].get()
+        del self.blocks[u'b']
+        self.diagnostics.refresh()
+        self.assertEqual(sorted(self.diagnostics.state().keys()), [u'a', u'enabled', u'ranking', u'rescan'])
+        self.assertIs(self.diagnostics.state()[u'a'].get(), group)
+
+    def test_ranking(self):
+        self.time = 1.0
+        self.blocks[u'a'].source.work_seconds = 0.25
+        self.blocks[u'b'].work_seconds = 0.5
+        ranking = self.diagnostics.get_ranking()
+        self.assertEqual(ranking[0][0], u'b.FakeBlock')
+        self.assertEqual(ranking[1][0], u'a.source')
+        self.assertAlmostEqual(self.diagnostics.state()[u'a'].get().get_total_cpu(), 0.25)
+
+
+class FakeSignature(object):
+    def __init__(self, streams):
+        self.__streams = streams
+
+    def max_streams(self):
+        return self.__streams
+
+
+class FakeBlock(object):
+    """Imitates the performance counter interface of a GNU Radio block."""
+    def __init__(self):
+        self.work_seconds = 0.0
+        self.items = 0
+        self.input_full = (0.5,)
+        self.output_full = (0.5,)
+        self.output_full_avg = (0.0,)
+
+    def name(self):
+        return 'fake'
+
+    def input_signature(self):
+        return FakeSignature(1)
+
+    def output_signature(self):
+        return FakeSignature(1)
+
+    def pc_work_time_total(self):
+        return self.work_seconds * gr.high_res_timer_tps()
+
+    def nitems_written(self, port):
+        return self.items
+
+    def pc_input_buffers_full(self):
+        return self.input_full
+
+    def pc_input_buffers_full_avg(self):
+        return (0.0,)
+
+    def pc_output_buffers_full(self):
+        return self.output_full
+
+    def pc_output_buffers_full_avg(self):
+        return self.output_full_avg
+
+
+class InnerSpecimen(gr.hier_block2):
+    def __init__(self):
+        gr.hier_block2.__init__(
+            self, type(self).__name__,
+            gr.io_signature(0, 0, 0),
+            gr.io_signature(0, 0, 0))
+        self.leaf = FakeBlock()
+
+
+class OuterSpecimen(gr.hier_block2):
+    def __init__(self):
+        gr.hier_block2.__init__(
+            self, type(self).__name__,
+            gr.io_signature(0, 0, 0),
+            gr.io_signature(0, 0, 0))
+        self.source = FakeBlock()
+        self.__leaves = [FakeBlock(), FakeBlock()]
+        self.inner = InnerSpecimen()
+        self.not_a_block = {'x': 1}
@@ -0,0 +1,125 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, division
+
+import json
+import os
+import os.path
+import wave
+
+import numpy
+
+from twisted.trial import unittest
+
+from gnuradio import gr
+
+from shinysdr.i.recording import RecordingSettings, RotatingFileWriter
+
+
+class TestRotatingFileWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.mkdir(self.directory)
+        self.time = 0.0
+        self.free_bytes = 1e9
+
+    def make_writer(self, file_format='wav', channels=1):
+        return RotatingFileWriter(
+            settings=RecordingSettings(
+                directory=self.directory,
+                file_format=file_format,
+                rotate_interval=60,
+                min_free_bytes=1e6,
+                queue_length=10),
+            get_name=lambda: u'a/b',
+            sample_rate=8000,
+            channels=channels,
+            clock=lambda: self.time,
+            get_free_bytes=lambda directory: self.free_bytes)
+
+    def files(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_wav(self):
+        writer = self.make_writer(channels=2)
+        writer.write(numpy.array([0.5, -0.5, 2.0, 0.0], dtype=numpy.float32).tostring())
+        path = writer.get_file()
+        self.assertEqual(self.files(), ['19700101T000000Z-a_b.wav'])
+        writer.close()
+        f = wave.open(path, 'rb')
+        self.assertEqual(f.getnchannels(), 2)
+        self.assertEqual(f.getframerate(), 8000)
+        self.assertEqual(
+            list(numpy.frombuffer(f.readframes(10), dtype='<i2')),
+            [16383, -16383, 32767, 0])
+        f.close()
+
+    def test_raw(self):
+        writer = self.make_writer(file_format='raw')
+        data = numpy.array([0.25, 2.0], dtype=numpy.float32).tostring()
+        writer.write(data)
+        writer.close()
+        with open(os.path.join(self.directory, self.files()[0]), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_sigmf(self):
+        writer = self.make_writer(file_format='sigmf')
+        data = numpy.array([1 + 2j, 3 + 4j], dtype=numpy.complex64).tostring()
+        writer.write(data, now=1.0, center_freq=100e6)
+        writer.write(data, now=2.0, center_freq=100e6, after_gap=True)
+        writer.write(data, now=3.0, center_freq=101e6)
+        writer.close()
+        self.assertEqual(self.files(), [
+            '19700101T000001Z-a_b.sigmf-data',
+            '19700101T000001Z-a_b.sigmf-meta',
+            '19700101T000003Z-a_b.sigmf-data',
+            '19700101T000003Z-a_b.sigmf-meta',
+        ])
+        with open(os.path.join(self.directory, self.files()[0]), 'rb') as f:
+            self.assertEqual(f.read(), data + data)
+        with open(os.path.join(self.directory, self.files()[1]), 'rb') as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata['global']['core:sample_rate'], 8000)
+        self.assertEqual(metadata['captures'], [
+            {'core:sample_start': 0, 'core:frequency': 100e6, 'core:datetime': '1970-01-01T00:00:00.999750Z'},
+            {'core:sample_start': 2, 'core:frequency': 100e6, 'core:datetime': '1970-01-01T00:00:01.999750Z'},
+        ])
+
+    def test_rotation(self):
+        writer = self.make_writer()
+        writer.write('\0' * 4)
+        self.time = 59
+        writer.write('\0' * 4)
+        self.assertEqual(len(self.files()), 1)
+        self.time = 61
+        writer.write('\0' * 4)
+        writer.close()
+        self.assertEqual(self.files(), ['19700101T000000Z-a_b.wav', '19700101T000101Z-a_b.wav'])
+
+    def test_disk_space(self):
+        self.free_bytes = 0
+        writer = self.make_writer()
+        writer.write('\0' * (10 * gr.sizeof_float))
+        self.assertEqual(self.files(), [])
+        self.assertEqual(writer.get_dropped_frames(), 10)
+        self.assertNotEqual(writer.get_status(), u'')
+        self.free_bytes = 1e9
+        writer.write('\0' * 4)
+        self.assertEqual(len(self.files()), 1)
+        self.assertEqual(writer.get_status(), u'')
+        writer.close()
@@ -0,0 +1,66 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, division
+
+import os.path
+
+from twisted.trial import unittest
+
+from shinysdr.i.ring import SharedRing
+
+
+class TestSharedRing(unittest.TestCase):
+    def setUp(self):
+        self.producer = SharedRing.create(64)
+        self.consumer = SharedRing(self.producer.get_path())
+
+    def tearDown(self):
+        self.consumer.close()
+        self.producer.close(unlink=True)
+
+    def test_empty(self):
+        self.assertEqual(self.consumer.read(), None)
+
+    def test_order(self):
+        self.assertTrue(self.producer.write('a'))
+        self.assertTrue(self.producer.write(''))
+        self.assertTrue(self.producer.write('bcd'))
+        self.assertEqual(self.consumer.read(), 'a')
+        self.assertEqual(self.consumer.read(), '')
+        self.assertEqual(self.consumer.read(), 'bcd')
+        self.assertEqual(self.consumer.read(), None)
+
+    def test_full_drops(self):
+        self.assertTrue(self.producer.write('x' * 60))
+        self.assertFalse(self.producer.write('y'))
+        self.assertEqual(self.consumer.read(), 'x' * 60)
+        self.assertTrue(self.producer.write('y'))
+        self.assertEqual(self.consumer.read(), 'y')
+
+    def test_wraparound(self):
+        for i in xrange(50):
+            data = chr(ord('a') + i % 26) * (i % 23)
+            self.assertTrue(self.producer.write(data))
+            self.assertEqual(self.consumer.read(), data)
+
+    def test_unlink(self):
+        path = self.producer.get_path()
+        self.assertTrue(os.path.exists(path))
+        ring = SharedRing.create(16)
+        ring.close(unlink=True)
+        self.assertFalse(os.path.exists(ring.get_path()))
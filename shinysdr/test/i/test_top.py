@@ -17,15 +17,20 @@
 
 from __future__ import absolute_import, division
 
+import os
+
 from twisted.internet import defer
 from twisted.internet import reactor as the_reactor
 from twisted.internet.task import deferLater
+from twisted.python import log
 from twisted.trial import unittest
 from zope.interface import implements  # available via Twisted
 
 from gnuradio import gr
 
 from shinysdr.devices import Device, IComponent, merge_devices
+from shinysdr.i.modes import lookup_mode
+from shinysdr.i.recording import RecordingSettings
 from shinysdr.i.top import Top
 from shinysdr.plugins import simulate
 from shinysdr.test.testutil import state_smoke_test
@@ -61,6 +66,26 @@ class TestTop(unittest.TestCase):
         self.assertEqual(top.state()['monitor'].get().get_fft_info()[0], freq2)
         # TODO: Also test value found in data stream
 
+    def test_record_not_configured(self):
+        top = Top(devices={'s1': simulate.SimulatedDevice()})
+        (_key, receiver) = top.add_receiver('AM', key='a')
+        self.assertRaises(ValueError, lambda: receiver.set_record(True))
+        self.assertFalse(receiver.get_record())
+    
+    def test_record(self):
+        directory = self.mktemp()
+        os.mkdir(directory)
+        top = Top(
+            devices={'s1': simulate.SimulatedDevice()},
+            recording=RecordingSettings(directory=directory, file_format='wav', rotate_interval=3600, min_free_bytes=0, queue_length=10))
+        (_key, receiver) = top.add_receiver('AM', key='a')
+        receiver.set_record(True)
+        self.assertTrue(receiver.get_record())
+        top.start()
+        top.stop()
+        top.wait()
+        top.close_all_devices()
+    
     def test_receiver_source_switch(self):
         """
         Regression test: Switching sources was not updating receiver input frequency.
@@ -95,6 +120,18 @@ class TestTop(unittest.TestCase):
         self.assertEquals(receiver2.get_device_name(), 's2')
         self.assertEquals(receiver1.get_device_name(), 's1')
 
+    def test_demodulator_reuse(self):
+        top = Top(devices={'s1': simulate.SimulatedDevice(freq=0)})
+        (_key, receiver) = top.add_receiver('AM', key='a')
+        am_demodulator = receiver.get_demodulator()
+        receiver.set_mode('USB')
+        usb_demodulator = receiver.get_demodulator()
+        self.assertIsNot(usb_demodulator, am_demodulator)
+        receiver.set_mode('AM')
+        self.assertIs(receiver.get_demodulator(), am_demodulator)
+        receiver.set_mode('USB')
+        self.assertIs(receiver.get_demodulator(), usb_demodulator)
+    
     def test_add_unknown_mode(self):
         """
         Specifying an unknown mode should not _fail_.
@@ -119,6 +156,140 @@ class TestTop(unittest.TestCase):
         top.add_audio_queue(queue, 48000)
         top.remove_audio_queue(queue)
     
+    def test_channelizer(self):
+        # SimulatedDevice has a sample rate of 200 kHz, so channels are 50 kHz apart.
+        top = Top(
+            devices={'s1': simulate.SimulatedDevice(freq=0)},
+            channelizers={'s1': 4})
+        (_key, receiver) = top.add_receiver('AM', key='a', state={'rec_freq': 52e3})
+        self.assertEqual(receiver.get_input_channel(), 1)
+        self.assertTrue(receiver.get_is_valid())
+        receiver.set_rec_freq(-48e3)
+        self.assertEqual(receiver.get_input_channel(), 3)
+        receiver.set_mode('WFM')  # too wide to fit in a channel
+        self.assertEqual(receiver.get_input_channel(), None)
+        top._do_connect()
+    
+    def test_shared_decimation(self):
+        top = Top(
+            devices={'s1': simulate.SimulatedDevice(freq=0)},
+            shared_decimations={'s1': 2})
+        (_key, receiver_a) = top.add_receiver('AM', key='a', state={'rec_freq': 48e3})
+        (_key, receiver_b) = top.add_receiver('AM', key='b', state={'rec_freq': 52e3})
+        self.assertEqual(receiver_a.get_input_channel(), 1)
+        self.assertEqual(receiver_b.get_input_channel(), 1)
+        top._do_connect()
+        explanation = receiver_a.explain_filters()
+        self.assertTrue(explanation.startswith('shared channel 1 at 50000'), explanation)
+        self.assertEqual(explanation.split('\n', 1)[0], receiver_b.explain_filters().split('\n', 1)[0])
+    
+    def test_channelizer_unknown_device(self):
+        e = self.assertRaises(ValueError, lambda: Top(
+            devices={'s1': simulate.SimulatedDevice(freq=0)},
+            channelizers={'s2': 4}))
+        self.assertIn('Channelizer', str(e))
+    
+    def test_shared_decimation_unknown_device(self):
+        e = self.assertRaises(ValueError, lambda: Top(
+            devices={'s1': simulate.SimulatedDevice(freq=0)},
+            shared_decimations={'s2': 10}))
+        self.assertIn('Shared decimation', str(e))
+    
+    def test_suspend_unused_receivers(self):
+        top = Top(devices={'s1': simulate.SimulatedDevice(freq=0)})
+        messages = []
+        
+        def observer(event):
+            text = log.textFromEventDict(event)
+            if text and 'done reconnecting' in text:
+                messages.append(text)
+        
+        log.addObserver(observer)
+        try:
+            (_key, receiver) = top.add_receiver('AM', key='a')
+            top._do_connect()
+            self.assertIn('1 receivers suspended', messages[-1])
+            receiver.set_decode_always(True)
+            top._do_connect()
+            self.assertIn('0 receivers suspended', messages[-1])
+            receiver.set_decode_always(False)
+            top.add_audio_queue(gr.msg_queue(), 48000)
+            top._do_connect()
+            self.assertIn('0 receivers suspended', messages[-1])
+        finally:
+            log.removeObserver(observer)
+    
+    def test_telemetry_receiver_not_suspended(self):
+        # Stand in for a telemetry mode such as APRS, whose external decoders may not be installed.
+        self.patch(lookup_mode('AM'), 'telemetry', True)
+        top = Top(devices={'s1': simulate.SimulatedDevice(freq=0)})
+        messages = []
+        
+        def observer(event):
+            text = log.textFromEventDict(event)
+            if text and 'done reconnecting' in text:
+                messages.append(text)
+        
+        log.addObserver(observer)
+        try:
+            (_key, receiver) = top.add_receiver('AM', key='a')
+            self.assertTrue(receiver.is_telemetry())
+            self.assertFalse(receiver.get_decode_always())
+            top._do_connect()
+            self.assertIn('0 receivers suspended', messages[-1])
+        finally:
+            log.removeObserver(observer)
+    
+    def test_reconnect_retry_after_failure(self):
+        top = Top(devices={'s1': simulate.SimulatedDevice(freq=0)})
+        (_key, receiver) = top.add_receiver('AM', key='a')
+        receiver.set_decode_always(True)
+        real_get_is_valid = receiver.get_is_valid
+        
+        def failing_get_is_valid():
+            raise ValueError('test failure')
+        
+        self.patch(receiver, 'get_is_valid', failing_get_is_valid)
+        self.assertRaises(ValueError, top._do_connect)
+        messages = []
+        
+        def observer(event):
+            text = log.textFromEventDict(event)
+            if text and 'done reconnecting' in text:
+                messages.append(text)
+        
+        log.addObserver(observer)
+        try:
+            self.patch(receiver, 'get_is_valid', real_get_is_valid)
+            top._do_connect()
+        finally:
+            log.removeObserver(observer)
+        self.assertEqual(len(messages), 1)
+        self.assertIn('0 receivers suspended', messages[0])
+    
+    @defer.inlineCallbacks
+    def test_reconnects_coalesced(self):
+        top = Top(devices={'s1': simulate.SimulatedDevice(freq=0)})
+        yield deferLater(the_reactor, 0, lambda: None)
+        messages = []
+        
+        def observer(event):
+            text = log.textFromEventDict(event)
+            if text and 'Rebuilding connections' in text:
+                messages.append(text)
+        
+        log.addObserver(observer)
+        try:
+            top.add_receiver('AM', key='a')
+            top.add_receiver('AM', key='b')
+            top.delete_receiver('a')
+            yield deferLater(the_reactor, 0, lambda: None)
+        finally:
+            log.removeObserver(observer)
+        self.assertEqual(len(messages), 1)
+        self.assertIn('added receiver b', messages[0])
+        self.assertIn('removed receiver a', messages[0])
+    
     def test_close(self):
         l = []
         top = Top(devices={'m':
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Copyright 2013, 2014, 2015, 2016 Kevin Reid <kpreid@switchb.org>
+# 
+# This file is part of ShinySDR.
+# 
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the speed of the filter blocks used by MultistageChannelFilter and make_resampler on this machine, relative to the cost model in shinysdr.filters, and writes the results to a file for use with config.set_filter_calibration.
+
+Usage: filter_calibration.py OUTPUT-FILE
+"""
+
+from __future__ import absolute_import, division
+
+import json
+import sys
+import time
+
+from gnuradio import blocks
+from gnuradio import gr
+from gnuradio import filter as grfilter
+from gnuradio.filter import pfb
+
+# pylint: disable=protected-access
+from shinysdr import filters
+
+
+_size = 4000000
+
+
+def measure(block):
+    """Return CPU seconds per input sample."""
+    top = gr.top_block()
+    top.connect(
+        blocks.vector_source_c([1] * _size),
+        block,
+        blocks.null_sink(gr.sizeof_gr_complex))
+    t0 = time.clock()
+    top.start()
+    top.wait()
+    top.stop()
+    t1 = time.clock()
+    return (t1 - t0) / _size
+
+
+def factor(description, block, model_cost):
+    """model_cost is the modeled cost per input sample."""
+    result = measure(block) / model_cost
+    print '%-40s %.3g s per modeled MAC' % (description, result)
+    return result
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    output_filename = sys.argv[1]
+    
+    fir = []
+    fft = []
+    for ntaps in [15, 63, 255]:
+        taps = [1.0 / ntaps] * ntaps
+        for decimation in [2, 5]:
+            fir.append(factor('fir %i taps / %i' % (ntaps, decimation),
+                grfilter.fir_filter_ccc(decimation, taps),
+                filters._fir_cost(ntaps, 1 / decimation)))
+            fft.append(factor('fft %i taps / %i' % (ntaps, decimation),
+                grfilter.fft_filter_ccc(decimation, taps, 1),
+                filters._fft_cost(ntaps, 1)))
+    
+    rational = []
+    for interpolation, decimation in [(3, 2), (24, 25)]:
+        ntaps = 64 * interpolation
+        rational.append(factor('rational %i/%i' % (interpolation, decimation),
+            grfilter.rational_resampler_base_ccf(interpolation, decimation, [1.0 / ntaps] * ntaps),
+            filters._rational_resampler_cost(ntaps, interpolation, interpolation / decimation)))
+    
+    pfb_factors = []
+    filter_count = 32
+    for ratio in [0.96, 1.5]:
+        ntaps = 64 * filter_count
+        pfb_factors.append(factor('pfb %s' % (ratio,),
+            pfb.arb_resampler_ccf(ratio, [1.0 / ntaps] * ntaps, filter_count),
+            filters._pfb_resampler_cost(ntaps, filter_count, ratio)))
+    
+    # Only relative costs matter, so normalize to FIR filters.
+    scale = mean(fir)
+    calibration = {
+        'fir': 1.0,
+        'fft': mean(fft) / scale,
+        'rational': mean(rational) / scale,
+        'pfb': mean(pfb_factors) / scale,
+    }
+    print calibration
+    with open(output_filename, 'w') as f:
+        json.dump(calibration, f)
+
+
+if __name__ == '__main__':
+    main()
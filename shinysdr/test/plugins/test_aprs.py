@@ -316,6 +316,7 @@ class TestAPRSTelemetryStore(unittest.TestCase):
     
     def __receive(self, msg):
         expand_aprs_message(msg, self.store)
+        self.clock.advance(0)  # messages are applied in a batch
     
     def test_new_station(self):
         self.assertEqual([], self.store.state().keys())
@@ -383,6 +384,13 @@ class TestAPRSStation(unittest.TestCase):
             longitude=TelemetryItem(-42, _dummy_receive_time),
             altitude=TelemetryItem(304.8, _dummy_receive_time)
         ), self.s.get_track())
+    
+    def test_track_history(self):
+        history_cell = self.s.state()['track_history']
+        self.s.receive(self.__message([Position(31, -42)]))
+        self.assertEqual(0, len(history_cell.get()))
+        self.s.flush_changes()
+        self.assertEqual([31, -42], list(history_cell.get()[0][:2]))
         
     def test_symbol(self):
         self.assertEqual('', self.s.get_symbol())
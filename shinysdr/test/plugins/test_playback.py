@@ -0,0 +1,65 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, division
+
+import json
+import os
+import os.path
+
+import numpy
+
+from shinysdr.i.recording import SigMFWriter
+from shinysdr.plugins.playback import PlaybackDevice
+from shinysdr.test.testutil import DeviceTestCase, state_smoke_test
+
+
+class TestPlaybackDevice(DeviceTestCase):
+    def setUp(self):
+        directory = self.mktemp()
+        os.mkdir(directory)
+        self.path = os.path.join(directory, u'test.sigmf-data')
+        writer = SigMFWriter(self.path, sample_rate=1000, channels=1, center_freq=1e6, start_time=0.0)
+        writer.write(numpy.zeros(2000, dtype=numpy.complex64).tostring())
+        writer.close()
+        super(TestPlaybackDevice, self).setUpFor(
+            device=PlaybackDevice(self.path[:-len('data')] + 'meta', realtime=True, loop=False))
+
+    # Test methods provided by DeviceTestCase
+
+    def test_metadata(self):
+        self.assertEqual(self.device.get_freq(), 1e6)
+        self.assertEqual(self.device.get_rx_driver().get_output_type().get_sample_rate(), 1000)
+        self.assertEqual(self.device.get_rx_driver().state()['position'].type().get_max(), 2.0)
+
+    def test_state_smoke(self):
+        state_smoke_test(self.device.get_rx_driver())
+
+    def test_close(self):
+        rx_driver = self.device.get_rx_driver()
+        self.device.close()
+        # The recording is no longer mapped.
+        self.assertRaises(ValueError, lambda: rx_driver._PlaybackRXDriver__map[0])
+
+    def test_unsupported_datatype(self):
+        meta_path = self.path[:-len('data')] + 'meta'
+        with open(meta_path, 'rb') as f:
+            metadata = json.load(f)
+        metadata['global']['core:datatype'] = 'ci16_le'
+        with open(meta_path, 'wb') as f:
+            json.dump(metadata, f)
+        self.assertRaises(ValueError, lambda: PlaybackDevice(self.path))
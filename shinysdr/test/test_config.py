@@ -81,6 +81,30 @@ class TestConfigObject(unittest.TestCase):
         self.config.persist_to_file('foo')
         self.assertRaises(ConfigException, lambda: self.config.persist_to_file('bar'))
         self.assertEqual('foo', self.config._state_filename)
+    
+    def test_telemetry_snapshot_ok(self):
+        self.assertEqual(None, self.config._telemetry_snapshot)
+        self.config.set_telemetry_snapshot('foo', interval=10)
+        self.assertEqual(('foo', 10.0), self.config._telemetry_snapshot)
+    
+    def test_telemetry_snapshot_bad_interval(self):
+        self.assertRaises(ConfigException, lambda: self.config.set_telemetry_snapshot('foo', interval=0))
+        self.assertEqual(None, self.config._telemetry_snapshot)
+    
+    def test_filter_design_cache_ok(self):
+        self.assertEqual(None, self.config._filter_design_cache_filename)
+        self.config.set_filter_design_cache('foo')
+        self.assertEqual('foo', self.config._filter_design_cache_filename)
+    
+    def test_filter_design_cache_duplication(self):
+        self.config.set_filter_design_cache('foo')
+        self.assertRaises(ConfigException, lambda: self.config.set_filter_design_cache('bar'))
+        self.assertEqual('foo', self.config._filter_design_cache_filename)
+    
+    def test_filter_calibration_ok(self):
+        self.assertEqual(None, self.config._filter_calibration_filename)
+        self.config.set_filter_calibration('foo')
+        self.assertEqual('foo', self.config._filter_calibration_filename)
 
     # --- Devices ---
     
@@ -120,6 +144,41 @@ class TestConfigObject(unittest.TestCase):
             self.config.devices.add(u'foo'))
         self.assertEqual({}, self.config.devices._values)
     
+    @defer.inlineCallbacks
+    def test_device_channelizer_ok(self):
+        self.config.devices.add(u'foo', StubDevice())
+        self.config.devices.set_channelizer('foo', channels=8)
+        yield self.config._wait_and_validate()
+        self.assertEqual({u'foo': 8}, self.config.devices._channelizers)
+    
+    def test_device_channelizer_too_few(self):
+        self.config.devices.add(u'foo', StubDevice())
+        self.assertRaises(ConfigException, lambda:
+            self.config.devices.set_channelizer('foo', channels=1))
+        self.assertEqual({}, self.config.devices._channelizers)
+    
+    def test_device_channelizer_odd(self):
+        self.config.devices.add(u'foo', StubDevice())
+        self.assertRaises(ConfigException, lambda:
+            self.config.devices.set_channelizer('foo', channels=5))
+        self.assertEqual({}, self.config.devices._channelizers)
+    
+    def test_device_channelizer_unknown_device(self):
+        self.config.devices.set_channelizer('foo')
+        return self.assertFailure(self.config._wait_and_validate(), ConfigException)
+    
+    def test_device_shared_decimation_ok(self):
+        self.config.devices.add(u'foo', StubDevice())
+        self.config.devices.set_shared_decimation('foo', decimation=10)
+        self.assertEqual({u'foo': 10}, self.config.devices._shared_decimations)
+    
+    def test_device_shared_decimation_and_channelizer(self):
+        self.config.devices.add(u'foo', StubDevice())
+        self.config.devices.set_channelizer('foo')
+        self.assertRaises(ConfigException, lambda:
+            self.config.devices.set_shared_decimation('foo'))
+        self.assertEqual({}, self.config.devices._shared_decimations)
+    
     # --- serve_web ---
     
     @defer.inlineCallbacks
@@ -168,6 +227,14 @@ class TestConfigObject(unittest.TestCase):
         self.assertEqual({}, self.config.devices._values)
     
     # TODO test rest of config.set_server_audio_allowed
+    
+    def test_audio_recording_not_directory(self):
+        self.assertRaises(ConfigException, lambda:
+            self.config.set_audio_recording('/nonexistent/directory'))
+    
+    def test_audio_recording_format(self):
+        self.assertRaises(ConfigException, lambda:
+            self.config.set_audio_recording('.', file_format='mp3'))
 
     @defer.inlineCallbacks
     def test_stereo_too_late(self):
@@ -17,6 +17,10 @@
 
 from __future__ import absolute_import, division
 
+import json
+import os.path
+import shutil
+import tempfile
 import textwrap
 
 from twisted.trial import unittest
@@ -24,7 +28,9 @@ from twisted.trial import unittest
 from gnuradio import blocks
 from gnuradio import gr
 
-from shinysdr.filters import MultistageChannelFilter
+# pylint: disable=protected-access
+from shinysdr import filters
+from shinysdr.filters import ChannelizerBank, MultistageChannelFilter, SharedDecimationBank, _DesignCache
 
 
 class TestMultistageChannelFilter(unittest.TestCase):
@@ -38,13 +44,9 @@ class TestMultistageChannelFilter(unittest.TestCase):
         self.assertEqual(1000, filt.get_transition_width())
         self.assertEqual(10000, filt.get_center_freq())
         self.assertEqual(filt.explain(), textwrap.dedent("""\
-            7 stages from 32000000 to 16000
-              freq xlate and decimate by 5 using  25 taps (160000000) in freq_xlating_fir_filter_ccc_sptr
-              decimate by 5 using  25 taps (32000000) in fft_filter_ccc_sptr
-              decimate by 5 using  25 taps (6400000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (1408000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (704000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (352000) in fft_filter_ccc_sptr
+            3 stages from 32000000 to 16000
+              freq xlate and decimate by 100 using 489 taps (156480000) in freq_xlating_fir_filter_ccc_sptr
+              decimate by 10 using  57 taps (1824000) in fir_filter_ccc_sptr
               final filter and decimate by 2 using  77 taps (1232000) in fft_filter_ccc_sptr
               No final resampler stage."""))
     
@@ -55,13 +57,9 @@ class TestMultistageChannelFilter(unittest.TestCase):
         # TODO: Test filter functionality more
         f = MultistageChannelFilter(input_rate=32000000, output_rate=16000, cutoff_freq=3000, transition_width=1200)
         self.__run(f, 400000, 16000 / 32000000, """\
-            7 stages from 32000000 to 16000
-              freq xlate and decimate by 5 using  25 taps (160000000) in freq_xlating_fir_filter_ccc_sptr
-              decimate by 5 using  25 taps (32000000) in fft_filter_ccc_sptr
-              decimate by 5 using  25 taps (6400000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (1408000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (704000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (352000) in fft_filter_ccc_sptr
+            3 stages from 32000000 to 16000
+              freq xlate and decimate by 100 using 489 taps (156480000) in freq_xlating_fir_filter_ccc_sptr
+              decimate by 10 using  57 taps (1824000) in fir_filter_ccc_sptr
               final filter and decimate by 2 using  65 taps (1040000) in fft_filter_ccc_sptr
               No final resampler stage.""")
     
@@ -69,13 +67,9 @@ class TestMultistageChannelFilter(unittest.TestCase):
         # Either float or int rates should be accepted
         f = MultistageChannelFilter(input_rate=32000000.0, output_rate=16000.0, cutoff_freq=3000, transition_width=1200)
         self.__run(f, 400000, 16000 / 32000000, """\
-            7 stages from 32000000 to 16000
-              freq xlate and decimate by 5 using  25 taps (160000000) in freq_xlating_fir_filter_ccc_sptr
-              decimate by 5 using  25 taps (32000000) in fft_filter_ccc_sptr
-              decimate by 5 using  25 taps (6400000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (1408000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (704000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (352000) in fft_filter_ccc_sptr
+            3 stages from 32000000 to 16000
+              freq xlate and decimate by 100 using 489 taps (156480000) in freq_xlating_fir_filter_ccc_sptr
+              decimate by 10 using  57 taps (1824000) in fir_filter_ccc_sptr
               final filter and decimate by 2 using  65 taps (1040000) in fft_filter_ccc_sptr
               No final resampler stage.""")
     
@@ -102,13 +96,9 @@ class TestMultistageChannelFilter(unittest.TestCase):
         # TODO: Test filter functionality more
         f = MultistageChannelFilter(input_rate=8000000, output_rate=48000, cutoff_freq=10000, transition_width=5000)
         self.__run(f, 400000, 48000 / 8000000, """\
-            8 stages from 8000000 to 48000
-              freq xlate and decimate by 2 using   9 taps (36000000) in freq_xlating_fir_filter_ccc_sptr
-              decimate by 2 using   9 taps (18000000) in fir_filter_ccc_sptr
-              decimate by 2 using   9 taps (9000000) in fir_filter_ccc_sptr
-              decimate by 2 using   9 taps (4500000) in fir_filter_ccc_sptr
-              decimate by 2 using  11 taps (2750000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (1375000) in fft_filter_ccc_sptr
+            4 stages from 8000000 to 48000
+              freq xlate and decimate by 16 using  79 taps (39500000) in freq_xlating_fir_filter_ccc_sptr
+              decimate by 4 using  21 taps (2625000) in fir_filter_ccc_sptr
               final filter and decimate by 2 using  61 taps (3812500) in fft_filter_ccc_sptr
               rational_resampler by 96/125 (stage rates 48000/62500) using 4128 taps (198144000) in rational_resampler_base_ccf_sptr""")
     
@@ -158,3 +148,185 @@ class TestMultistageChannelFilter(unittest.TestCase):
         top.stop()
         reference_out_size = in_size * ratio
         return reference_out_size - len(sink.data())
+
+
+class TestFilterPlanner(unittest.TestCase):
+    def setUp(self):
+        self.__temp_dir = tempfile.mkdtemp(prefix='shinysdr_test_filters')
+    
+    def tearDown(self):
+        self.__load_calibration({})
+        shutil.rmtree(self.__temp_dir)
+    
+    def __load_calibration(self, calibration):
+        filename = os.path.join(self.__temp_dir, 'calibration')
+        with open(filename, 'w') as f:
+            json.dump(calibration, f)
+        filters.load_filter_calibration(filename)
+    
+    def test_ntaps(self):
+        # cf. test_explain
+        self.assertEqual(filters._estimate_ntaps(53, 10000, 550), 43)
+        self.assertEqual(filters._estimate_ntaps(53, 2000, 100), 49)
+    
+    def test_fft_versus_fir(self):
+        self.assertFalse(filters._prefer_fft_filter(11, 100000, 50000))
+        self.assertTrue(filters._prefer_fft_filter(101, 100000, 50000))
+        # with enough decimation, a direct FIR is cheaper because it computes only the output samples
+        self.assertFalse(filters._prefer_fft_filter(101, 100000, 1000))
+    
+    def test_least_cost_decimations(self):
+        def cost(decimations):
+            stage_input_rate = 32000000
+            total = 0
+            for i, decimation in enumerate(decimations):
+                stage_type = filters._FilterPlanFinalDecimatingStage if i == len(decimations) - 1 else filters._FilterPlanDecimatingStage
+                total += stage_type(
+                    freq_xlating=i == 0,
+                    decimation=decimation,
+                    input_rate=stage_input_rate,
+                    output_rate=stage_input_rate / decimation).estimate_cost(3000, 1200)
+                stage_input_rate /= decimation
+            return total
+        
+        decimations = filters._choose_stage_decimations(32000000, 2000, 3000, 1200)
+        self.assertEqual(reduce(lambda a, b: a * b, decimations), 2000)
+        self.assertLess(cost(decimations), cost([5, 5, 5, 2, 2, 2, 2]))
+        self.assertLess(cost(decimations), cost([2000]))
+    
+    def test_calibration(self):
+        self.__load_calibration({'fft': 1000})
+        self.assertFalse(filters._prefer_fft_filter(101, 100000, 50000))
+        self.assertRaises(ValueError, lambda: self.__load_calibration({'foo': 1}))
+        self.assertRaises(ValueError, lambda: self.__load_calibration({'fir': -1}))
+    
+    def test_rational_preferred(self):
+        plan = filters._make_filter_plan_1(1000000, 48000, 5000, 1000)
+        self.assertIsInstance(plan.get_stage_designs()[-1], filters._FilterPlanRationalResamplerStage)
+    
+    def test_pfb_when_cheaper(self):
+        self.__load_calibration({'rational': 100})
+        plan = filters._make_filter_plan_1(1000000, 48000, 5000, 1000)
+        self.assertIsInstance(plan.get_stage_designs()[-1], filters._FilterPlanPfbResamplerStage)
+
+
+class TestChannelizerBank(unittest.TestCase):
+    def test_nearest_channel(self):
+        bank = ChannelizerBank(input_rate=200000, channels=4)
+        self.assertEqual(bank.get_channel_spacing(), 50000)
+        self.assertEqual(bank.get_output_rate(), 100000)
+        self.assertEqual(bank.nearest_channel(0), (0, 0))
+        self.assertEqual(bank.nearest_channel(60000), (1, 50000))
+        self.assertEqual(bank.nearest_channel(-60000), (3, -50000))
+        self.assertEqual(bank.nearest_channel(-90000), (2, -100000))
+        self.assertEqual(bank.get_max_signal_half_width(), 12500)
+    
+    def test_partial_use(self):
+        bank = ChannelizerBank(input_rate=200000, channels=4)
+        top = gr.top_block()
+        sink = blocks.vector_sink_c()
+        top.connect(
+            blocks.vector_source_c([0] * 40000),
+            bank)
+        top.connect((bank, 2), sink)
+        top.start()
+        top.wait()
+        top.stop()
+        self.assertApproximates(len(sink.data()), 20000, 100)
+    
+    def test_too_few_channels(self):
+        self.assertRaises(ValueError, lambda: ChannelizerBank(input_rate=200000, channels=1))
+    
+    def test_odd_channels(self):
+        self.assertRaises(ValueError, lambda: ChannelizerBank(input_rate=200000, channels=5))
+    
+    def test_explain_channel(self):
+        bank = ChannelizerBank(input_rate=200000, channels=4)
+        self.assertEqual(bank.explain_channel(2), 'channel 2 of ' + bank.explain())
+
+
+class TestSharedDecimationBank(unittest.TestCase):
+    def test_nearest_channel(self):
+        bank = SharedDecimationBank(input_rate=10000000, decimation=20)
+        self.assertEqual(bank.get_output_rate(), 500000)
+        self.assertEqual(bank.nearest_channel(0), (0, 0))
+        self.assertEqual(bank.nearest_channel(300000), (1, 250000))
+        self.assertEqual(bank.nearest_channel(-1000000), (-4, -1000000))
+        self.assertEqual(bank.get_max_signal_half_width(), 50000)
+    
+    def test_sharing(self):
+        bank = SharedDecimationBank(input_rate=10000000, decimation=20)
+        connections = []
+        
+        class RecordingConnector(object):
+            def connect(self, *endpoints):
+                connections.append(endpoints)
+        
+        stage_1 = bank.connect_channel(RecordingConnector(), 'source', 1)
+        self.assertEqual(bank.get_channel_cost(1, set([1])), 0)
+        self.assertEqual(bank.get_channel_cost(2, set([1])), 1)
+        self.assertIs(stage_1, bank.connect_channel(RecordingConnector(), 'source', 1))
+        self.assertEqual(connections, [('source', stage_1), ('source', stage_1)])
+        self.assertIsInstance(stage_1, MultistageChannelFilter)
+        self.assertEqual(stage_1.get_center_freq(), 250000)
+        self.assertIn('channel 1 at 250000', bank.explain())
+        self.assertIn(stage_1.explain().split('\n')[0], bank.explain())
+        self.assertEqual(bank.explain_channel(1), 'shared channel 1 at 250000.0: ' + stage_1.explain())
+    
+    def test_too_little_decimation(self):
+        self.assertRaises(ValueError, lambda: SharedDecimationBank(input_rate=10000000, decimation=1))
+
+
+class TestDesignCache(unittest.TestCase):
+    def setUp(self):
+        self.__temp_dir = tempfile.mkdtemp(prefix='shinysdr_test_filters')
+        self.computations = []
+    
+    def tearDown(self):
+        shutil.rmtree(self.__temp_dir)
+    
+    def __compute(self, value):
+        def compute():
+            self.computations.append(value)
+            return [value, value]
+        return compute
+    
+    def test_hit(self):
+        cache = _DesignCache()
+        self.assertEqual(cache.get(('low_pass', 1), self.__compute(1)), (1, 1))
+        self.assertEqual(cache.get(('low_pass', 1), self.__compute(1)), (1, 1))
+        self.assertEqual(cache.get(('low_pass', 2), self.__compute(2)), (2, 2))
+        self.assertEqual(self.computations, [1, 2])
+    
+    def test_bounded(self):
+        cache = _DesignCache(max_entries=2)
+        cache.get(('low_pass', 1), self.__compute(1))
+        cache.get(('low_pass', 2), self.__compute(2))
+        cache.get(('low_pass', 1), self.__compute(1))  # 2 is now least recently used
+        cache.get(('low_pass', 3), self.__compute(3))
+        cache.get(('low_pass', 1), self.__compute(1))
+        cache.get(('low_pass', 2), self.__compute(2))
+        self.assertEqual(self.computations, [1, 2, 3, 2])
+    
+    def test_save_and_load(self):
+        filename = os.path.join(self.__temp_dir, 'cache')
+        cache = _DesignCache()
+        cache.load(filename)  # nonexistent is OK
+        cache.get(('low_pass', 1.5, 'x'), self.__compute(1))
+        cache.get(('plan', 1), self.__compute(2))
+        cache.save()
+        
+        cache = _DesignCache()
+        cache.load(filename)
+        self.assertEqual(cache.get(('low_pass', 1.5, 'x'), self.__compute(3)), (1, 1))
+        self.assertEqual(cache.get(('plan', 1), self.__compute(4)), [4, 4])
+        self.assertEqual(self.computations, [1, 2, 4])
+    
+    def test_load_bad_file(self):
+        filename = os.path.join(self.__temp_dir, 'cache')
+        with open(filename, 'w') as f:
+            f.write('garbage')
+        cache = _DesignCache()
+        cache.load(filename)
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self.assertEqual(cache.get(('low_pass', 1), self.__compute(1)), (1, 1))
@@ -17,11 +17,15 @@
 
 from __future__ import absolute_import, division
 
+import math
+
 from twisted.internet.task import Clock
 from twisted.trial import unittest
 from zope.interface import implements
 
-from shinysdr.telemetry import ITelemetryMessage, ITelemetryObject, TelemetryItem, TelemetryStore, Track, empty_track
+from shinysdr.i.json import transform_for_json
+from shinysdr.telemetry import IPersistableTelemetryMessage, ITelemetryMessage, ITelemetryObject, ITrackedTelemetryObject, TelemetryItem, TelemetryStore, Track, TrackHistory, empty_track
+from shinysdr.values import SubscriptionContext
 
 
 class TestTrack(unittest.TestCase):
@@ -36,32 +40,154 @@ class TestTrack(unittest.TestCase):
             }))
 
 
+def _position(latitude, longitude, time, altitude=None):
+    return empty_track._replace(
+        latitude=TelemetryItem(latitude, time),
+        longitude=TelemetryItem(longitude, time),
+        altitude=TelemetryItem(altitude, time))
+
+
+class TestTrackHistory(unittest.TestCase):
+    def test_empty(self):
+        history = TrackHistory()
+        self.assertEqual((0, 4), history.get().shape)
+        self.assertEqual(None, history.get_origin_time())
+        self.assertFalse(history.record(empty_track))
+    
+    def test_downsampling(self):
+        history = TrackHistory(min_distance=100, min_interval=10)
+        self.assertTrue(history.record(_position(10, 20, 1000, altitude=500)))
+        self.assertFalse(history.record(_position(11, 20, 1005)))  # too soon
+        self.assertFalse(history.record(_position(10.0001, 20, 1020)))  # too close
+        self.assertTrue(history.record(_position(10.01, 20, 1030)))
+        self.assertEqual(1000, history.get_origin_time())
+        points = history.get()
+        self.assertEqual((2, 4), points.shape)
+        self.assertEqual([10, 20, 500, 0], list(points[0]))
+        self.assertAlmostEqual(10.01, points[1][0], places=5)
+        self.assertTrue(math.isnan(points[1][2]))
+        self.assertEqual(30, points[1][3])
+    
+    def test_ring(self):
+        history = TrackHistory(capacity=3, min_distance=0, min_interval=0)
+        for i in xrange(5):
+            history.record(_position(i, 0, 1000 + i))
+        self.assertEqual([[2, 0, 2], [3, 0, 3], [4, 0, 4]], [[row[0], row[1], row[3]] for row in history.get()])
+        history.record(_position(5, 0, 1005))
+        self.assertEqual([3, 4, 5], [row[0] for row in history.get()])
+    
+    def test_growth(self):
+        history = TrackHistory(capacity=10, min_distance=0, min_interval=0)
+        for i in xrange(7):
+            history.record(_position(i, 0, 1000 + i))
+        self.assertEqual(range(7), [row[0] for row in history.get()])
+        for i in xrange(7, 25):
+            history.record(_position(i, 0, 1000 + i))
+        self.assertEqual(range(15, 25), [row[0] for row in history.get()])
+    
+    def test_subscribe(self):
+        history = TrackHistory(min_distance=0, min_interval=0)
+        queue_1 = _QueueStub()
+        history.subscribe(queue_1)
+        self.assertEqual(0, queue_1.count)
+        history.record(_position(0, 0, 1000))
+        self.assertEqual(1, queue_1.count)
+        queue_2 = _QueueStub()
+        history.subscribe(queue_2)
+        self.assertEqual(1, queue_2.count)  # snapshot on subscription
+        history.unsubscribe(queue_1)
+        history.record(_position(1, 0, 1001))
+        self.assertEqual(1, queue_1.count)
+        self.assertEqual(2, queue_2.count)
+    
+    def test_cell(self):
+        history = TrackHistory()
+        history.record(_position(10, 20, 1000))
+        cell = history.cell()
+        self.assertEqual('track_history', cell.key())
+        self.assertEqual((1, 4), cell.get().shape)
+        self.assertEqual((1000, 4), history.get_track_history_info())
+    
+    def test_cell_description_serializable(self):
+        history = TrackHistory()
+        history.record(_position(10, 20, 1000, altitude=500))
+        self.assertEqual([[10, 20, 500, 0]], transform_for_json(history.cell().description())[u'current'])
+
+
+class _QueueStub(object):
+    def __init__(self):
+        self.count = 0
+    
+    def insert_tail(self, message):
+        self.count += 1
+
+
 class TestTelemetryStore(unittest.TestCase):
     def setUp(self):
         self.clock = Clock()
         self.clock.advance(1000)
         self.store = TelemetryStore(time_source=self.clock)
     
+    def __receive(self, message):
+        self.store.receive(message)
+        self.clock.advance(0)  # messages are applied in a batch
+    
     def test_new_object(self):
         self.assertEqual([], self.store.state().keys())
-        self.store.receive(Msg('foo', 1000))
+        self.__receive(Msg('foo', 1000))
         self.assertEqual(['foo'], self.store.state().keys())
         obj = self.store.state()['foo'].get()
         self.assertIsInstance(obj, Obj)
     
     def test_receive_called(self):
-        self.store.receive(Msg('foo', 1000, 1))
+        self.__receive(Msg('foo', 1000, 1))
         obj = self.store.state()['foo'].get()
         self.assertEquals(obj.last_msg, 1)
-        self.store.receive(Msg('foo', 1000, 2))
+        self.__receive(Msg('foo', 1000, 2))
         self.assertEquals(obj.last_msg, 2)
     
+    def test_batch(self):
+        self.store.receive(Msg('foo', 1000, 1))
+        self.store.receive(Msg('foo', 1000, 2))
+        self.store.receive(Msg('bar', 1000, 3))
+        self.assertEqual([], self.store.state().keys())
+        self.clock.advance(0)
+        self.assertEqual({'bar', 'foo'}, set(self.store.state().keys()))
+        foo = self.store.state()['foo'].get()
+        self.assertEqual(foo.last_msg, 2)
+        self.assertEqual(foo.flushes, 1)
+        self.assertEqual(self.store.state()['bar'].get().flushes, 1)
+    
+    def test_retain_and_restore(self):
+        self.store.retain_messages(2)
+        self.__receive(PersistableMsg('foo', 1000, 1))
+        self.__receive(PersistableMsg('foo', 1000, 2))
+        self.__receive(PersistableMsg('foo', 1000, 3))
+        self.__receive(Msg('bar', 1000))  # not persistable
+        [(object_id, expiry, messages)] = self.store.get_snapshot()
+        self.assertEqual((u'foo', 2800), (object_id, expiry))
+        self.assertEqual([2, 3], [m.value for m in messages])
+        
+        new_store = TelemetryStore(time_source=self.clock)
+        new_store.restore(messages)
+        self.clock.advance(0)
+        self.assertEqual(3, new_store.state()['foo'].get().last_msg)
+    
+    def test_restore_does_not_overwrite(self):
+        self.__receive(Msg('foo', 1000, 'live'))
+        self.store.restore([Msg('foo', 900, 'old')])
+        self.store.receive(Msg('bar', 1000, 'live'))
+        self.store.restore([Msg('bar', 900, 'old')])
+        self.clock.advance(0)
+        self.assertEqual('live', self.store.state()['foo'].get().last_msg)
+        self.assertEqual('live', self.store.state()['bar'].get().last_msg)
+    
     def test_drop_old(self):
-        self.store.receive(Msg('foo', 1000))
+        self.__receive(Msg('foo', 1000))
         self.assertEqual(['foo'], self.store.state().keys())
 
         self.clock.advance(1799.5)
-        self.store.receive(Msg('bar', 2799.5))
+        self.__receive(Msg('bar', 2799.5))
         self.assertEqual({'bar', 'foo'}, set(self.store.state().keys()))
 
         self.clock.advance(0.5)
@@ -73,10 +199,31 @@ class TestTelemetryStore(unittest.TestCase):
         # Expect complete cleanup -- that is, even if a TelemetryStore is created, filled, and thrown away, it will eventually be garbage collected when the objects expire.
         self.assertEqual([], self.clock.getDelayedCalls())
     
+    def test_expiry_extended(self):
+        self.__receive(Msg('foo', 1000))
+        self.__receive(Msg('bar', 1000))
+        self.clock.advance(1000)
+        self.__receive(Msg('foo', 2000))
+        self.clock.advance(800)
+        self.assertEqual(['foo'], self.store.state().keys())
+        self.clock.advance(1000)
+        self.assertEqual([], self.store.state().keys())
+        self.assertEqual([], self.clock.getDelayedCalls())
+    
+    def test_many_objects(self):
+        for i in xrange(1000):
+            self.__receive(Msg('obj%i' % (i,), 1000 + i))
+            self.__receive(Msg('obj%i' % (i,), 1000 + i))  # unchanged expiry
+        for i in xrange(500):
+            self.__receive(Msg('obj%i' % (i,), 3000))
+        self.clock.advance(1800 + 999.5)
+        self.assertEqual(set('obj%i' % (i,) for i in xrange(500)), set(self.store.state().keys()))
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+    
     def test_become_interesting(self):
-        self.store.receive(Msg('foo', 1000, 'boring'))
+        self.__receive(Msg('foo', 1000, 'boring'))
         self.assertEqual([], self.store.state().keys())
-        self.store.receive(Msg('foo', 1001, 'interesting'))
+        self.__receive(Msg('foo', 1001, 'interesting'))
         self.assertEqual(['foo'], self.store.state().keys())
         # 'become boring' is not implemented, so also not tested yet
     
@@ -84,13 +231,125 @@ class TestTelemetryStore(unittest.TestCase):
         """
         Make sure that dropping a boring object doesn't fail.
         """
-        self.store.receive(Msg('foo', 1000, 'boring'))
+        self.__receive(Msg('foo', 1000, 'boring'))
         self.assertEqual([], self.store.state().keys())
         self.clock.advance(1800)
-        self.store.receive(Msg('bar', 2800, 'boring'))
+        self.__receive(Msg('bar', 2800, 'boring'))
         self.assertEqual([], self.store.state().keys())
     
 
+class TestTelemetryStoreArea(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.clock.advance(1000)
+        self.store = TelemetryStore(time_source=self.clock)
+        self.log = []
+    
+    def __receive(self, *messages):
+        for message in messages:
+            self.store.receive(message)
+        self.clock.advance(0)
+    
+    def __subscribe(self, *area, **kwargs):
+        return self.store.subscribe_area(*area,
+            enter=lambda object_id, obj: self.log.append(('enter', object_id)),
+            leave=lambda object_id: self.log.append(('leave', object_id)),
+            **kwargs)
+    
+    def test_query(self):
+        self.__receive(
+            PositionMsg('a', 1000, 37.5, -122.5),
+            PositionMsg('b', 1000, 37.5, -100.0),
+            PositionMsg('c', 1000, -37.5, -122.5),
+            PositionMsg('d', 1000, None, None),
+            Msg('e', 1000))
+        self.assertEqual(['a'], self.store.query_area(37, -123, 38, -122).keys())
+        self.assertEqual({'a', 'b'}, set(self.store.query_area(30, -130, 40, -90).keys()))
+        self.assertEqual({'a', 'b', 'c'}, set(self.store.query_area(-90, -180, 90, 180).keys()))
+        self.assertEqual([], self.store.query_area(37, -122, 38, -121).keys())
+    
+    def test_query_antimeridian(self):
+        self.__receive(
+            PositionMsg('east', 1000, 0, 179.5),
+            PositionMsg('west', 1000, 0, -179.5),
+            PositionMsg('zero', 1000, 0, 0))
+        self.assertEqual({'east', 'west'}, set(self.store.query_area(-1, 179, 1, -179).keys()))
+        self.assertEqual({'east', 'west'}, set(self.store.query_area(-1, 179, 1, 181).keys()))
+    
+    def test_subscribe(self):
+        self.__receive(PositionMsg('a', 1000, 10.5, 10.5))
+        subscription = self.__subscribe(10, 10, 11, 11)
+        self.assertEqual([('enter', 'a')], self.log)
+        self.log = []
+        self.__receive(
+            PositionMsg('a', 1000, 10.6, 10.6),  # moves within
+            PositionMsg('b', 1000, 12.5, 10.5))  # outside
+        self.assertEqual([], self.log)
+        self.__receive(
+            PositionMsg('a', 1000, 11.5, 10.5),
+            PositionMsg('b', 1000, 10.5, 10.5))
+        self.assertEqual({('leave', 'a'), ('enter', 'b')}, set(self.log))
+        self.log = []
+        subscription.set_area(10, 10, 12, 12)
+        self.assertEqual([('enter', 'a')], self.log)
+        self.log = []
+        subscription.unsubscribe()
+        self.__receive(PositionMsg('a', 1000, 0, 0))
+        self.assertEqual([], self.log)
+    
+    def test_subscribe_expiry(self):
+        self.__receive(PositionMsg('a', 1000, 10.5, 10.5))
+        self.__subscribe(10, 10, 11, 11)
+        self.log = []
+        self.clock.advance(1800)
+        self.assertEqual([('leave', 'a')], self.log)
+        self.assertEqual({}, self.store.query_area(-90, -180, 90, 180))
+    
+    def test_subscribe_unpositioned(self):
+        self.__receive(
+            PositionMsg('a', 1000, None, None),
+            Msg('b', 1000),
+            PositionMsg('c', 1000, 0, 0))
+        self.__subscribe(10, 10, 11, 11, include_unpositioned=True)
+        self.assertEqual({('enter', 'a'), ('enter', 'b')}, set(self.log))
+        self.log = []
+        self.__receive(PositionMsg('a', 1000, 0, 0))
+        self.assertEqual([('leave', 'a')], self.log)
+        self.log = []
+        self.__receive(Msg('d', 1000))
+        self.assertEqual([('enter', 'd')], self.log)
+    
+    def test_state_subscribe_area(self):
+        self.__receive(
+            PositionMsg('a', 1000, 10.5, 10.5),
+            PositionMsg('b', 1000, 0, 0),
+            Msg('c', 1000))
+        states = []
+        subscription = self.store.state_subscribe_area((10, 10, 11, 11), states.append, SubscriptionContext(reactor=self.clock, poller=None))
+        all_state = self.store.state()
+        self.assertEqual({'a': all_state['a'], 'c': all_state['c']}, subscription.get_state())
+        self.clock.advance(0)
+        self.assertEqual([], states)
+        
+        # changes in one batch produce one notification
+        self.__receive(
+            PositionMsg('a', 1000, 0, 0),
+            PositionMsg('b', 1000, 10.5, 10.5))
+        self.clock.advance(0)
+        self.assertEqual([{'b': all_state['b'], 'c': all_state['c']}], states)
+        
+        states[:] = []
+        subscription.set_area((-1, -1, 1, 1))
+        self.clock.advance(0)
+        self.assertEqual([{'a': all_state['a'], 'c': all_state['c']}], states)
+        
+        states[:] = []
+        subscription.unsubscribe()
+        self.__receive(PositionMsg('a', 1000, 10.5, 10.5))
+        self.clock.advance(0)
+        self.assertEqual([], states)
+
+
 class Msg(object):
     implements(ITelemetryMessage)
     
@@ -113,13 +372,46 @@ class Obj(object):
         self.__id = object_id
         self.last_msg = 'no message'
         self.last_time = None
+        self.flushes = 0
     
     def receive(self, message):
         self.last_msg = message.value
         self.last_time = message.timestamp
     
+    def flush_changes(self):
+        self.flushes += 1
+    
     def is_interesting(self):
         return self.last_msg != 'boring'
     
     def get_object_expiry(self):
         return self.last_time + 1800
+
+
+class PersistableMsg(Msg):
+    implements(IPersistableTelemetryMessage)
+
+
+class PositionMsg(Msg):
+    def __init__(self, object_id, timestamp, latitude, longitude):
+        Msg.__init__(self, object_id, timestamp)
+        self.latitude = latitude
+        self.longitude = longitude
+    
+    def get_object_constructor(self):
+        return TrackedObj
+
+
+class TrackedObj(Obj):
+    implements(ITrackedTelemetryObject)
+    
+    def __init__(self, object_id):
+        Obj.__init__(self, object_id)
+        self.track = empty_track
+    
+    def receive(self, message):
+        Obj.receive(self, message)
+        self.track = _position(message.latitude, message.longitude, message.timestamp)
+    
+    def get_track(self):
+        return self.track
@@ -17,11 +17,15 @@
 
 from __future__ import absolute_import, division
 
+import array
+import struct
 import unittest
 
+from gnuradio import gr
+
 from shinysdr.test.testutil import CellSubscriptionTester
-from shinysdr.types import EnumRow, RangeT, ReferenceT, to_value_type
-from shinysdr.values import Cell, CellDict, CollectionState, ExportedState, LooseCell, ViewCell, command, exported_value, nullExportedState, setter, unserialize_exported_state
+from shinysdr.types import BulkDataT, EnumRow, RangeT, ReferenceT, to_value_type
+from shinysdr.values import Cell, CellDict, CollectionState, ExportedState, LooseCell, StreamCell, ViewCell, command, exported_value, nullExportedState, setter, unserialize_exported_state
 
 
 class TestExportedState(unittest.TestCase):
@@ -348,6 +352,56 @@ class TestStateInsert(unittest.TestCase):
         self.assertEqual([], self.object.state().keys())
 
 
+class TestCollectionState(unittest.TestCase):
+    def setUp(self):
+        self.table = CellDict(dynamic=True)
+        self.object = CollectionState(self.table)
+    
+    def test_shape_change(self):
+        self.assertEqual([], self.object.state().keys())
+        self.table['a'] = ExportedState()
+        self.assertEqual(['a'], self.object.state().keys())
+        del self.table['a']
+        self.assertEqual([], self.object.state().keys())
+    
+    def test_cached(self):
+        self.table['a'] = ExportedState()
+        self.assertIs(self.object.state(), self.object.state())
+        state = self.object.state()
+        self.table['a'] = ExportedState()  # replacing a value is not a shape change
+        self.assertIs(state, self.object.state())
+    
+    def test_cell_follows_value(self):
+        first = ExportedState()
+        second = ExportedState()
+        self.table['a'] = first
+        cell = self.table.get_cell('a')
+        self.assertIs(first, cell.get())
+        self.table['a'] = second
+        self.assertIs(second, cell.get())
+        self.assertIs(cell, self.table.get_cell('a'))
+        del self.table['a']
+        self.assertRaises(KeyError, lambda: self.table.get_cell('a'))
+
+
+class TestLazyCells(unittest.TestCase):
+    def test_state_changed_before_state(self):
+        o = LazyCellsSpecimen()
+        o.value = 1
+        o.state_changed('value')
+        o.state_changed()
+        self.assertFalse(hasattr(o, '_ExportedState__decorator_cells_cache'))
+        self.assertEqual(1, o.state()['value'].get())
+
+
+class LazyCellsSpecimen(ExportedState):
+    value = 0
+    
+    @exported_value(changes='explicit')
+    def get_value(self):
+        return self.value
+
+
 class InsertFailSpecimen(CollectionState):
     """Helper for TestStateInsert"""
     def __init__(self):
@@ -395,3 +449,65 @@ class CellIdentitySpecimen(ExportedState):
     @exported_value(type=ReferenceT(), changes='never')
     def get_block(self):
         return self.__block
+
+
+class TestStreamCell(unittest.TestCase):
+    def setUp(self):
+        self.object = StreamCellSpecimen()
+        self.splitter = self.object.state()['s'].subscribe_to_stream()
+    
+    def tearDown(self):
+        self.splitter.close()
+    
+    def test_python_values(self):
+        self.object.send([1, 2, 3, 4, 5, 6], count=2)
+        info, item = self.splitter.get()
+        self.assertEqual(info, (1.5,))
+        self.assertEqual(list(item), [1, 2, 3])
+        info, item = self.splitter.get()
+        self.assertEqual(list(item), [4, 5, 6])
+        self.assertEqual(self.splitter.get(), None)
+    
+    def test_binary(self):
+        self.object.send([1, 2, 3, 4, 5, 6], count=2)
+        self.assertEqual(''.join(str(b) for b in self.splitter.get(binary=True)),
+            struct.pack('d', 1.5) + array.array('b', [1, 2, 3]).tostring())
+        self.assertEqual(''.join(str(b) for b in self.splitter.get(binary=True)),
+            struct.pack('d', 1.5) + array.array('b', [4, 5, 6]).tostring())
+        self.assertEqual(self.splitter.get(binary=True), None)
+
+
+class StreamCellSpecimen(ExportedState):
+    """Helper for TestStreamCell"""
+    def __init__(self):
+        self.__distributor = _QueueDistributorSpecimen()
+    
+    def state_def(self, callback):
+        super(StreamCellSpecimen, self).state_def(callback)
+        callback(StreamCell(self, 's', type=BulkDataT(array_format='b', info_format='d')))
+    
+    def send(self, values, count):
+        string = array.array('b', values).tostring()
+        self.__distributor.send(gr.message_from_string(string, 0, len(string) // count, count))
+    
+    def get_s_distributor(self):
+        return self.__distributor
+    
+    def get_s_info(self):
+        return (1.5,)
+
+
+class _QueueDistributorSpecimen(object):
+    """Stand-in for MessageDistributorSink which sends only explicitly given messages."""
+    def __init__(self):
+        self.__queues = set()
+    
+    def subscribe(self, queue):
+        self.__queues.add(queue)
+    
+    def unsubscribe(self, queue):
+        self.__queues.remove(queue)
+    
+    def send(self, message):
+        for queue in self.__queues:
+            queue.insert_tail(message)
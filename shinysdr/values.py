@@ -22,7 +22,6 @@
 
 from __future__ import absolute_import, division
 
-import array
 from collections import namedtuple
 import struct
 import weakref
@@ -31,6 +30,7 @@ from twisted.python import log
 from zope.interface import Interface, implements  # available via Twisted
 
 from gnuradio import gr
+import numpy
 
 from shinysdr.types import BulkDataT, EnumRow, ReferenceT, to_value_type
 
@@ -260,13 +260,20 @@ class _MessageSplitter(object):
         # config
         self.__queue = queue
         self.__igetter = info_getter
-        self.__type = type
+        self.__info_struct = struct.Struct(type.get_info_format())
+        self.__dtype = numpy.dtype(type.get_array_format())
         self.close = close  # provided as method
         
         # state
         self.__splitting = None
     
     def get(self, binary=False):
+        """Return the next item from the queue, or None if there is none.
+        
+        If binary is true, the value is a tuple of buffer objects which, concatenated, are the packed info and the item's bytes. Otherwise, the value is a tuple of the info and a read-only numpy array of the item.
+        
+        In either case, the item is not copied out of the message it arrived in.
+        """
         if self.__splitting is not None:
             (string, itemsize, count, index) = self.__splitting
         else:
@@ -277,7 +284,7 @@ class _MessageSplitter(object):
             else:
                 message = queue.delete_head()
             if message.length() > 0:
-                string = message.to_string()  # only interface available
+                string = message.to_string()  # only interface available, and the only copy we make
             else:
                 string = ''  # avoid crash bug
             itemsize = int(message.arg1())
@@ -293,15 +300,15 @@ class _MessageSplitter(object):
         
         # extract value
         # TODO: this should be a separate concern, refactor
-        item_string = string[itemsize * index:itemsize * (index + 1)]
         if binary:
-            # In binary mode, pack info with already-binary data.
-            value = struct.pack(self.__type.get_info_format(), *self.__igetter()) + item_string
+            # In binary mode, pack info with already-binary data; the consumer is responsible for concatenating.
+            value = (self.__info_struct.pack(*self.__igetter()), buffer(string, itemsize * index, itemsize))
         else:
-            # In python-value mode, unpack binary data.
-            unpacker = array.array(self.__type.get_array_format())
-            unpacker.fromstring(item_string)
-            value = (self.__igetter(), unpacker.tolist())
+            # In python-value mode, view binary data as an array.
+            value = (self.__igetter(), numpy.frombuffer(string,
+                dtype=self.__dtype,
+                count=itemsize // self.__dtype.itemsize,
+                offset=itemsize * index))
         return value
 
 
@@ -511,7 +518,8 @@ class ExportedState(object):
     
     def state(self):
         # pylint: disable=attribute-defined-outside-init
-        if self.state_is_dynamic() or not hasattr(self, '_ExportedState__cache'):
+        # The cache of a dynamic object is discarded by state_shape_changed.
+        if getattr(self, '_ExportedState__cache', None) is None:
             cache = {}
             self.__cache = cache
             self.__setter_cells = {}
@@ -578,6 +586,9 @@ class ExportedState(object):
         
         if key is given, it is the key of the relevant cell; otherwise all cells are polled.
         """
+        if not hasattr(self, '_ExportedState__decorator_cells_cache'):
+            # state() has not yet been called, so no cells have been created, so there are no possible subscriptions to notify. Not creating them here keeps objects which no client has looked at small.
+            return
         state = self.state()
         if key is None:
             for cell in state.itervalues():
@@ -590,11 +601,17 @@ class ExportedState(object):
         
         This only applies to objects which return True from state_is_dynamic().
         """
-        new_state = self.state()
+        # pylint: disable=attribute-defined-outside-init
+        if getattr(self, '_ExportedState__cache', None) is not None:
+            self.__cache = None
         try:
             subscriptions = self.__shape_subscriptions
         except AttributeError:
             return
+        if not subscriptions:
+            # Don't rebuild the state until it is next asked for.
+            return
+        new_state = self.state()
         for subscription in subscriptions:
             subscription._fire(new_state)
     
@@ -676,12 +693,16 @@ nullExportedState = NullExportedState()
 
 
 class CellDict(object):
-    """A dictionary-like object which holds its contents in cells."""
+    """A dictionary-like object which holds its contents in cells.
+    
+    The cells are created only when get_cell is first called for their keys, so that a large collection which no client has looked at costs no more than a dict.
+    """
     
     def __init__(self, initial_state={}, dynamic=False, member_type=ReferenceT()):
         # pylint: disable=dangerous-default-value
         self.__member_type = member_type
-        self.__cells = {}
+        self.__values = {}
+        self.__cells = {}  # subset of the keys of __values
         self._shape_subscription = lambda: None
         
         self._dynamic = True
@@ -690,38 +711,37 @@ class CellDict(object):
         self._dynamic = dynamic
     
     def __len__(self):
-        return len(self.__cells)
+        return len(self.__values)
     
-    def __contains(self, key):
-        return key in self.__cells
+    def __contains__(self, key):
+        return key in self.__values
     
     def __getitem__(self, key):
-        return self.__cells[key].get()
+        return self.__values[key]
     
     def __setitem__(self, key, value):
-        if key in self.__cells:
-            self.__cells[key].set_internal(value)
+        if key in self.__values:
+            self.__values[key] = value
+            cell = self.__cells.get(key)
+            if cell is not None:
+                cell.set_internal(value)
         else:
             assert self._dynamic
-            self.__cells[key] = LooseCell(
-                key=key,
-                value=value,
-                type=self.__member_type,
-                persists=True,
-                writable=False)
+            self.__values[key] = value
             self._shape_subscription()
     
     def __delitem__(self, key):
         assert self._dynamic
-        if key in self.__cells:
-            del self.__cells[key]
+        if key in self.__values:
+            del self.__values[key]
+            self.__cells.pop(key, None)
             self._shape_subscription()
     
     def __iter__(self):
         return self.iterkeys()
     
     def iterkeys(self):
-        return self.__cells.iterkeys()
+        return self.__values.iterkeys()
     
     def itervalues(self):
         for key in self:
@@ -732,7 +752,15 @@ class CellDict(object):
             yield key, self[key]
     
     def get_cell(self, key):
-        return self.__cells[key]
+        cell = self.__cells.get(key)
+        if cell is None:
+            cell = self.__cells[key] = LooseCell(
+                key=key,
+                value=self.__values[key],
+                type=self.__member_type,
+                persists=True,
+                writable=False)
+        return cell
 
 
 class CollectionState(ExportedState):